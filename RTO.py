@@ -1,17 +1,55 @@
 import streamlit as st
-import pymysql
-from pymysql import IntegrityError
-import pandas as pd
-import time
+import os
 from datetime import datetime, timedelta
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
 import hashlib
+import html
+import json
 import secrets
-import re
-from typing import Optional, Dict, List
-import bcrypt
+import time
+from contextlib import nullcontext
+from operator import attrgetter
+from rto_core import (
+    WorkflowError, connect, ensure_schema, sanitize_input, authenticate, get_active_user,
+    update_registration_status, compute_registration_stats,
+    pending_registrations_query, owner_applications_query, recent_activity_query,
+    decided_registrations_query, compute_owner_summary, owner_stats_key, STATS_CACHE_KEY,
+    SESSION_COOKIE, SESSION_TTL, hand_off_session
+)
+from rto_cube import GRAINS, DIMENSIONS, ensure_cube_schema, query_cube, dimension_values
+from rto_sla import ensure_sla_schema, load_sketches, merge_percentiles
+from rto_status import (
+    CHASSIS_SUFFIX_LENGTH, LookupThrottled, client_address, lookup_status
+)
+from rto_cache import get_cache
+from rto_rows import Columns, fetch_columns
+from rto_explorer import (
+    FACET_DIMENSIONS, FILTER_COLUMNS, PAGE_SIZES, SORT_COLUMNS, ExplorerQuery,
+    export_columns, facet_counts, fetch_page, merge_facets, merge_pages
+)
+from rto_admission import Overloaded, admit, cached_or_stale, degraded_state
+from rto_budgets import BudgetExceeded, budget_stats, cap_rows, row_limit
+from rto_reports import REPORTS, list_versions, load_manifest, read_artifact
+from rto_catalog import canonicalize, ensure_catalog_schema, get_catalog
+from rto_fees import ensure_fee_schema, with_fee
+from rto_documents import (
+    DOC_TYPES, MAX_DOCUMENT_BYTES, DocumentError, attach_documents, ensure_documents_schema,
+    get_registration_documents, preview_images, schedule_processing, signed_url, store_upload
+)
+from rto_shards import (
+    SHARDS, create_sharded_registration, ensure_shards, gather_records, is_home,
+    merge_columns, merge_counts, merge_sorted, mirror_users, scatter, shard_for_reg_no, shard_for_state
+)
+from rto_memory import (
+    account_session, compare_snapshots, format_bytes, get_snapshot, is_tracing, ledger,
+    reset_peak, snapshot_labels, start_tracing, stop_tracing, take_snapshot, top_allocations,
+    traced_memory
+)
+from rto_spool import UNAVAILABLE, Replayer, Spool
+
+# pandas and plotly are imported inside the pages that draw tables and
+# charts, so the login page renders without loading them.
+
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'style.css')
 
 # --- Page Configuration with Enhanced UI ---
 st.set_page_config(
@@ -22,287 +60,92 @@ st.set_page_config(
 )
 
 # Enhanced custom CSS with animations and better styling
-st.markdown("""
-<style>
-    /* Main dark theme */
-    .stApp {
-        background: linear-gradient(135deg, #0f172a 0%, #1e293b 100%);
-        color: #e2e8f0;
-        font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-    }
-    
-    /* Status badges */
-    .status-badge {
-        padding: 4px 12px;
-        border-radius: 20px;
-        font-size: 12px;
-        font-weight: 600;
-        display: inline-block;
-        margin: 2px;
-    }
-    
-    .status-approved {
-        background: linear-gradient(90deg, #10b981, #34d399);
-        color: white;
-    }
-    
-    .status-pending {
-        background: linear-gradient(90deg, #f59e0b, #fbbf24);
-        color: white;
-    }
-    
-    .status-rejected {
-        background: linear-gradient(90deg, #ef4444, #f87171);
-        color: white;
-    }
-    
-    .status-verified {
-        background: linear-gradient(90deg, #3b82f6, #8b5cf6);
-        color: white;
-    }
-    
-    /* Enhanced cards */
-    .card {
-        background: rgba(30, 41, 59, 0.8);
-        border-radius: 15px;
-        padding: 20px;
-        margin: 10px 0;
-        border-left: 4px solid;
-        backdrop-filter: blur(10px);
-        transition: transform 0.3s ease, box-shadow 0.3s ease;
-    }
-    
-    .card:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 10px 25px rgba(0, 0, 0, 0.3);
-    }
-    
-    /* Toast notifications */
-    .toast-success {
-        background: linear-gradient(90deg, #10b981, #34d399) !important;
-        color: white !important;
-        border-radius: 10px !important;
-        border: none !important;
-    }
-    
-    .toast-warning {
-        background: linear-gradient(90deg, #f59e0b, #fbbf24) !important;
-        color: white !important;
-        border-radius: 10px !important;
-        border: none !important;
-    }
-    
-    /* Role-specific styling */
-    .role-badge {
-        padding: 3px 10px;
-        border-radius: 15px;
-        font-size: 11px;
-        font-weight: 600;
-        display: inline-block;
-        margin-left: 10px;
-    }
-    
-    .role-admin {
-        background: linear-gradient(90deg, #8b5cf6, #a78bfa);
-        color: white;
-    }
-    
-    .role-user {
-        background: linear-gradient(90deg, #3b82f6, #60a5fa);
-        color: white;
-    }
-    
-    .role-inspector {
-        background: linear-gradient(90deg, #10b981, #34d399);
-        color: white;
-    }
-    
-    /* Form styling */
-    .required-field::after {
-        content: " *";
-        color: #ef4444;
-    }
-    
-    /* Animation classes */
-    @keyframes fadeIn {
-        from { opacity: 0; transform: translateY(10px); }
-        to { opacity: 1; transform: translateY(0); }
-    }
-    
-    @keyframes slideIn {
-        from { transform: translateX(-20px); opacity: 0; }
-        to { transform: translateX(0); opacity: 1; }
-    }
-    
-    @keyframes pulse {
-        0% { transform: scale(1); }
-        50% { transform: scale(1.05); }
-        100% { transform: scale(1); }
-    }
-    
-    .fade-in {
-        animation: fadeIn 0.5s ease-out;
-    }
-    
-    .slide-in {
-        animation: slideIn 0.4s ease-out;
-    }
-    
-    .pulse-animation {
-        animation: pulse 2s infinite;
-    }
-</style>
-""", unsafe_allow_html=True)
-
-# --- Database Configuration & Security ---
-DB_HOST = "localhost"
-DB_USER = "root"
-DB_PASSWORD = "P@sahu15"
-DB_NAME = "rto_vehicle_system"
-
-# --- Security Functions ---
-def hash_password(password: str) -> str:
-    """Hash password using bcrypt"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
-
-def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+@st.cache_resource
+def load_css() -> str:
+    """Read the stylesheet once per process"""
+    with open(CSS_PATH, encoding='utf-8') as f:
+        return f"<style>\n{f.read()}</style>"
 
-def sanitize_input(text: str) -> str:
-    """Basic input sanitization"""
-    return re.sub(r'[<>"\']', '', text).strip()
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # --- Database Connection & Schema Setup ---
 @st.cache_resource
 def get_db_connection():
     """Establishes and caches the database connection."""
+    return connect()
+
+def open_db_connection():
+    """The cached connection, or None while the database is unreachable"""
     try:
-        conn = pymysql.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        return conn
-    except Exception as e:
-        st.error(f"Error connecting to database: {e}")
-        st.stop()
+        db = get_db_connection()
+        db.ping(reconnect=True)
+        return db
+    except UNAVAILABLE:
+        return None
+
+@st.cache_resource
+def get_spool() -> Spool:
+    """This process's spool, with a thread that replays it once the database is back"""
+    spool = Spool()
+    Replayer(spool, on_finished=lambda entries: schedule_processing([
+        blob for entry in entries if entry['kind'] in ('submission', 'documents') and entry['state'] == 'applied'
+        for blob, _ in entry['payload']['documents'].values()
+    ])).start()
+    return spool
 
-def setup_database_schema():
+def setup_database_schema() -> bool:
     """Create all necessary tables with proper schema design."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Users table for authentication and roles
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INT AUTO_INCREMENT PRIMARY KEY,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                password_hash VARCHAR(255) NOT NULL,
-                full_name VARCHAR(100) NOT NULL,
-                email VARCHAR(100),
-                phone VARCHAR(15),
-                role ENUM('admin', 'user', 'inspector') DEFAULT 'user',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE
-            )
-        """)
-        
-        # Vehicles table with comprehensive details
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS vehicles (
-                vehicle_id INT AUTO_INCREMENT PRIMARY KEY,
-                engine_no VARCHAR(50) UNIQUE NOT NULL,
-                chassis_no VARCHAR(50) UNIQUE NOT NULL,
-                manufacturer VARCHAR(100) NOT NULL,
-                model VARCHAR(100) NOT NULL,
-                vehicle_type ENUM('2-wheeler', '3-wheeler', '4-wheeler', 'commercial', 'other') NOT NULL,
-                fuel_type ENUM('petrol', 'diesel', 'electric', 'cng', 'hybrid') NOT NULL,
-                color VARCHAR(50),
-                manufacturing_year YEAR,
-                seating_capacity INT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Registrations table with status tracking
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS registrations (
-                registration_id INT AUTO_INCREMENT PRIMARY KEY,
-                reg_no VARCHAR(20) UNIQUE NOT NULL,
-                vehicle_id INT,
-                owner_id INT,
-                state VARCHAR(50) NOT NULL,
-                district VARCHAR(50) NOT NULL,
-                application_date DATE NOT NULL,
-                registration_date DATE,
-                status ENUM('pending', 'approved', 'rejected', 'verified') DEFAULT 'pending',
-                status_updated_by INT,
-                status_updated_at TIMESTAMP,
-                remarks TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (vehicle_id) REFERENCES vehicles(vehicle_id),
-                FOREIGN KEY (owner_id) REFERENCES users(user_id),
-                FOREIGN KEY (status_updated_by) REFERENCES users(user_id)
-            )
-        """)
-        
-        # Payment tracking (optional)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS payments (
-                payment_id INT AUTO_INCREMENT PRIMARY KEY,
-                registration_id INT,
-                amount DECIMAL(10, 2) NOT NULL,
-                payment_mode ENUM('online', 'cash', 'cheque') NOT NULL,
-                transaction_id VARCHAR(100),
-                payment_status ENUM('pending', 'completed', 'failed') DEFAULT 'pending',
-                payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (registration_id) REFERENCES registrations(registration_id)
-            )
-        """)
-        
-        # Audit logs for security
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS audit_logs (
-                log_id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT,
-                action VARCHAR(100) NOT NULL,
-                table_name VARCHAR(50),
-                record_id INT,
-                old_values TEXT,
-                new_values TEXT,
-                ip_address VARCHAR(45),
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(user_id)
-            )
-        """)
-        
-        conn.commit()
-        
-        # Create default admin user if not exists
-        cursor.execute("SELECT * FROM users WHERE username = 'admin'")
-        if not cursor.fetchone():
-            admin_hash = hash_password("admin@123")
-            cursor.execute("""
-                INSERT INTO users (username, password_hash, full_name, role) 
-                VALUES ('admin', %s, 'System Administrator', 'admin')
-            """, (admin_hash,))
-            conn.commit()
-            
+        ensure_schema(get_db_connection())
+        ensure_cube_schema(get_db_connection())
+        ensure_sla_schema(get_db_connection())
+        ensure_documents_schema(get_db_connection())
+        ensure_catalog_schema(get_db_connection())
+        ensure_fee_schema(get_db_connection())
+        ensure_shards(get_db_connection(), ensure_schema, ensure_cube_schema,
+                      ensure_sla_schema, ensure_documents_schema)
+        return True
     except Exception as e:
         st.error(f"Error setting up database schema: {e}")
-    finally:
-        cursor.close()
+        return False
+
+def shard_opener(budget: str = 'page'):
+    """open_conn for rto_shards.scatter: a connection from the budget's admission pool per shard"""
+    return lambda shard: admit(budget, shard)
+
+def home_connection(shard: str, db):
+    """The home database next to db, a connection to shard: db itself, or one from the critical pool"""
+    return nullcontext(db) if is_home(shard) else admit('critical')
 
-# Initialize database
-conn = get_db_connection()
-setup_database_schema()
+def on_all_shards(fn, pass_shard: bool = False, budget: str = 'page') -> list:
+    """fn(conn) on every shard in parallel, results in shard order"""
+    return list(scatter(fn, open_conn=shard_opener(budget), pass_shard=pass_shard).values())
+
+def fetch_within_budget(budget: str, fetch, empty):
+    """fetch() under a query budget, cut to its row cap; says so on the page when either bites"""
+    try:
+        rows = fetch()
+    except BudgetExceeded as e:
+        st.error(f"⏱️ {e}")
+        return empty
+    except Overloaded as e:
+        st.warning(f"⏳ {e}. Please try again in a moment.")
+        return empty
+    rows, truncated = cap_rows(budget, rows)
+    if truncated:
+        st.caption(f"Showing the first {len(rows):,} only. Narrow the filters to see the rest.")
+    return rows
+
+@st.cache_resource
+def bootstrap_database() -> bool:
+    """Run schema setup once per process instead of on every rerun"""
+    return setup_database_schema()
+
+# Initialize database; while it is unreachable, intake goes to the local spool
+conn = open_db_connection()
+spool = get_spool()
+if conn is not None and not bootstrap_database():
+    bootstrap_database.clear()  # retry on the next rerun
 
 # --- Session State Management ---
 if 'user' not in st.session_state:
@@ -311,56 +154,133 @@ if 'current_role' not in st.session_state:
     st.session_state.current_role = 'guest'
 if 'show_toast' not in st.session_state:
     st.session_state.show_toast = None
+if 'show_balloons' not in st.session_state:
+    st.session_state.show_balloons = False
+if 'submission_key' not in st.session_state:
+    st.session_state.submission_key = secrets.token_hex(16)
+if 'memory_id' not in st.session_state:
+    st.session_state.memory_id = secrets.token_hex(8)
+if 'session_token' not in st.session_state:
+    st.session_state.session_token = None
+    st.session_state.user_checked_at = 0.0
+    st.session_state.pending_cookie = None
+
+STATS_TTL = 60  # seconds; writes invalidate the cached stats sooner
+NOT_IN_CATALOG = "Other (not listed)"
+RECENT_ACTIVITY_TTL = 15
+ANALYTICS_TTL = 60  # seconds the Analytics page reuses a cube slice or SLA summary
+OWNER_STATS_TTL = 600  # seconds; changes to the owner's registrations invalidate it sooner
+OWNER_LATEST_APPLICATIONS = 5
+# How far an application is through the workflow, for the owner dashboard
+STATUS_PROGRESS = {
+    'pending': (1 / 3, "Submitted, awaiting verification"),
+    'verified': (2 / 3, "Verified, awaiting approval"),
+    'approved': (1.0, "Approved"),
+    'rejected': (1.0, "Rejected"),
+}
+SESSION_RECHECK = 60  # seconds between checks that the signed-in account is still active
+# The API's /session endpoints, which set and clear the HttpOnly session cookie
+SESSION_URL = os.environ.get("RTO_SESSION_URL", "http://localhost:8000/session")
+SESSION_USER_FIELDS = ('user_id', 'username', 'full_name', 'role', 'email', 'phone')
+# Rebuilt on demand if trimmed for memory: the prepared CSV export, and the
+# explorer's page cursors (the explorer starts again from its first page)
+DROPPABLE_SESSION_KEYS = ('explorer_export', 'explorer_cursors', 'explorer_view')
 
 def show_toast(message: str, type: str = "success"):
     """Display toast notification"""
     st.session_state.show_toast = (message, type)
 
 # --- Authentication Module ---
+def session_user(user: dict) -> dict:
+    """The fields of a users row kept in the session; never the password hash"""
+    return {field: user.get(field) for field in SESSION_USER_FIELDS}
+
+def write_session_cookie():
+    """Send the browser through the API to set or clear the session cookie queued by login or logout.
+
+    Page scripts cannot set an HttpOnly cookie, so the API does it and
+    redirects back. The URL carries a one-time code, never the token.
+    """
+    token = st.session_state.pending_cookie
+    if token is None:
+        return
+    import streamlit.components.v1 as components
+    st.session_state.pending_cookie = None
+    url = f"{SESSION_URL}/{'start' if token else 'end'}?code={hand_off_session(token)}"
+    components.html(f"<script>parent.location.replace({json.dumps(url)});</script>", height=0)
+
+def start_session(user: dict):
+    """Sign user in under a fresh token; any token this browser had before stops working"""
+    end_session()
+    user = session_user(user)
+    st.session_state.user = user
+    st.session_state.current_role = user['role']
+    st.session_state.user_checked_at = time.time()
+    # Any replica can resume this login from the shared session store
+    token = secrets.token_urlsafe(32)
+    get_cache().set(f"session:{token}", user, SESSION_TTL)
+    st.session_state.session_token = token
+    st.session_state.pending_cookie = token
+
+def end_session():
+    """Drop the current login and its token, and clear the browser's cookie"""
+    for token in {st.session_state.session_token, st.context.cookies.get(SESSION_COOKIE)}:
+        if token:
+            get_cache().invalidate(f"session:{token}")
+            st.session_state.pending_cookie = ''
+    st.session_state.session_token = None
+    st.session_state.user = None
+    st.session_state.current_role = 'guest'
+
 def login(username: str, password: str) -> bool:
     """Authenticate user"""
-    cursor = conn.cursor()
+    with admit('critical') as db:
+        user = authenticate(db, username, password)
+    if user:
+        start_session(user)
+        show_toast(f"Welcome back, {user['full_name']}!", "success")
+        return True
+    return False
+
+def restore_session():
+    """Resume a login made on any replica from the session cookie.
+
+    The account is looked up again every SESSION_RECHECK seconds, so a
+    deactivated user is signed out and a role change applies at once.
+    """
+    if not st.session_state.user:
+        token = st.context.cookies.get(SESSION_COOKIE)
+        user = get_cache().get(f"session:{token}") if token else None
+        if not user:
+            return
+        st.session_state.session_token = token
+        st.session_state.user = session_user(user)
+        st.session_state.current_role = user['role']
+        st.session_state.user_checked_at = 0.0
+    if conn is None or time.time() - st.session_state.user_checked_at < SESSION_RECHECK:
+        return  # while the database is down the last check stands
     try:
-        cursor.execute("SELECT * FROM users WHERE username = %s AND is_active = TRUE", (username,))
-        user = cursor.fetchone()
-        
-        if user and verify_password(password, user['password_hash']):
-            st.session_state.user = user
-            st.session_state.current_role = user['role']
-            show_toast(f"Welcome back, {user['full_name']}!", "success")
-            return True
-        return False
-    finally:
-        cursor.close()
+        with admit('critical') as db:
+            row = get_active_user(db, st.session_state.user['user_id'])
+    except (Overloaded, BudgetExceeded, *UNAVAILABLE):
+        return
+    if row is None:
+        end_session()
+        st.warning("Your account is no longer active. Please contact the RTO office.")
+        return
+    user = session_user(row)
+    st.session_state.user = user
+    st.session_state.current_role = user['role']
+    st.session_state.user_checked_at = time.time()
+    get_cache().set(f"session:{st.session_state.session_token}", user, SESSION_TTL)
 
 def logout():
     """Logout current user"""
-    st.session_state.user = None
-    st.session_state.current_role = 'guest'
+    end_session()
+    ledger.forget(st.session_state.memory_id)
     st.rerun()
 
 # --- Helper Functions ---
-def generate_registration_number(state: str) -> str:
-    """Generate unique registration number"""
-    cursor = conn.cursor()
-    try:
-        # Get state code (first two letters)
-        state_code = state[:2].upper()
-        
-        # Get sequential number
-        cursor.execute("""
-            SELECT COUNT(*) as count FROM registrations 
-            WHERE state LIKE %s AND YEAR(application_date) = YEAR(CURDATE())
-        """, (f"{state_code}%",))
-        count = cursor.fetchone()['count'] + 1
-        
-        # Format: StateCode-SeriesNumber-UniqueNumber
-        series = datetime.now().strftime('%y')
-        unique_num = str(count).zfill(4)
-        return f"{state_code}{series}{unique_num}"
-    finally:
-        cursor.close()
-
 def get_status_badge(status: str) -> str:
     """Return HTML for status badge"""
     badges = {
@@ -380,116 +300,262 @@ def get_role_badge(role: str) -> str:
     }
     return f'<span class="role-badge {badges.get(role, "role-user")}">{role.upper()}</span>'
 
+def get_staleness_badge(age: float) -> str:
+    """Return HTML for the badge shown on figures served from the last known values"""
+    if age == float('inf'):
+        label = "UNAVAILABLE"
+    else:
+        minutes = int(age // 60)
+        label = f"{minutes} MIN OLD" if minutes else "<1 MIN OLD"
+    return f'<span class="status-badge status-pending" title="Database busy, showing cached figures">⏳ {label}</span>'
+
 # --- CRUD Operations ---
-def add_vehicle_registration(vehicle_data: dict, owner_id: int) -> tuple:
-    """Add new vehicle registration"""
-    cursor = conn.cursor()
+def add_vehicle_registration(vehicle_data: dict, owner_id: int, uploads: dict) -> tuple:
+    """Add new vehicle registration with its documents ({doc_type: uploaded file})"""
     try:
-        # Check for duplicate engine/chassis numbers
-        cursor.execute("SELECT * FROM vehicles WHERE engine_no = %s OR chassis_no = %s", 
-                      (vehicle_data['engine_no'], vehicle_data['chassis_no']))
-        if cursor.fetchone():
-            show_toast("Error: Engine or Chassis number already exists!", "warning")
-            return False, None
-        
-        # Insert vehicle details
-        cursor.execute("""
-            INSERT INTO vehicles (engine_no, chassis_no, manufacturer, model, 
-            vehicle_type, fuel_type, color, manufacturing_year, seating_capacity)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            vehicle_data['engine_no'], vehicle_data['chassis_no'],
-            vehicle_data['manufacturer'], vehicle_data['model'],
-            vehicle_data['vehicle_type'], vehicle_data['fuel_type'],
-            vehicle_data['color'], vehicle_data['manufacturing_year'],
-            vehicle_data['seating_capacity']
-        ))
-        
-        vehicle_id = cursor.lastrowid
-        
-        # Generate registration number
-        reg_no = generate_registration_number(vehicle_data['state'])
-        
-        # Insert registration
-        cursor.execute("""
-            INSERT INTO registrations (reg_no, vehicle_id, owner_id, state, district,
-            application_date, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """, (
-            reg_no, vehicle_id, owner_id,
-            vehicle_data['state'], vehicle_data['district'],
-            datetime.now().date(), 'pending'
-        ))
-        
-        conn.commit()
-        show_toast(f"Registration submitted successfully! Reference: {reg_no}", "success")
-        return True, reg_no
-        
-    except IntegrityError as e:
-        conn.rollback()
-        show_toast("Database error: Please try again.", "warning")
+        # Files go to the document store first; the database only gets their hashes
+        documents = {doc_type: (store_upload(upload), upload.name) for doc_type, upload in uploads.items()}
+        if conn is None:
+            return spool_registration(vehicle_data, owner_id, documents)
+        # Re-submits of the same form (double clicks, retries) reuse the key
+        shard = shard_for_state(vehicle_data['state'], write=True)
+        with admit('write', shard) as db, home_connection(shard, db) as home:
+            mirror_users(home, shard, db, [owner_id])
+            reg_no = create_sharded_registration(home, db, vehicle_data, owner_id,
+                                                 st.session_state.submission_key)
+            try:
+                attach_documents(db, reg_no, documents, owner_id)
+                attach_error = None
+            except Exception as e:  # the registration is saved either way; the spool retries the links
+                attach_error = e
+        if attach_error is not None:
+            spool.add_documents(reg_no, owner_id, documents)
+    except (WorkflowError, DocumentError) as e:
+        show_toast(f"Error: {e}", "warning")
         return False, None
-    finally:
-        cursor.close()
+    except Overloaded:
+        show_toast("The system is busy, your registration was not submitted. Please try again.", "warning")
+        return False, None
+    except UNAVAILABLE:
+        # The replay reuses the submission key, so an attempt that did commit is not doubled
+        return spool_registration(vehicle_data, owner_id, documents)
+    schedule_processing([blob for blob, _ in documents.values()])
+    st.session_state.submission_key = secrets.token_hex(16)
+    fee = f" Fee due: ₹{vehicle_data['fee']:,.2f}" if vehicle_data.get('fee') is not None else ""
+    if attach_error is not None:
+        show_toast(f"Registration submitted! Reference: {reg_no}.{fee} Your documents were saved and will be "
+                   f"attached to it shortly.", "warning")
+    else:
+        show_toast(f"Registration submitted successfully! Reference: {reg_no}.{fee}", "success")
+    return True, reg_no
+
+def spool_registration(vehicle_data: dict, owner_id: int, documents: dict) -> tuple:
+    """Queue a submission locally while the database is down; returns (True, provisional reference)"""
+    ref = spool.add_submission(vehicle_data, owner_id, st.session_state.submission_key, documents)
+    st.session_state.submission_key = secrets.token_hex(16)
+    show_toast(f"The database is unavailable, so your registration was queued and will be submitted "
+               f"automatically. Provisional reference: {ref}", "success")
+    return True, ref
+
+def change_registration_status(registration_id: int, reg_no: str, status: str,
+                               remarks: str = None) -> bool:
+    """Apply a status change as the current admin; False if it could not be saved right now"""
+    try:
+        shard = shard_for_reg_no(reg_no, write=True)
+        with admit('write', shard) as db, home_connection(shard, db) as home:
+            mirror_users(home, shard, db, [st.session_state.user['user_id']])
+            update_registration_status(db, registration_id, status,
+                                       st.session_state.user['user_id'], remarks)
+    except WorkflowError as e:
+        show_toast(f"Error: {e}", "warning")
+        return False
+    except Overloaded:
+        show_toast("The system is busy, the change was not saved. Please try again.", "warning")
+        return False
+    except UNAVAILABLE:
+        spool.add_status_change(registration_id, reg_no, status, st.session_state.user['user_id'], remarks)
+        show_toast(f"The database is unavailable. Marking {reg_no} {status} was queued "
+                   f"and will be applied when it is back.", "warning")
+        return False
+    return True
+
+def show_spooled_applications(owner_id: int):
+    """Submissions this replica queued for the owner while the database was down"""
+    entries = [entry for entry in spool.entries(actor_id=owner_id, limit=20) if entry['kind'] == 'submission']
+    if not entries:
+        return
+    labels = {'queued': "⏳ Waiting for the database", 'claimed': "⏳ Submitting",
+              'applied': "✅ Submitted", 'conflict': "❌ Not accepted", 'failed': "❌ Not accepted"}
+    st.subheader("🕓 Submitted During an Outage")
+    for entry in entries:
+        vehicle = entry['payload']['vehicle_data']
+        outcome = f"Registration number: **{entry['result']}**" if entry['result'] else (entry['error'] or "")
+        st.markdown(f"**{entry['ref']}** · {html.escape(vehicle['manufacturer'])} {html.escape(vehicle['model'])} "
+                    f"· {labels[entry['state']]}  \n{html.escape(outcome)}")
+
+def show_registration_documents(registration_id: int, shard: str):
+    """Thumbnails and page previews of a registration's documents"""
+    try:
+        with admit('page', shard) as db:
+            documents = get_registration_documents(db, registration_id)
+    except Overloaded as e:
+        st.warning(f"⏳ {e}. Please try again in a moment.")
+        return
+    if not documents:
+        st.info("No documents were uploaded with this application")
+        return
+    for col, document in zip(st.columns(len(documents)), documents):
+        with col:
+            st.markdown(f"**{DOC_TYPES.get(document['doc_type'], document['doc_type'])}**")
+            st.caption(f"{html.escape(document['original_name'] or '')} · "
+                       f"{document['size_bytes'] / 2**20:.1f} MB"
+                       + (f" · {document['page_count']} pages" if document['page_count'] else ""))
+            previews = preview_images(document['sha256'])
+            if previews['pages']:
+                page = 1
+                if len(previews['pages']) > 1:
+                    page = st.select_slider("Page", range(1, len(previews['pages']) + 1),
+                                            key=f"page_{registration_id}_{document['doc_type']}")
+                st.image(previews['pages'][page - 1], use_container_width=True)
+            elif previews['thumbnail']:
+                st.image(previews['thumbnail'], use_container_width=True)
+            elif document['processed_at'] is None:
+                st.caption("⏳ Preview is being prepared")
+            else:
+                st.caption("No preview available")
+            st.markdown(f"[Open original]({signed_url(document['sha256'])})")
 
 # --- Analytics Functions ---
-def get_registration_stats() -> dict:
-    """Get comprehensive registration statistics"""
-    cursor = conn.cursor()
+def get_registration_stats() -> tuple:
+    """Registration statistics shared through the cache, and their age if served stale"""
     try:
-        stats = {}
-        
-        # Basic counts
-        cursor.execute("SELECT COUNT(*) as total FROM registrations")
-        stats['total'] = cursor.fetchone()['total']
-        
-        cursor.execute("SELECT COUNT(*) as pending FROM registrations WHERE status = 'pending'")
-        stats['pending'] = cursor.fetchone()['pending']
-        
-        cursor.execute("SELECT COUNT(*) as approved FROM registrations WHERE status = 'approved'")
-        stats['approved'] = cursor.fetchone()['approved']
-        
-        # Monthly registrations
-        cursor.execute("""
-            SELECT DATE_FORMAT(application_date, '%Y-%m') as month, 
-                   COUNT(*) as count
-            FROM registrations
-            WHERE application_date >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH)
-            GROUP BY month
-            ORDER BY month
-        """)
-        stats['monthly'] = cursor.fetchall()
-        
-        # Vehicle type distribution
-        cursor.execute("""
-            SELECT v.vehicle_type, COUNT(*) as count
-            FROM vehicles v
-            JOIN registrations r ON v.vehicle_id = r.vehicle_id
-            GROUP BY v.vehicle_type
-        """)
-        stats['vehicle_types'] = cursor.fetchall()
-        
-        # Fuel type analysis
-        cursor.execute("""
-            SELECT v.fuel_type, COUNT(*) as count
-            FROM vehicles v
-            JOIN registrations r ON v.vehicle_id = r.vehicle_id
-            GROUP BY v.fuel_type
-        """)
-        stats['fuel_types'] = cursor.fetchall()
-        
-        # Approval rate
-        cursor.execute("""
-            SELECT 
-                SUM(CASE WHEN status = 'approved' THEN 1 ELSE 0 END) / COUNT(*) * 100 as approval_rate
-            FROM registrations
-            WHERE status IN ('approved', 'rejected')
-        """)
-        stats['approval_rate'] = cursor.fetchone()['approval_rate'] or 0
-        
-        return stats
-    finally:
-        cursor.close()
+        return cached_or_stale(STATS_CACHE_KEY, STATS_TTL, compute_registration_stats,
+                               merge_registration_stats)
+    except (Overloaded, BudgetExceeded):
+        return {'total': 0, 'pending': 0, 'approved': 0, 'monthly': [],
+                'vehicle_types': [], 'fuel_types': [], 'approval_rate': 0}, float('inf')
+
+def merge_registration_stats(parts: list) -> dict:
+    """Per-shard statistics combined into system-wide figures"""
+    stats = {key: sum(part[key] for part in parts) for key in ('total', 'pending', 'approved', 'decided')}
+    stats['monthly'] = merge_counts([part['monthly'] for part in parts], ['month'])
+    stats['vehicle_types'] = merge_counts([part['vehicle_types'] for part in parts], ['vehicle_type'])
+    stats['fuel_types'] = merge_counts([part['fuel_types'] for part in parts], ['fuel_type'])
+    stats['approval_rate'] = stats['approved'] / stats['decided'] * 100 if stats['decided'] else 0
+    return stats
+
+def get_owner_summary(owner_id: int) -> tuple:
+    """One owner's status counts and latest applications, cached per owner, and their age if stale"""
+    try:
+        return cached_or_stale(owner_stats_key(owner_id), OWNER_STATS_TTL,
+                               lambda db: compute_owner_summary(db, owner_id, OWNER_LATEST_APPLICATIONS),
+                               merge_owner_summary)
+    except (Overloaded, BudgetExceeded):
+        return {'counts': {'total': 0, 'pending': 0, 'verified': 0, 'approved': 0, 'rejected': 0},
+                'latest': []}, float('inf')
+
+def merge_owner_summary(parts: list) -> dict:
+    """Per-shard owner summaries combined; an owner may have registered in several states"""
+    counts = {key: sum(part['counts'][key] for part in parts) for key in parts[0]['counts']}
+    latest = merge_sorted([part['latest'] for part in parts],
+                          key=lambda row: (row['application_date'], row['registration_id']),
+                          reverse=True, limit=OWNER_LATEST_APPLICATIONS)
+    return {'counts': counts, 'latest': latest}
+
+def compute_recent_activity(db) -> Columns:
+    """Latest registrations of one shard for the dashboard"""
+    return fetch_columns(db, *recent_activity_query())
+
+def merge_recent_activity(parts: list) -> Columns:
+    """The latest registrations across shards"""
+    return merge_columns(parts, 'created_at', reverse=True, limit=10).drop('created_at')
+
+def analytics_query(name: str, args: tuple, compute, merge, empty):
+    """merge of compute(conn) on every shard, cached and admitted as analytics.
+
+    Serves the last known value with its age while degraded, and empty with
+    a note when there is none.
+    """
+    key = f"analytics:{name}:{hashlib.sha256(repr(args).encode()).hexdigest()}"
+    try:
+        value, age = cached_or_stale(key, ANALYTICS_TTL, compute, merge, query_class='analytics')
+    except (Overloaded, BudgetExceeded) as e:
+        st.warning(f"⏳ {e}")
+        return empty
+    if age is not None:
+        st.markdown(get_staleness_badge(age), unsafe_allow_html=True)
+    return value
+
+def cube_counts(grain: str, date_from, date_to, filters: dict,
+                group_by: str = None, by_period: bool = True) -> list:
+    """Registration cube slice summed over every shard"""
+    keys = (['period_start'] if by_period else []) + ([group_by] if group_by else [])
+    return analytics_query(
+        'cube', (grain, date_from, date_to, sorted(filters.items()), group_by, by_period),
+        lambda db: query_cube(db, grain, date_from, date_to, filters, group_by, by_period),
+        lambda parts: merge_counts(parts, keys), [])
+
+def cube_dimension_values(dimension: str, filters: dict) -> list:
+    """Drill-down values of a cube dimension present on any shard"""
+    return analytics_query(
+        'dimension', (dimension, sorted(filters.items())),
+        lambda db: dimension_values(db, dimension, filters),
+        lambda parts: sorted(set().union(*parts)), [])
+
+def sla_summary(date_from, date_to, filters: dict, group_by: str = None) -> list:
+    """Turnaround percentiles from the SLA sketches of every shard"""
+    return analytics_query(
+        'sla', (date_from, date_to, filters['state'], filters['district'], group_by),
+        lambda db: load_sketches(db, date_from, date_to, filters['state'], filters['district']),
+        lambda parts: merge_percentiles(parts, group_by), [])
+
+# --- Status Tracking ---
+def get_client_id() -> str:
+    """Client identity for rate limiting: the caller's address, as far as trusted proxies report it"""
+    address = client_address(getattr(st.context, 'ip_address', None),
+                             st.context.headers.get('X-Forwarded-For'))
+    if address:
+        return address
+    # Streamlit versions without st.context.ip_address; the per-reg_no limit still applies
+    if 'client_id' not in st.session_state:
+        st.session_state.client_id = secrets.token_hex(8)
+    return st.session_state.client_id
+
+def show_track_status():
+    """Public status lookup by registration number and chassis number"""
+    st.caption(f"Enter your registration number and the last {CHASSIS_SUFFIX_LENGTH} characters of the chassis number")
+    col_track1, col_track2 = st.columns(2)
+    with col_track1:
+        reg_no = st.text_input("Registration Number", key="track_reg_no")
+    with col_track2:
+        chassis_suffix = st.text_input("Chassis Number (last characters)", key="track_chassis",
+                                       max_chars=CHASSIS_SUFFIX_LENGTH)
+    
+    if st.button("🔎 Check Status", use_container_width=True, key="track_button"):
+        if not reg_no or not chassis_suffix:
+            st.warning("Please enter both fields")
+            return
+        try:
+            shard = shard_for_reg_no(reg_no)
+            with admit('page', shard) as db:
+                record = lookup_status(db, reg_no, chassis_suffix, get_client_id())
+        except (LookupThrottled, Overloaded) as e:
+            st.warning(str(e))
+            return
+        
+        if record:
+            st.markdown(f"""
+                <div class="card">
+                    <h4>{record['reg_no']} {get_status_badge(record['status'])}</h4>
+                    <small>Applied: {record['application_date']} | 
+                    {record['district']}, {record['state']}<br>
+                    {f"Registered: {record['registration_date']}" if record['registration_date'] else ""}
+                    {f"Remarks: {html.escape(record['remarks'])}" if record['remarks'] else ""}
+                    </small>
+                </div>
+            """, unsafe_allow_html=True)
+        else:
+            st.error("No registration matches these details")
 
 # --- Login Page ---
 def show_login_page():
@@ -504,17 +570,22 @@ def show_login_page():
         with st.container():
             st.markdown('<div class="card">', unsafe_allow_html=True)
             
-            login_tab, register_tab = st.tabs(["🔐 Login", "📝 Register"])
+            login_tab, register_tab, track_tab = st.tabs(["🔐 Login", "📝 Register", "🔎 Track Status"])
             
             with login_tab:
                 username = st.text_input("Username", key="login_username")
                 password = st.text_input("Password", type="password", key="login_password")
                 
                 if st.button("Login", type="primary", use_container_width=True):
-                    if login(username, password):
-                        st.rerun()
+                    try:
+                        logged_in = login(username, password)
+                    except (Overloaded, BudgetExceeded):
+                        st.warning("The system is busy right now, please try again in a moment")
                     else:
-                        st.error("Invalid username or password")
+                        if logged_in:
+                            st.rerun()
+                        else:
+                            st.error("Invalid username or password")
             
             with register_tab:
                 st.info("Note: User registrations require admin approval")
@@ -528,6 +599,9 @@ def show_login_page():
                     # Simplified registration - in production, would send for approval
                     st.info("Registration functionality would be implemented with admin approval workflow")
             
+            with track_tab:
+                show_track_status()
+            
             st.markdown('</div>', unsafe_allow_html=True)
     
     st.markdown('</div>', unsafe_allow_html=True)
@@ -535,6 +609,8 @@ def show_login_page():
 # --- Main Application ---
 def main_app():
     """Main application after login"""
+    traced_before = traced_memory()
+    reset_peak()
     
     # --- Sidebar ---
     with st.sidebar:
@@ -554,23 +630,40 @@ def main_app():
         st.markdown("---")
         st.subheader("📱 Navigation")
         
-        if st.session_state.current_role == 'admin':
-            menu_options = ["Dashboard", "Approve Registrations", "Manage Users", "Analytics", "System Logs"]
+        if conn is None:
+            # Only intake keeps working until the database is back
+            menu_options = ["New Registration"] if st.session_state.current_role == 'user' else []
+        elif st.session_state.current_role == 'admin':
+            menu_options = ["Dashboard", "Approve Registrations", "Registration Explorer", "Manage Users", "Analytics", "System Logs"]
         elif st.session_state.current_role == 'inspector':
             menu_options = ["Dashboard", "Verify Vehicles", "My Inspections", "Reports"]
         else:  # user
             menu_options = ["Dashboard", "New Registration", "My Applications", "Track Status"]
         
-        selected_menu = st.radio("", menu_options, label_visibility="collapsed")
+        selected_menu = st.radio("", menu_options, label_visibility="collapsed") if menu_options else None
         
-        # Statistics
-        st.markdown("---")
-        st.subheader("📊 Quick Stats")
-        
-        stats = get_registration_stats()
-        st.metric("Total Registrations", stats['total'])
-        st.metric("Pending Approvals", stats['pending'])
-        st.metric("Approval Rate", f"{stats['approval_rate']:.1f}%")
+        # Statistics: citizens only see their own, and never pay for the global figures
+        if conn is not None and st.session_state.current_role == 'user':
+            st.markdown("---")
+            st.subheader("📊 My Applications")
+            
+            summary, summary_age = get_owner_summary(user['user_id'])
+            if summary_age is not None:
+                st.markdown(get_staleness_badge(summary_age), unsafe_allow_html=True)
+            counts = summary['counts']
+            st.metric("Submitted", counts['total'])
+            st.metric("In Progress", counts['pending'] + counts['verified'])
+            st.metric("Approved", counts['approved'])
+        elif conn is not None:
+            st.markdown("---")
+            st.subheader("📊 Quick Stats")
+            
+            stats, stats_age = get_registration_stats()
+            if stats_age is not None:
+                st.markdown(get_staleness_badge(stats_age), unsafe_allow_html=True)
+            st.metric("Total Registrations", stats['total'])
+            st.metric("Pending Approvals", stats['pending'])
+            st.metric("Approval Rate", f"{stats['approval_rate']:.1f}%")
         
         # Logout button
         st.markdown("---")
@@ -589,11 +682,66 @@ def main_app():
         else:
             st.warning(message)
         st.session_state.show_toast = None
+    if st.session_state.show_balloons:
+        st.balloons()
+        st.session_state.show_balloons = False
+    if conn is None:
+        backlog = spool.backlog()
+        st.warning("⚠️ The database is unavailable right now. "
+                   + ("New registrations are still accepted and will be submitted automatically once it is back."
+                      if st.session_state.current_role == 'user'
+                      else "Approvals and reports will be available again once it is back.")
+                   + (f" {backlog} queued operations are waiting on this server." if backlog else ""))
+    
+    # --- Dashboard Tab (for users: their own applications only) ---
+    if selected_menu == "Dashboard" and st.session_state.current_role == 'user':
+        st.markdown('<div class="fade-in">', unsafe_allow_html=True)
+        
+        counts = summary['counts']
+        col1, col2, col3, col4 = st.columns(4)
+        for col, (label, value) in zip((col1, col2, col3, col4), (
+                ("My Applications", counts['total']),
+                ("In Progress", counts['pending'] + counts['verified']),
+                ("Approved", counts['approved']),
+                ("Rejected", counts['rejected']))):
+            with col:
+                st.markdown('<div class="card">', unsafe_allow_html=True)
+                st.metric(label, value)
+                st.markdown('</div>', unsafe_allow_html=True)
+        
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        st.subheader("🕒 My Latest Applications")
+        if summary['latest']:
+            for application in summary['latest']:
+                progress, stage = STATUS_PROGRESS.get(application['status'], (0.0, application['status']))
+                st.markdown(f"**{html.escape(application['reg_no'])}** — "
+                            f"{html.escape(application['manufacturer'])} {html.escape(application['model'])} "
+                            f"{get_status_badge(application['status'])}<br>"
+                            f"<small>Applied {application['application_date']}</small>",
+                            unsafe_allow_html=True)
+                st.progress(progress, text=stage)
+                if application['status'] == 'rejected' and application['remarks']:
+                    st.caption(f"Remarks: {application['remarks']}")
+        else:
+            st.info("You have no applications yet. Start with New Registration!")
+        st.markdown('</div>', unsafe_allow_html=True)
+        
+        show_spooled_applications(user['user_id'])
+        
+        st.markdown('</div>', unsafe_allow_html=True)
     
     # --- Dashboard Tab ---
-    if selected_menu == "Dashboard":
+    elif selected_menu == "Dashboard":
+        import pandas as pd
+        import plotly.express as px
+        import plotly.graph_objects as go
+        
         st.markdown('<div class="fade-in">', unsafe_allow_html=True)
         
+        if degraded_state():
+            st.warning("⏳ The database is under heavy load. Dashboard figures are served from the "
+                       "last known values and may be a few minutes old.")
+        
         # Hero Metrics
         col1, col2, col3, col4 = st.columns(4)
         with col1:
@@ -716,21 +864,16 @@ def main_app():
         st.markdown('<div class="card">', unsafe_allow_html=True)
         st.subheader("🕒 Recent Activity")
         
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT r.reg_no, r.status, r.application_date, u.full_name, v.model
-            FROM registrations r
-            JOIN users u ON r.owner_id = u.user_id
-            JOIN vehicles v ON r.vehicle_id = v.vehicle_id
-            ORDER BY r.created_at DESC
-            LIMIT 10
-        """)
-        recent = cursor.fetchall()
-        
-        if recent:
-            df = pd.DataFrame(recent)
-            df['Status'] = df['status'].apply(lambda x: get_status_badge(x))
-            st.markdown(df.to_html(escape=False, index=False), unsafe_allow_html=True)
+        try:
+            recent, recent_age = cached_or_stale('dashboard:recent', RECENT_ACTIVITY_TTL,
+                                                 compute_recent_activity, merge_recent_activity)
+        except (Overloaded, BudgetExceeded):
+            recent, recent_age = Columns([], []), float('inf')
+        if recent_age is not None:
+            st.markdown(get_staleness_badge(recent_age), unsafe_allow_html=True)
+        
+        if len(recent):
+            st.markdown(recent.to_html({'status': get_status_badge}), unsafe_allow_html=True)
         else:
             st.info("No recent activity. Start by adding a registration!")
         
@@ -746,6 +889,26 @@ def main_app():
         st.header("🚗 New Vehicle Registration")
         st.caption("Please fill all mandatory fields for vehicle registration")
         
+        # Make and model are picked outside the form so the model list follows the manufacturer
+        st.subheader("🏭 Make & Model")
+        catalog = get_catalog(conn)
+        catalog_manufacturer = catalog_model = None
+        if len(catalog):
+            col_catalog1, col_catalog2 = st.columns(2)
+            with col_catalog1:
+                catalog_manufacturer = st.selectbox(
+                    "Manufacturer", catalog.manufacturer_names() + [NOT_IN_CATALOG],
+                    index=None, placeholder="Type to search manufacturers"
+                )
+            with col_catalog2:
+                catalog_model = st.selectbox(
+                    "Model", catalog.models_of(catalog_manufacturer) + [(NOT_IN_CATALOG, None)],
+                    index=None, format_func=lambda option: option[0], placeholder="Type to search models",
+                    disabled=catalog_manufacturer in (None, NOT_IN_CATALOG)
+                )
+        free_text_model = (not len(catalog) or catalog_manufacturer == NOT_IN_CATALOG
+                           or (catalog_model is not None and catalog_model[1] is None))
+        
         with st.form("registration_form", clear_on_submit=True):
             # Owner Details Section
             st.subheader("👤 Owner Details")
@@ -762,8 +925,15 @@ def main_app():
             
             col3, col4 = st.columns(2)
             with col3:
-                manufacturer = st.text_input("Manufacturer", placeholder="e.g., Maruti Suzuki")
-                model = st.text_input("Model", placeholder="e.g., Swift Dzire")
+                if free_text_model:
+                    manufacturer = st.text_input("Manufacturer", placeholder="e.g., Maruti Suzuki",
+                                                 value="" if catalog_manufacturer in (None, NOT_IN_CATALOG)
+                                                 else catalog_manufacturer)
+                    model = st.text_input("Model", placeholder="e.g., Swift Dzire")
+                else:
+                    manufacturer = catalog_manufacturer
+                    model = catalog_model[0] if catalog_model else None
+                    st.markdown(f"**Vehicle:** {manufacturer or '—'} {model or ''}")
                 vehicle_type = st.selectbox(
                     "Vehicle Type",
                     ['2-wheeler', '3-wheeler', '4-wheeler', 'commercial', 'other']
@@ -793,15 +963,14 @@ def main_app():
             with col6:
                 district = st.text_input("District", placeholder="e.g., Mumbai")
             
-            # Documents upload (simulated)
+            # Documents upload
             st.subheader("📄 Required Documents")
-            col7, col8, col9 = st.columns(3)
-            with col7:
-                st.checkbox("✅ Address Proof")
-            with col8:
-                st.checkbox("✅ Identity Proof")
-            with col9:
-                st.checkbox("✅ Vehicle Invoice")
+            st.caption(f"PDF, PNG or JPEG, up to {MAX_DOCUMENT_BYTES >> 20} MB each")
+            uploads = {}
+            for col, (doc_type, label) in zip(st.columns(len(DOC_TYPES)), DOC_TYPES.items()):
+                with col:
+                    uploads[doc_type] = st.file_uploader(label, type=['pdf', 'png', 'jpg', 'jpeg'],
+                                                         key=f"upload_{doc_type}")
             
             st.markdown("---")
             st.markdown('<p class="required-field">All fields are mandatory unless specified</p>', unsafe_allow_html=True)
@@ -819,7 +988,9 @@ def main_app():
                     state, district
                 ]
                 
-                if all(required_fields):
+                if not all(uploads.values()):
+                    show_toast("Please upload all required documents!", "warning")
+                elif all(required_fields):
                     vehicle_data = {
                         'engine_no': sanitize_input(engine_no),
                         'chassis_no': sanitize_input(chassis_no),
@@ -833,19 +1004,26 @@ def main_app():
                         'state': sanitize_input(state),
                         'district': sanitize_input(district)
                     }
+                    # Catalog spelling and id; free text that matches a known model or alias is mapped too
+                    vehicle_data = canonicalize(conn, vehicle_data)
+                    # Fee from the schedule in force today, recorded as the pending payment
+                    vehicle_data = with_fee(conn, vehicle_data)
                     
                     success, reg_no = add_vehicle_registration(
                         vehicle_data, 
-                        st.session_state.user['user_id']
+                        st.session_state.user['user_id'],
+                        uploads
                     )
                     
                     if success:
-                        st.balloons()
-                        time.sleep(2)
+                        st.session_state.show_balloons = True
                         st.rerun()
                 else:
                     show_toast("Please fill all required fields!", "warning")
         
+        if conn is None:
+            show_spooled_applications(st.session_state.user['user_id'])
+        
         st.markdown('</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
@@ -860,114 +1038,80 @@ def main_app():
         status_tabs = st.tabs(["⏳ Pending", "✅ Approved", "❌ Rejected"])
         
         with status_tabs[0]:  # Pending tab
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT r.registration_id, r.reg_no, r.application_date,
-                       u.full_name, u.phone, v.*
-                FROM registrations r
-                JOIN users u ON r.owner_id = u.user_id
-                JOIN vehicles v ON r.vehicle_id = v.vehicle_id
-                WHERE r.status = 'pending'
-                ORDER BY r.application_date
-            """)
-            pending_records = cursor.fetchall()
+            # Oldest first, and no more than the pending budget's row cap
+            pending_records = fetch_within_budget('pending', lambda: gather_records(
+                *pending_registrations_query(limit=row_limit('pending')),
+                key=attrgetter('application_date', 'registration_id'),
+                limit=row_limit('pending'), open_conn=shard_opener('pending')), None)
             
             if pending_records:
                 for record in pending_records:
-                    with st.expander(f"📄 Application: {record['reg_no']} - {record['full_name']}"):
+                    with st.expander(f"📄 Application: {record.reg_no} - {record.full_name}"):
                         col_info1, col_info2 = st.columns(2)
                         with col_info1:
-                            st.markdown(f"**Owner:** {record['full_name']}")
-                            st.markdown(f"**Phone:** {record['phone']}")
-                            st.markdown(f"**Application Date:** {record['application_date']}")
-                            st.markdown(f"**Vehicle:** {record['manufacturer']} {record['model']}")
+                            st.markdown(f"**Owner:** {record.full_name}")
+                            st.markdown(f"**Phone:** {record.phone}")
+                            st.markdown(f"**Application Date:** {record.application_date}")
+                            st.markdown(f"**Vehicle:** {record.manufacturer} {record.model}")
                         with col_info2:
-                            st.markdown(f"**Engine No:** {record['engine_no']}")
-                            st.markdown(f"**Chassis No:** {record['chassis_no']}")
-                            st.markdown(f"**Fuel Type:** {record['fuel_type']}")
-                            st.markdown(f"**Color:** {record['color']}")
+                            st.markdown(f"**Engine No:** {record.engine_no}")
+                            st.markdown(f"**Chassis No:** {record.chassis_no}")
+                            st.markdown(f"**Fuel Type:** {record.fuel_type}")
+                            st.markdown(f"**Color:** {record.color}")
+                        
+                        # Previews are only loaded for the application being reviewed
+                        if st.toggle("📄 Show documents", key=f"docs_{record.registration_id}"):
+                            show_registration_documents(record.registration_id, record.shard)
                         
                         st.markdown("---")
                         
                         # Approval buttons
                         col_btn1, col_btn2, col_btn3 = st.columns(3)
                         with col_btn1:
-                            if st.button(f"✅ Approve {record['reg_no']}", key=f"approve_{record['registration_id']}"):
-                                cursor.execute("""
-                                    UPDATE registrations 
-                                    SET status = 'approved', 
-                                        status_updated_by = %s,
-                                        status_updated_at = NOW(),
-                                        registration_date = CURDATE()
-                                    WHERE registration_id = %s
-                                """, (st.session_state.user['user_id'], record['registration_id']))
-                                conn.commit()
-                                show_toast(f"Registration {record['reg_no']} approved!", "success")
+                            if st.button(f"✅ Approve {record.reg_no}", key=f"approve_{record.registration_id}"):
+                                if change_registration_status(record.registration_id, record.reg_no, 'approved'):
+                                    show_toast(f"Registration {record.reg_no} approved!", "success")
                                 st.rerun()
                         
                         with col_btn2:
-                            if st.button(f"🔍 Verify {record['reg_no']}", key=f"verify_{record['registration_id']}"):
-                                cursor.execute("""
-                                    UPDATE registrations 
-                                    SET status = 'verified',
-                                        status_updated_by = %s,
-                                        status_updated_at = NOW()
-                                    WHERE registration_id = %s
-                                """, (st.session_state.user['user_id'], record['registration_id']))
-                                conn.commit()
-                                show_toast(f"Registration {record['reg_no']} marked for verification!", "success")
+                            if st.button(f"🔍 Verify {record.reg_no}", key=f"verify_{record.registration_id}"):
+                                if change_registration_status(record.registration_id, record.reg_no, 'verified'):
+                                    show_toast(f"Registration {record.reg_no} marked for verification!", "success")
                                 st.rerun()
                         
                         with col_btn3:
-                            remarks = st.text_input("Remarks (if rejecting)", key=f"remarks_{record['registration_id']}")
-                            if st.button(f"❌ Reject {record['reg_no']}", key=f"reject_{record['registration_id']}"):
+                            remarks = st.text_input("Remarks (if rejecting)", key=f"remarks_{record.registration_id}")
+                            if st.button(f"❌ Reject {record.reg_no}", key=f"reject_{record.registration_id}"):
                                 if remarks:
-                                    cursor.execute("""
-                                        UPDATE registrations 
-                                        SET status = 'rejected',
-                                            status_updated_by = %s,
-                                            status_updated_at = NOW(),
-                                            remarks = %s
-                                        WHERE registration_id = %s
-                                    """, (st.session_state.user['user_id'], remarks, record['registration_id']))
-                                    conn.commit()
-                                    show_toast(f"Registration {record['reg_no']} rejected.", "warning")
+                                    if change_registration_status(record.registration_id, record.reg_no, 'rejected', remarks):
+                                        show_toast(f"Registration {record.reg_no} rejected.", "warning")
                                     st.rerun()
                                 else:
                                     st.warning("Please provide remarks for rejection")
-            else:
+            elif pending_records is not None:
                 st.info("No pending registrations!")
         
         # Show other statuses in their tabs
         for i, status in enumerate(['approved', 'rejected'], start=1):
             with status_tabs[i]:
-                cursor.execute(f"""
-                    SELECT r.reg_no, r.application_date, r.registration_date,
-                           u.full_name, v.model, r.status, r.remarks
-                    FROM registrations r
-                    JOIN users u ON r.owner_id = u.user_id
-                    JOIN vehicles v ON r.vehicle_id = v.vehicle_id
-                    WHERE r.status = '{status}'
-                    ORDER BY r.status_updated_at DESC
-                    LIMIT 20
-                """)
-                status_records = cursor.fetchall()
+                status_records = fetch_within_budget('decided', lambda: gather_records(
+                    *decided_registrations_query(status, row_limit('decided')),
+                    key=lambda record: record.status_updated_at or datetime.min,
+                    reverse=True, limit=row_limit('decided'), open_conn=shard_opener('decided')), [])
                 
                 if status_records:
                     for record in status_records:
                         st.markdown(f"""
                             <div style="padding: 10px; margin: 5px 0; border-radius: 8px; background: rgba(30,41,59,0.5);">
-                                <strong>{record['reg_no']}</strong> - {record['full_name']}<br>
-                                <small>Vehicle: {record['model']} | 
-                                Status: {get_status_badge(record['status'])}<br>
-                                {f"Remarks: {record['remarks']}" if record['remarks'] else ""}
+                                <strong>{record.reg_no}</strong> - {record.full_name}<br>
+                                <small>Vehicle: {record.model} | 
+                                Status: {get_status_badge(record.status)}<br>
+                                {f"Remarks: {record.remarks}" if record.remarks else ""}
                                 </small>
                             </div>
                         """, unsafe_allow_html=True)
                 else:
                     st.info(f"No {status} registrations!")
-        
-        cursor.close()
         st.markdown('</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
@@ -1006,86 +1150,283 @@ def main_app():
             date_to = st.date_input("To date", value=datetime.now())
         
         # Get user's applications
-        cursor = conn.cursor()
-        query = """
-            SELECT r.reg_no, r.application_date, r.status, r.registration_date,
-                   v.model, v.vehicle_type, v.fuel_type, r.remarks
-            FROM registrations r
-            JOIN vehicles v ON r.vehicle_id = v.vehicle_id
-            WHERE r.owner_id = %s
-            AND r.application_date BETWEEN %s AND %s
-        """
-        params = [st.session_state.user['user_id'], date_from, date_to]
-        
-        if search_btn and search_term:
-            if search_type == "Registration Number":
-                query += " AND r.reg_no LIKE %s"
-                params.append(f"%{search_term}%")
-            elif search_type == "Vehicle Model":
-                query += " AND v.model LIKE %s"
-                params.append(f"%{search_term}%")
-            elif search_type == "Status":
-                query += " AND r.status = %s"
-                params.append(search_term)
-        
-        cursor.execute(query, params)
-        applications = cursor.fetchall()
-        
-        if applications:
-            df = pd.DataFrame(applications)
-            df['Status'] = df['status'].apply(lambda x: get_status_badge(x))
-            
+        applications_query = owner_applications_query(
+            st.session_state.user['user_id'], date_from, date_to,
+            search_type if search_btn else None, search_term if search_btn else None,
+            limit=row_limit('my_applications')
+        )
+        applications = fetch_within_budget('my_applications', lambda: merge_columns(
+            on_all_shards(lambda db: fetch_columns(db, *applications_query), budget='my_applications'),
+            'registration_id', limit=row_limit('my_applications')).drop('registration_id'), None)
+        
+        if applications is not None and len(applications):
             # Convert to HTML for better styling
-            st.markdown(df.to_html(escape=False, index=False), unsafe_allow_html=True)
+            st.markdown(applications.to_html({'status': get_status_badge}), unsafe_allow_html=True)
             
             # Export options
             st.download_button(
                 label="📥 Export as CSV",
-                data=df.to_csv(index=False),
+                data=applications.to_csv(),
                 file_name=f"my_applications_{datetime.now().strftime('%Y%m%d')}.csv",
                 mime="text/csv",
                 use_container_width=True
             )
-        else:
+        elif applications is not None:
             st.info("No applications found matching your criteria!")
         
-        cursor.close()
+        show_spooled_applications(st.session_state.user['user_id'])
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    # --- Registration Explorer (for admin) ---
+    elif selected_menu == "Registration Explorer" and st.session_state.current_role == 'admin':
+        st.markdown('<div class="slide-in">', unsafe_allow_html=True)
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        
+        st.header("🗂️ Registration Explorer")
+        
+        col_exp1, col_exp2, col_exp3 = st.columns(3)
+        with col_exp1:
+            explore_from = st.date_input("From", value=datetime.now() - timedelta(days=365), key="explore_from")
+        with col_exp2:
+            explore_to = st.date_input("To", value=datetime.now(), key="explore_to")
+        with col_exp3:
+            owner = st.text_input("Owner name starts with", key="explore_owner")
+        
+        explore_filters = {}
+        filter_cols = st.columns(len(FILTER_COLUMNS))
+        for col, dimension in zip(filter_cols, FILTER_COLUMNS):
+            with col:
+                explore_filters[dimension] = st.multiselect(
+                    dimension.replace('_', ' ').title(),
+                    cube_dimension_values(dimension, explore_filters),
+                    key=f"explore_filter_{dimension}"
+                )
+        
+        col_sort1, col_sort2, col_sort3, col_sort4, col_sort5 = st.columns(5)
+        sort_label = lambda c: c.replace('_', ' ').title()
+        with col_sort1:
+            primary_sort = st.selectbox("Sort by", list(SORT_COLUMNS), format_func=sort_label)
+        with col_sort2:
+            primary_dir = st.selectbox("Order", ['desc', 'asc'], key="explore_dir1")
+        with col_sort3:
+            secondary_sort = st.selectbox("Then by", [None] + list(SORT_COLUMNS),
+                                          format_func=lambda c: "—" if c is None else sort_label(c))
+        with col_sort4:
+            secondary_dir = st.selectbox("Order", ['asc', 'desc'], key="explore_dir2")
+        with col_sort5:
+            page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1)
+        
+        sort = [(primary_sort, primary_dir)]
+        if secondary_sort and secondary_sort != primary_sort:
+            sort.append((secondary_sort, secondary_dir))
+        explorer_query = ExplorerQuery(explore_from, explore_to, explore_filters, owner, sort)
+        
+        # Any change to the view starts again from the first page
+        view_key = (explorer_query.cache_key(), tuple(sort), page_size)
+        if st.session_state.get('explorer_view') != view_key or 'explorer_cursors' not in st.session_state:
+            st.session_state.explorer_view = view_key
+            st.session_state.explorer_cursors = [None]
+        
+        page_cursor = st.session_state.explorer_cursors[-1]
+        try:
+            facets = merge_facets(on_all_shards(lambda db, shard: facet_counts(db, explorer_query, shard),
+                                                pass_shard=True, budget='explorer'))
+            records, next_cursor = merge_pages(
+                on_all_shards(lambda db: fetch_page(db, explorer_query, page_size, page_cursor),
+                              budget='explorer'),
+                explorer_query, page_size)
+        except BudgetExceeded as e:
+            st.error(f"⏱️ {e}")
+            facets, records, next_cursor = None, [], None
+        except Overloaded as e:
+            st.warning(f"⏳ {e}. Please try again in a moment.")
+            facets, records, next_cursor = None, [], None
+        
+        if facets is not None:
+            total_label = f"{facets['total']:,}" if facets['exact'] else f"~{facets['total']:,} (estimated)"
+            st.markdown(f"**Matching registrations:** {total_label}")
+        
+        if facets and facets['facets']:
+            with st.expander("📊 Facet counts"):
+                facet_cols = st.columns(len(FACET_DIMENSIONS))
+                for col, dimension in zip(facet_cols, FACET_DIMENSIONS):
+                    with col:
+                        st.markdown(f"**{dimension.replace('_', ' ').title()}**")
+                        for value, count in sorted(facets['facets'][dimension].items(),
+                                                   key=lambda item: -item[1]):
+                            st.caption(f"{value}: {count:,}")
+        
+        if records:
+            page = Columns(records[0]._fields, [list(column) for column in zip(*records)])
+            st.markdown(page.drop('registration_id', 'created_at').to_html({'status': get_status_badge}),
+                        unsafe_allow_html=True)
+        elif facets is not None:
+            st.info("No registrations match these filters.")
+        
+        col_page1, col_page2, col_page3 = st.columns([1, 2, 1])
+        with col_page1:
+            if len(st.session_state.explorer_cursors) > 1 and st.button("⬅️ Previous", use_container_width=True):
+                st.session_state.explorer_cursors.pop()
+                st.rerun()
+        with col_page2:
+            st.caption(f"Page {len(st.session_state.explorer_cursors)}")
+        with col_page3:
+            if next_cursor is not None and st.button("Next ➡️", use_container_width=True):
+                st.session_state.explorer_cursors.append(next_cursor)
+                st.rerun()
+        
+        # Full exports run in their own small pool and are the first thing shed under load
+        if st.button("📦 Prepare CSV export of all matches", use_container_width=True):
+            try:
+                # One shard at a time: the export class admits a single query
+                parts = []
+                for shard in SHARDS:
+                    with admit('export', shard) as db:
+                        parts.append(export_columns(db, explorer_query, row_limit('export')))
+                rows, truncated = cap_rows('export', merge_columns(parts))
+                if truncated:
+                    st.warning(f"The export holds the first {len(rows):,} matches only. Narrow the filters to export the rest.")
+                st.session_state.explorer_export = (view_key, rows.to_csv())
+            except Overloaded as e:
+                st.warning(f"{e}. Please try again later.")
+            except BudgetExceeded as e:
+                st.error(f"⏱️ {e}")
+        export = st.session_state.get('explorer_export')
+        if export and export[0] == view_key:
+            st.download_button(
+                label="📥 Download CSV",
+                data=export[1],
+                file_name=f"registrations_{datetime.now().strftime('%Y%m%d')}.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    # --- Track Status Tab (for users) ---
+    elif selected_menu == "Track Status" and st.session_state.current_role == 'user':
+        st.markdown('<div class="slide-in">', unsafe_allow_html=True)
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        
+        st.header("🔎 Track Application Status")
+        show_track_status()
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    # --- Reports Tab (for inspectors) ---
+    elif selected_menu == "Reports" and st.session_state.current_role == 'inspector':
+        import streamlit.components.v1 as components
+        
+        st.markdown('<div class="slide-in">', unsafe_allow_html=True)
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        
+        st.header("📑 District Reports")
+        st.caption("Reports are pre-rendered in the background whenever registrations change")
+        
+        col_report1, col_report2 = st.columns([2, 1])
+        with col_report1:
+            report_name = st.selectbox("Report", list(REPORTS), format_func=REPORTS.get)
+        versions = list_versions(report_name)
+        with col_report2:
+            report_version = st.selectbox("Version", versions) if versions else None
+        
+        manifest = load_manifest(report_name, report_version) if report_version else None
+        if manifest:
+            generated_at = datetime.fromisoformat(manifest['generated_at'])
+            st.markdown(f"**Generated:** {generated_at.strftime('%d %b %Y, %H:%M')} | "
+                        f"**Districts:** {manifest['rows']}")
+            
+            components.html(read_artifact(report_name, report_version, 'report.html').decode('utf-8'),
+                            height=700, scrolling=True)
+            
+            download_cols = st.columns(len(manifest['files']))
+            for col, filename in zip(download_cols, manifest['files']):
+                extension = filename.rsplit('.', 1)[1]
+                with col:
+                    st.download_button(
+                        label=f"📥 Download {extension.upper()}",
+                        data=read_artifact(report_name, report_version, filename),
+                        file_name=f"{report_name}_{report_version}.{extension}",
+                        mime={'html': 'text/html', 'csv': 'text/csv', 'pdf': 'application/pdf'}[extension],
+                        use_container_width=True,
+                        key=f"report_download_{extension}"
+                    )
+        else:
+            st.info("This report has not been generated yet. Run `python rto_reports.py` to build it.")
+        
         st.markdown('</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
     # --- Analytics Tab (for admin) ---
     elif selected_menu == "Analytics" and st.session_state.current_role == 'admin':
+        import pandas as pd
+        import plotly.express as px
+        
         st.markdown('<div class="slide-in">', unsafe_allow_html=True)
         st.markdown('<div class="card">', unsafe_allow_html=True)
         
         st.header("📊 Advanced Analytics Dashboard")
         
-        stats = get_registration_stats()
+        stats, _ = get_registration_stats()
         
-        # Time series analysis
+        # Slice and drill-down controls, answered from the registration cube
         st.subheader("📅 Registration Trends")
         
-        if stats['monthly']:
-            trend_df = pd.DataFrame(stats['monthly'])
-            fig = px.area(trend_df, x='month', y='count', 
-                         title="Monthly Registration Trends",
+        col_range1, col_range2, col_range3 = st.columns(3)
+        with col_range1:
+            trend_from = st.date_input("From", value=datetime.now() - timedelta(days=180), key="cube_from")
+        with col_range2:
+            trend_to = st.date_input("To", value=datetime.now(), key="cube_to")
+        with col_range3:
+            grain = st.selectbox("Granularity", list(GRAINS), index=2, format_func=str.title)
+        
+        # Each filter only offers values that exist under the filters before it
+        filters = {}
+        filter_cols = st.columns(len(DIMENSIONS))
+        for col, dimension in zip(filter_cols, DIMENSIONS):
+            with col:
+                filters[dimension] = st.multiselect(
+                    dimension.replace('_', ' ').title(),
+                    cube_dimension_values(dimension, filters),
+                    key=f"cube_filter_{dimension}"
+                )
+        
+        breakdown = st.selectbox(
+            "Break down by",
+            [None] + list(DIMENSIONS),
+            format_func=lambda d: "Nothing" if d is None else d.replace('_', ' ').title()
+        )
+        
+        trend = cube_counts(grain, trend_from, trend_to, filters, group_by=breakdown)
+        if trend:
+            trend_df = pd.DataFrame(trend)
+            fig = px.area(trend_df, x='period_start', y='count', color=breakdown,
+                         title=f"Registration Trends by {grain.title()}",
                          line_shape='spline')
             fig.update_layout(
                 plot_bgcolor='rgba(0,0,0,0)',
                 paper_bgcolor='rgba(0,0,0,0)',
                 font=dict(color='white'),
-                xaxis=dict(showgrid=False),
+                xaxis=dict(showgrid=False, title=""),
                 yaxis=dict(showgrid=False)
             )
             st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No registrations in this slice.")
         
         # Comparison charts
         col_compare1, col_compare2 = st.columns(2)
         
         with col_compare1:
             st.subheader("🚗 Vehicle Type Analysis")
-            if stats['vehicle_types']:
-                types_df = pd.DataFrame(stats['vehicle_types'])
+            vehicle_types = cube_counts(grain, trend_from, trend_to, filters,
+                                        group_by='vehicle_type', by_period=False)
+            if vehicle_types:
+                types_df = pd.DataFrame(vehicle_types)
                 fig = px.bar(types_df, x='vehicle_type', y='count',
                             color='vehicle_type',
                             text='count')
@@ -1099,8 +1440,10 @@ def main_app():
         
         with col_compare2:
             st.subheader("⛽ Fuel Type Comparison")
-            if stats['fuel_types']:
-                fuel_df = pd.DataFrame(stats['fuel_types'])
+            fuel_types = cube_counts(grain, trend_from, trend_to, filters,
+                                     group_by='fuel_type', by_period=False)
+            if fuel_types:
+                fuel_df = pd.DataFrame(fuel_types)
                 fig = px.pie(fuel_df, values='count', names='fuel_type',
                             hole=0.4,
                             color_discrete_sequence=px.colors.qualitative.Pastel)
@@ -1114,10 +1457,20 @@ def main_app():
         # Performance metrics
         st.subheader("📈 Performance Metrics")
         
+        # Sketches are kept current by the rto_sla.py worker; the page only reads them
+        sla_window = trend_to - trend_from
+        current_sla = sla_summary(trend_from, trend_to, filters)
+        previous_sla = sla_summary(trend_from - sla_window, trend_from - timedelta(days=1), filters)
+        
         col_metric1, col_metric2, col_metric3 = st.columns(3)
         with col_metric1:
-            avg_processing_time = 3.2  # This would be calculated from database
-            st.metric("Avg Processing Time", f"{avg_processing_time} days", delta="-0.5 days")
+            approval_p50 = next((r['p50'] for r in current_sla if r['status'] == 'approved'), None)
+            previous_p50 = next((r['p50'] for r in previous_sla if r['status'] == 'approved'), None)
+            st.metric("Median Time to Approval",
+                     f"{approval_p50:.1f} days" if approval_p50 is not None else "No data",
+                     delta=f"{approval_p50 - previous_p50:+.1f} days"
+                     if approval_p50 is not None and previous_p50 is not None else None,
+                     delta_color="inverse")
         
         with col_metric2:
             rejection_rate = 100 - stats['approval_rate']
@@ -1133,6 +1486,140 @@ def main_app():
             st.metric("Monthly Growth", f"{growth:.1f}%", 
                      delta="positive" if growth > 0 else "negative")
         
+        # Turnaround percentiles per outcome
+        st.subheader("⏱️ Processing SLA")
+        sla_group = st.selectbox(
+            "SLA breakdown",
+            [None, 'state', 'district', 'period_month'],
+            format_func=lambda g: {None: "Overall", 'state': "By State",
+                                   'district': "By District", 'period_month': "By Month"}[g]
+        )
+        sla_rows = current_sla if sla_group is None else sla_summary(trend_from, trend_to, filters, sla_group)
+        if sla_rows:
+            sla_df = pd.DataFrame(sla_rows).round({'p50': 2, 'p90': 2, 'p99': 2})
+            st.dataframe(sla_df.rename(columns={'p50': 'p50 (days)', 'p90': 'p90 (days)',
+                                                'p99': 'p99 (days)'}),
+                         use_container_width=True, hide_index=True)
+            if sla_group == 'period_month':
+                fig = px.line(sla_df, x='period_month', y='p90', color='status', markers=True,
+                             title="p90 Turnaround by Month")
+                fig.update_layout(
+                    plot_bgcolor='rgba(0,0,0,0)',
+                    paper_bgcolor='rgba(0,0,0,0)',
+                    font=dict(color='white'),
+                    xaxis=dict(showgrid=False, title=""),
+                    yaxis=dict(showgrid=False, title="Days")
+                )
+                st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No verified, approved or rejected registrations in this range yet.")
+        
+        st.markdown('</div>', unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    # --- System Logs Tab ---
+    elif selected_menu == "System Logs" and st.session_state.current_role == 'admin':
+        import pandas as pd
+        
+        st.markdown('<div class="slide-in">', unsafe_allow_html=True)
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        
+        st.header("🖥️ System Logs")
+        st.caption("Figures are for this replica only")
+        
+        # Session memory, as estimated after each rerun
+        st.subheader("🧠 Session Memory")
+        sizing = ledger.sizing()
+        col_mem1, col_mem2, col_mem3, col_mem4 = st.columns(4)
+        with col_mem1:
+            st.metric("Live Sessions", sizing['sessions'])
+        with col_mem2:
+            st.metric("Session State Total", format_bytes(sizing['total']))
+        with col_mem3:
+            st.metric("Process RSS", format_bytes(sizing['rss']),
+                     delta=f"of {format_bytes(sizing['budget'])}" if sizing['budget'] else None,
+                     delta_color="off")
+        with col_mem4:
+            st.metric("p95 Session", format_bytes(sizing['p95']))
+        if sizing['headroom'] is not None:
+            st.caption(f"Room for about {sizing['headroom']:,} more sessions of p95 size within the replica budget")
+        
+        pages = ledger.pages()
+        if pages:
+            st.markdown("**By page**")
+            st.dataframe(pd.DataFrame([{
+                'Page': row['page'], 'Reruns': row['reruns'],
+                'Mean State': format_bytes(row['mean']), 'Largest State': format_bytes(row['max']),
+                'Largest Render Peak': format_bytes(row['render_peak_max'])
+            } for row in pages]), use_container_width=True, hide_index=True)
+        sessions = ledger.sessions()
+        if sessions:
+            st.markdown("**Largest sessions**")
+            st.dataframe(pd.DataFrame([{
+                'Session': row['session'], 'Page': row['page'], 'State': format_bytes(row['bytes']),
+                'Render Peak': format_bytes(row['render_peak']),
+                'Last Rerun': datetime.fromtimestamp(row['seen']).strftime('%H:%M:%S')
+            } for row in sessions[:20]]), use_container_width=True, hide_index=True)
+        
+        # Statement time limits and row caps, and how often they bite
+        st.subheader("⏱️ Query Budgets")
+        budgets = budget_stats()
+        if budgets:
+            st.dataframe(pd.DataFrame([{
+                'Budget': row['budget'],
+                'Time Limit': f"{row['seconds_limit']:g}s" if row['seconds_limit'] else "none",
+                'Row Cap': f"{row['rows_limit']:,}" if row['rows_limit'] else "none",
+                'Queries': row['runs'], 'Overruns': row['overruns'], 'Truncated': row['truncated'],
+                'Mean': f"{row['mean']:.3f}s" if row['mean'] is not None else "n/a",
+                'Slowest': f"{row['slowest']:.3f}s" if row['slowest'] is not None else "n/a"
+            } for row in budgets]), use_container_width=True, hide_index=True)
+        else:
+            st.caption("No budgeted queries have run in this replica yet")
+        
+        # Allocation tracing slows the whole process, so it only runs on request
+        st.subheader("🔬 Allocation Profiling")
+        if not is_tracing():
+            st.info("Allocation tracing is off. It slows this replica while it runs.")
+            if st.button("▶️ Start tracing", use_container_width=True):
+                start_tracing()
+                st.rerun()
+        else:
+            traced = traced_memory()
+            st.caption(f"Traced: {format_bytes(traced['current'])} now, {format_bytes(traced['peak'])} peak")
+            col_trace1, col_trace2 = st.columns(2)
+            with col_trace1:
+                if st.button("📸 Take snapshot", use_container_width=True):
+                    take_snapshot()
+                    st.rerun()
+            with col_trace2:
+                if st.button("⏹️ Stop tracing", use_container_width=True):
+                    stop_tracing()
+                    st.rerun()
+            
+            labels = snapshot_labels()
+            group_by = st.selectbox("Group by", ['lineno', 'filename', 'traceback'],
+                                    format_func=lambda g: {'lineno': "Line", 'filename': "File",
+                                                           'traceback': "Call stack"}[g])
+            if len(labels) >= 2:
+                col_diff1, col_diff2 = st.columns(2)
+                with col_diff1:
+                    old_label = st.selectbox("Compare snapshot", labels, index=len(labels) - 2)
+                with col_diff2:
+                    new_label = st.selectbox("With snapshot", labels, index=len(labels) - 1)
+                growth = compare_snapshots(get_snapshot(old_label), get_snapshot(new_label), group_by=group_by)
+                st.dataframe(pd.DataFrame([{
+                    'Location': row['location'], 'Growth': format_bytes(row['size_diff']),
+                    'New Blocks': row['count_diff'], 'Size': format_bytes(row['size'])
+                } for row in growth]), use_container_width=True, hide_index=True)
+            elif labels:
+                st.dataframe(pd.DataFrame([{
+                    'Location': row['location'], 'Size': format_bytes(row['size']), 'Blocks': row['count']
+                } for row in top_allocations(get_snapshot(labels[-1]), group_by=group_by)]),
+                    use_container_width=True, hide_index=True)
+                st.caption("Take another snapshot to see what grows between them")
+            else:
+                st.caption("Take a snapshot to see the largest allocation sites")
+        
         st.markdown('</div>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
     
@@ -1144,16 +1631,38 @@ def main_app():
         st.caption("**Problem Solved:** Manual vehicle registration is time-consuming, error-prone, and difficult to track. This system digitizes the RTO workflow with secure storage, validation, and analytics.")
     with footer_col3:
         st.caption(f"🔄 Last updated: {datetime.now().strftime('%H:%M:%S')}")
+    
+    account_session_memory(selected_menu or "Outage", traced_before)
+
+def account_session_memory(page: str, traced_before):
+    """Record what this session holds after rendering page, trimming it if over budget"""
+    traced_after = traced_memory()
+    render_peak = None
+    if traced_before and traced_after:
+        render_peak = max(0, traced_after['peak'] - traced_before['current'])
+    dropped = account_session(st.session_state.memory_id, page, st.session_state,
+                              DROPPABLE_SESSION_KEYS, render_peak)
+    if dropped:
+        show_toast("A prepared export was discarded to free memory. Please prepare it again.", "warning")
 
 # --- Main Execution Flow ---
 def main():
     """Main execution flow"""
+    restore_session()
+    write_session_cookie()
     
     # Show login page if not authenticated
-    if not st.session_state.user:
+    if not st.session_state.user and conn is None:
+        st.error("The database is unavailable right now, so signing in is not possible. "
+                 "Please try again in a few minutes.")
+    elif not st.session_state.user:
         show_login_page()
     else:
-        main_app()
+        try:
+            main_app()
+        except BudgetExceeded as e:
+            # Pages without their own handling still fail with a clear message
+            st.error(f"⏱️ {e}")
 
 if __name__ == "__main__":
     main()
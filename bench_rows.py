@@ -0,0 +1,77 @@
+"""Per-row memory and build time of the listing result shapes.
+
+Compares, for the same synthetic My Applications-shaped rows:
+
+  * dict rows        what DictCursor.fetchall() returns
+  * dict + DataFrame dict rows copied into a pandas DataFrame (old path)
+  * records          rto_rows.record_type slotted tuples
+  * columns          rto_rows.Columns, one list per column
+
+    python bench_rows.py --rows 100000
+
+Only the Python-side shapes are measured, so no database is needed.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from rto_rows import Columns, record_type
+
+FIELDS = ('registration_id', 'reg_no', 'application_date', 'status', 'registration_date',
+          'model', 'vehicle_type', 'fuel_type', 'remarks')
+
+def synthetic_rows(count: int) -> list:
+    """Tuples as a tuple cursor would return them"""
+    start = date(2024, 1, 1)
+    statuses = ('pending', 'approved', 'rejected', 'verified')
+    return [
+        (i, f"MA24{i:06d}", start + timedelta(days=i % 365), statuses[i % 4],
+         None if i % 4 else start + timedelta(days=i % 365 + 3),
+         f"Model {i % 50}", '4-wheeler', 'petrol', None)
+        for i in range(count)
+    ]
+
+def as_dicts(rows):
+    return [dict(zip(FIELDS, row)) for row in rows]
+
+def as_dataframe(rows):
+    import pandas as pd
+    dicts = as_dicts(rows)
+    return dicts, pd.DataFrame(dicts)
+
+def as_records(rows):
+    return list(map(record_type(FIELDS)._make, rows))
+
+def as_columns(rows):
+    return Columns(FIELDS, [list(column) for column in zip(*rows)])
+
+def measure(build, rows) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build(rows)
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size / len(rows), elapsed * 1e6 / len(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare listing result shapes")
+    parser.add_argument('--rows', type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.rows)
+    shapes = [('dict rows', as_dicts), ('records', as_records), ('columns', as_columns)]
+    try:
+        import pandas  # noqa: F401
+        shapes.insert(1, ('dict + DataFrame', as_dataframe))
+    except ImportError:
+        pass
+
+    print(f"{'shape':<18}{'bytes/row':>12}{'us/row':>10}")
+    for name, build in shapes:
+        per_row_bytes, per_row_us = measure(build, rows)
+        print(f"{name:<18}{per_row_bytes:>12.1f}{per_row_us:>10.3f}")
@@ -0,0 +1,88 @@
+"""Startup benchmark: time-to-first-render and import memory of the app.
+
+Each run starts a fresh interpreter, renders the login page once through
+Streamlit's AppTest harness and reports:
+
+  * first_render_s       wall time from interpreter start to rendered page
+  * import_peak_mib      peak Python allocation while importing and rendering
+  * max_rss_mib          resident set size of the child process
+  * heavy_modules        pandas/plotly modules loaded by the login page
+
+    python bench_startup.py --runs 5 --record bench_startup.jsonl
+
+--record appends the median of the runs to a JSON-lines file and prints the
+change against the previous entry, so regressions show up in review.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'RTO.py')
+HEAVY_MODULES = ('pandas', 'plotly.express', 'plotly.graph_objects', 'plotly.subplots')
+
+CHILD = r"""
+import json, resource, sys, time, tracemalloc
+start = time.perf_counter()
+tracemalloc.start()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=120)
+app.run()
+elapsed = time.perf_counter() - start
+_, peak = tracemalloc.get_traced_memory()
+rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'first_render_s': elapsed,
+    'import_peak_mib': peak / 2**20,
+    'max_rss_mib': rss_kib / 1024 if sys.platform != 'darwin' else rss_kib / 2**20,
+    'heavy_modules': [m for m in json.loads(sys.argv[2]) if m in sys.modules],
+    'exceptions': [str(e.value) for e in app.exception],
+}))
+"""
+
+def run_once() -> dict:
+    """Render the login page in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, APP_PATH, json.dumps(HEAVY_MODULES)],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def summarize(runs: list) -> dict:
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'runs': len(runs),
+        'first_render_s': round(statistics.median(r['first_render_s'] for r in runs), 4),
+        'import_peak_mib': round(statistics.median(r['import_peak_mib'] for r in runs), 2),
+        'max_rss_mib': round(statistics.median(r['max_rss_mib'] for r in runs), 2),
+        'heavy_modules': runs[-1]['heavy_modules'],
+        'exceptions': runs[-1]['exceptions'],
+    }
+
+def previous_entry(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        lines = [line for line in f if line.strip()]
+    return json.loads(lines[-1]) if lines else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark app cold start")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--record', help="JSON-lines file to append the result to")
+    args = parser.parse_args()
+
+    summary = summarize([run_once() for _ in range(args.runs)])
+    print(json.dumps(summary, indent=2))
+
+    if args.record:
+        previous = previous_entry(args.record)
+        if previous:
+            for key in ('first_render_s', 'import_peak_mib', 'max_rss_mib'):
+                change = summary[key] - previous[key]
+                print(f"{key}: {previous[key]} -> {summary[key]} ({change:+.3f})")
+        with open(args.record, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(summary) + '\n')
@@ -0,0 +1,197 @@
+"""Admission control in front of the database.
+
+Queries are split into classes, each with its own small connection pool:
+
+    critical   login, session checks and vehicle claims
+    write      submissions and status changes
+    dashboard  sidebar stats, dashboard cards and charts
+    export     bulk CSV exports
+
+and one class per page budget of rto_budgets (page, pending, decided,
+my_applications, explorer, analytics). A connection is only ever used by
+the one caller that took it, never by two Streamlit sessions at once.
+
+The pool size caps how many queries of a class run at once. A caller that
+cannot get a connection within the class's queue timeout gets Overloaded
+instead of piling up behind a slow database, and a slow dashboard query
+cannot hold up a login, which uses a different pool. Slow queries and
+queue timeouts switch every replica into degraded mode for a while (the
+flag lives in the shared cache). In degraded mode dashboards and the
+Analytics page serve their last computed values with their age, listings
+say the system is busy when their pool is full, and exports are refused
+outright.
+Each class is also a query budget (see rto_budgets): its connections carry
+the budget's statement time limit, and an overrun raises BudgetExceeded
+without costing the connection.
+
+With several shards (see rto_shards) the pool limits hold per process
+across all shards, and each shard keeps its own idle connections.
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+import pymysql
+
+from rto_budgets import BUDGETS, BudgetExceeded, limit_statements, within_budget
+from rto_cache import get_cache
+from rto_core import connect
+from rto_shards import connect_shard, is_home, scatter
+
+# class: (concurrent queries per process, seconds a caller may wait for a slot)
+QUERY_CLASSES = {
+    'critical': (4, 10.0),
+    'write': (4, 5.0),
+    'dashboard': (3, 1.0),
+    'export': (1, 0.0),
+    'page': (4, 5.0),
+    'pending': (3, 5.0),
+    'decided': (3, 5.0),
+    'my_applications': (3, 5.0),
+    'explorer': (3, 5.0),
+    'analytics': (3, 5.0),
+}
+SLOW_QUERY_SECONDS = 3.0  # a non-export query this slow puts the app into degraded mode
+DEGRADED_HOLD = 60        # seconds degraded mode lasts after the last sign of overload
+DEGRADED_KEY = 'admission:degraded'
+STALE_TTL = 24 * 3600     # how long last-known dashboard values are kept
+
+
+class Overloaded(Exception):
+    """Raised when a query class has no free slot within its queue timeout"""
+
+    def __init__(self, query_class: str, message: Optional[str] = None):
+        super().__init__(message or f"Too many {query_class} queries in progress")
+        self.query_class = query_class
+
+
+class _Pool:
+    """Bounded set of connections for one query class"""
+
+    def __init__(self, size: int, timeout: float):
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle: Dict[Optional[str], "queue.LifoQueue"] = {}
+        self.in_flight = 0
+        self.rejected = 0
+
+    def take(self, shard: Optional[str]):
+        try:
+            conn = self.idle.setdefault(shard, queue.LifoQueue()).get_nowait()
+        except queue.Empty:
+            return connect() if shard is None else connect_shard(shard)
+        conn.ping(reconnect=True)
+        return conn
+
+
+_pools: Dict[str, _Pool] = {name: _Pool(size, timeout) for name, (size, timeout) in QUERY_CLASSES.items()}
+_stats_lock = threading.Lock()
+
+def _discard(conn):
+    try:
+        conn.close()
+    except pymysql.MySQLError:
+        pass
+
+def enter_degraded(reason: str):
+    """Switch every replica to degraded mode for DEGRADED_HOLD seconds"""
+    get_cache().set(DEGRADED_KEY, {'since': time.time(), 'reason': reason}, DEGRADED_HOLD)
+
+def degraded_state() -> Optional[Dict[str, Any]]:
+    """{'since', 'reason'} while degraded, else None"""
+    return get_cache().get(DEGRADED_KEY)
+
+def is_degraded() -> bool:
+    return degraded_state() is not None
+
+@contextmanager
+def admit(query_class: str, shard: Optional[str] = None):
+    """A connection of the given class, or Overloaded if none frees up in time.
+
+    shard is a name from rto_shards.SHARDS; None is the home database.
+    """
+    pool = _pools[query_class]
+    if shard is not None and is_home(shard):
+        shard = None
+    if query_class == 'export' and is_degraded():
+        with _stats_lock:
+            pool.rejected += 1
+        raise Overloaded(query_class, "Exports are paused while the database is under heavy load")
+    if not pool.slots.acquire(timeout=pool.timeout):
+        with _stats_lock:
+            pool.rejected += 1
+        enter_degraded(f"{query_class} queue full")
+        raise Overloaded(query_class)
+
+    with _stats_lock:
+        pool.in_flight += 1
+    started = time.monotonic()
+    conn = None
+    try:
+        conn = pool.take(shard)
+        if query_class in BUDGETS:
+            limit_statements(conn, query_class)
+            with within_budget(query_class):
+                yield conn
+        else:
+            yield conn
+    except pymysql.OperationalError:
+        # Lost or timed-out connection: don't hand it to the next caller
+        if conn is not None:
+            _discard(conn)
+            conn = None
+        enter_degraded(f"{query_class} query failed")
+        raise
+    finally:
+        if conn is not None:
+            try:
+                conn.rollback()  # end any read snapshot before the next caller
+                pool.idle[shard].put(conn)
+            except pymysql.MySQLError:
+                _discard(conn)
+        with _stats_lock:
+            pool.in_flight -= 1
+        pool.slots.release()
+        if query_class != 'export' and time.monotonic() - started > SLOW_QUERY_SECONDS:
+            enter_degraded(f"slow {query_class} query")
+
+def cached_or_stale(key: str, ttl: float, compute: Callable,
+                    merge: Optional[Callable[[List], Any]] = None,
+                    query_class: str = 'dashboard') -> Tuple[Any, Optional[float]]:
+    """Value of compute(conn) cached under key, run in query_class.
+
+    With merge, compute runs on every shard and merge(results) combines them.
+    Returns (value, age): age is None for a fresh value, or the age in
+    seconds of the last known value served while degraded or overloaded.
+    """
+    cache = get_cache()
+    value = cache.get(key)
+    if value is not None:
+        return value, None
+
+    last = cache.get(f"{key}:last")
+    if last is not None and is_degraded():
+        return last[1], time.time() - last[0]
+    try:
+        if merge is None:
+            with admit(query_class) as conn:
+                value = compute(conn)
+        else:
+            value = merge(list(scatter(compute, open_conn=lambda shard: admit(query_class, shard)).values()))
+    except (Overloaded, BudgetExceeded, pymysql.OperationalError):
+        if last is None:
+            raise
+        return last[1], time.time() - last[0]
+
+    cache.set(key, value, ttl)
+    cache.set(f"{key}:last", (time.time(), value), STALE_TTL)
+    return value, None
+
+def admission_stats() -> Dict[str, Dict[str, int]]:
+    """In-flight and rejected queries per class in this process"""
+    with _stats_lock:
+        return {name: {'in_flight': pool.in_flight, 'rejected': pool.rejected,
+                       'limit': QUERY_CLASSES[name][0]}
+                for name, pool in _pools.items()}
@@ -0,0 +1,357 @@
+"""Headless JSON API over the registration workflow.
+
+Run it as its own service, independent of the Streamlit app:
+
+    uvicorn rto_api:app --host 0.0.0.0 --port 8000 --workers 8
+
+Every worker process keeps one database connection per thread and shard
+and an in-process cache of validated API tokens, so a steady stream of
+requests costs a single indexed query each. Requests about one registration
+go to its state's shard; listings ask every shard and merge (see rto_shards).
+"""
+import hashlib
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from operator import itemgetter
+from typing import Optional, Dict, List
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse, RedirectResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from rto_core import (
+    WorkflowError, connect, sanitize_input, authenticate,
+    update_registration_status, get_pending_registrations, get_owner_applications,
+    get_registration, SECURE_COOKIE, SESSION_COOKIE, SESSION_TTL, redeem_session_handoff
+)
+from rto_status import LookupThrottled, client_address, lookup_status
+from rto_catalog import canonicalize, get_catalog
+from rto_fees import with_fee
+from rto_documents import (
+    DocumentError, blob_path, detect_mime, get_registration_documents, parse_range,
+    read_range, signed_url, verify_signature
+)
+from rto_shards import (
+    SHARDS, connect_shard, create_sharded_registration, is_home, merge_sorted, mirror_users, scatter,
+    shard_for_reg_no, shard_for_registration, shard_for_state
+)
+
+MAX_BATCH_SIZE = 100
+MAX_PAGE_SIZE = 500
+TOKEN_CACHE_TTL = 60  # seconds
+APP_URL = os.environ.get("RTO_APP_URL", "http://localhost:8501/")  # where /session sends the browser back to
+
+app = FastAPI(title="RTO Vehicle Registration API", default_response_class=ORJSONResponse)
+
+# --- Connections ---
+_local = threading.local()
+
+def _open(shard: Optional[str]):
+    return connect() if shard is None else connect_shard(shard)
+
+def get_conn(shard: Optional[str] = None):
+    """Connection owned by the current worker thread to a shard (None: the home database)"""
+    if shard is not None and is_home(shard):
+        shard = None
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(shard)
+    if conn is None:
+        conn = conns[shard] = _open(shard)
+    else:
+        # Ends the previous request's read snapshot and checks the link
+        try:
+            conn.rollback()
+        except Exception:
+            conn = conns[shard] = _open(shard)
+    return conn
+
+def on_all_shards(fn) -> List:
+    """fn(conn) on every shard in parallel over this thread's connections, in shard order"""
+    conns = {shard: get_conn(shard) for shard in SHARDS}
+    return list(scatter(fn, open_conn=lambda shard: nullcontext(conns[shard])).values())
+
+# --- Token Authentication ---
+_token_cache: Dict[str, tuple] = {}
+_token_lock = threading.Lock()
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def issue_token(conn, user_id: int) -> str:
+    """Create a new API token for a user; only its hash is stored"""
+    token = secrets.token_urlsafe(32)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO api_tokens (token_hash, user_id) VALUES (%s, %s)",
+                       (_hash_token(token), user_id))
+        conn.commit()
+    finally:
+        cursor.close()
+    return token
+
+def current_user(authorization: str = Header(...)) -> Dict:
+    """Resolve the bearer token to an active user"""
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise HTTPException(status_code=401, detail="Bearer token required")
+
+    token_hash = _hash_token(token)
+    now = time.monotonic()
+    with _token_lock:
+        cached = _token_cache.get(token_hash)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    cursor = get_conn().cursor()
+    try:
+        cursor.execute("""
+            SELECT u.user_id, u.username, u.full_name, u.role
+            FROM api_tokens t
+            JOIN users u ON t.user_id = u.user_id
+            WHERE t.token_hash = %s AND t.revoked = FALSE AND u.is_active = TRUE
+        """, (token_hash,))
+        user = cursor.fetchone()
+    finally:
+        cursor.close()
+
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid or revoked token")
+    with _token_lock:
+        _token_cache[token_hash] = (now + TOKEN_CACHE_TTL, user)
+    return user
+
+def require_role(*roles: str):
+    """Dependency that only admits users with one of the given roles"""
+    def dependency(user: Dict = Depends(current_user)) -> Dict:
+        if user['role'] not in roles:
+            raise HTTPException(status_code=403, detail="Not allowed for this role")
+        return user
+    return dependency
+
+# --- Request Models ---
+class Credentials(BaseModel):
+    username: str
+    password: str
+
+class VehicleRegistration(BaseModel):
+    engine_no: str = Field(..., min_length=1, max_length=50)
+    chassis_no: str = Field(..., min_length=1, max_length=50)
+    manufacturer: str = Field(..., min_length=1, max_length=100)
+    model: str = Field(..., min_length=1, max_length=100)
+    vehicle_type: str = Field(..., pattern=r'^(2-wheeler|3-wheeler|4-wheeler|commercial|other)$')
+    fuel_type: str = Field(..., pattern=r'^(petrol|diesel|electric|cng|hybrid)$')
+    color: str = ''
+    manufacturing_year: int = Field(..., ge=1990)
+    seating_capacity: int = Field(..., ge=1, le=50)
+    state: str = Field(..., min_length=2, max_length=50)
+    district: str = Field(..., min_length=1, max_length=50)
+    idempotency_key: Optional[str] = Field(None, max_length=64)
+
+    def to_vehicle_data(self) -> Dict:
+        data = self.model_dump(exclude={'idempotency_key'})
+        for key in ('engine_no', 'chassis_no', 'manufacturer', 'model', 'color', 'state', 'district'):
+            data[key] = sanitize_input(data[key])
+        return data
+
+class StatusChange(BaseModel):
+    registration_id: int
+    status: str = Field(..., pattern=r'^(verified|approved|rejected)$')
+    remarks: Optional[str] = None
+
+# --- Endpoints ---
+@app.post("/auth/token")
+def login(credentials: Credentials):
+    """Exchange username and password for an API token"""
+    conn = get_conn()
+    user = authenticate(conn, credentials.username, credentials.password)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    return {"token": issue_token(conn, user['user_id']), "role": user['role']}
+
+@app.get("/session/start", include_in_schema=False)
+def start_browser_session(code: str = Query(..., max_length=64)):
+    """Set the app's HttpOnly session cookie for a login the app handed off, then go back to the app"""
+    token = redeem_session_handoff(code)
+    response = RedirectResponse(APP_URL, status_code=303)
+    if token:
+        response.set_cookie(SESSION_COOKIE, token, max_age=SESSION_TTL, path='/', secure=SECURE_COOKIE,
+                            httponly=True, samesite='strict')
+    return response
+
+@app.get("/session/end", include_in_schema=False)
+def end_browser_session(code: str = Query(..., max_length=64)):
+    """Clear the session cookie after a logout in the app, then go back to the app"""
+    response = RedirectResponse(APP_URL, status_code=303)
+    if redeem_session_handoff(code) == '':
+        response.delete_cookie(SESSION_COOKIE, path='/', secure=SECURE_COOKIE, httponly=True, samesite='strict')
+    return response
+
+def _submit(registration: VehicleRegistration, owner_id: int) -> Dict:
+    try:
+        vehicle_data = with_fee(get_conn(), canonicalize(get_conn(), registration.to_vehicle_data()))
+        shard = shard_for_state(vehicle_data['state'], write=True)
+        conn = get_conn(shard)
+        mirror_users(get_conn(), shard, conn, [owner_id])
+        reg_no = create_sharded_registration(get_conn(), conn, vehicle_data, owner_id,
+                                             registration.idempotency_key)
+        return {"success": True, "reg_no": reg_no, "fee": vehicle_data['fee']}
+    except WorkflowError as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/registrations")
+def submit_registration(registration: VehicleRegistration,
+                        idempotency_key: Optional[str] = Header(None, max_length=64),
+                        user: Dict = Depends(require_role('user'))):
+    """Submit one vehicle registration; retries with the same Idempotency-Key return the original reg_no"""
+    if idempotency_key and not registration.idempotency_key:
+        registration.idempotency_key = idempotency_key
+    result = _submit(registration, user['user_id'])
+    if not result['success']:
+        raise HTTPException(status_code=409, detail=result['error'])
+    return result
+
+@app.post("/registrations/batch")
+def submit_registrations(registrations: List[VehicleRegistration],
+                         user: Dict = Depends(require_role('user'))):
+    """Submit up to MAX_BATCH_SIZE registrations; results keep the input order"""
+    if len(registrations) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} items per batch")
+    return {"results": [_submit(r, user['user_id']) for r in registrations]}
+
+def _change_status(change: StatusChange, actor_id: int) -> Dict:
+    # A change racing a move of its state makes the move abort (see rto_shards.move_state)
+    shard = shard_for_registration(change.registration_id)
+    try:
+        if shard is None:
+            updated = False
+        else:
+            conn = get_conn(shard)
+            mirror_users(get_conn(), shard, conn, [actor_id])
+            updated = update_registration_status(conn, change.registration_id, change.status,
+                                                 actor_id, change.remarks)
+    except WorkflowError as e:
+        return {"registration_id": change.registration_id, "success": False, "error": str(e)}
+    if not updated:
+        return {"registration_id": change.registration_id, "success": False,
+                "error": "Registration not found or not eligible for this status"}
+    return {"registration_id": change.registration_id, "success": True}
+
+@app.post("/registrations/status")
+def change_status(change: StatusChange, user: Dict = Depends(require_role('admin'))):
+    """Verify, approve or reject one registration"""
+    result = _change_status(change, user['user_id'])
+    if not result['success']:
+        raise HTTPException(status_code=409, detail=result['error'])
+    return result
+
+@app.post("/registrations/status/batch")
+def change_statuses(changes: List[StatusChange], user: Dict = Depends(require_role('admin'))):
+    """Apply up to MAX_BATCH_SIZE status changes; results keep the input order"""
+    if len(changes) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} items per batch")
+    return {"results": [_change_status(c, user['user_id']) for c in changes]}
+
+@app.get("/registrations/pending")
+def pending_registrations(after_date: Optional[date] = None, after_id: int = 0,
+                          limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+                          user: Dict = Depends(require_role('admin'))):
+    """Pending queue, oldest first, paginated by (application_date, registration_id)"""
+    if after_id and after_date is None:
+        raise HTTPException(status_code=400, detail="after_id needs the after_date it was returned with")
+    after = (after_date, after_id) if after_date else None
+    # The shards' pages are combined on the same key the cursor follows
+    rows = merge_sorted(on_all_shards(lambda conn: get_pending_registrations(conn, after, limit)),
+                        key=itemgetter('application_date', 'registration_id'), limit=limit)
+    page = _page(rows, limit)
+    page["next_after_date"] = rows[-1]['application_date'] if page["next_after_id"] else None
+    return page
+
+@app.get("/applications")
+def my_applications(date_from: Optional[date] = None, date_to: Optional[date] = None,
+                    search_type: Optional[str] = None, search_term: Optional[str] = None,
+                    after_id: int = 0, limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+                    user: Dict = Depends(require_role('user'))):
+    """The caller's applications, paginated by registration_id"""
+    date_to = date_to or datetime.now().date()
+    date_from = date_from or date_to - timedelta(days=30)
+    rows = merge_sorted(on_all_shards(
+        lambda conn: get_owner_applications(conn, user['user_id'], date_from, date_to,
+                                            search_type, search_term, after_id, limit)
+    ), key=itemgetter('registration_id'), limit=limit)
+    return _page(rows, limit)
+
+@app.get("/registrations/{reg_no}")
+def registration_status(reg_no: str, user: Dict = Depends(current_user)):
+    """Current status of one registration"""
+    record = get_registration(get_conn(shard_for_reg_no(reg_no)), reg_no)
+    if not record or (user['role'] == 'user' and record['owner_id'] != user['user_id']):
+        raise HTTPException(status_code=404, detail="Registration not found")
+    return record
+
+@app.get("/registrations/{reg_no}/documents")
+def registration_documents(reg_no: str, user: Dict = Depends(current_user)):
+    """Uploaded documents of one registration with short-lived download links"""
+    conn = get_conn(shard_for_reg_no(reg_no))
+    record = get_registration(conn, reg_no)
+    if not record or (user['role'] == 'user' and record['owner_id'] != user['user_id']):
+        raise HTTPException(status_code=404, detail="Registration not found")
+    documents = get_registration_documents(conn, record['registration_id'])
+    for document in documents:
+        document['url'] = signed_url(document['sha256'])
+    return {"items": documents}
+
+@app.get("/documents/{sha256}")
+def download_document(sha256: str, expires: int, sig: str, range: Optional[str] = Header(None)):
+    """Original document behind a signed link; honours single byte ranges"""
+    if not re.fullmatch(r'[0-9a-f]{64}', sha256) or not verify_signature(sha256, expires, sig):
+        raise HTTPException(status_code=403, detail="Link is invalid or has expired")
+    path = blob_path(sha256)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(range, size)
+    except DocumentError as e:
+        raise HTTPException(status_code=416, detail=str(e), headers={'Content-Range': f'bytes */{size}'})
+    start, end = byte_range or (0, size - 1)
+    with open(path, 'rb') as f:
+        media_type = detect_mime(f.read(16)) or 'application/octet-stream'
+
+    headers = {'Accept-Ranges': 'bytes', 'Content-Length': str(end - start + 1),
+               'Cache-Control': 'private, max-age=600'}
+    if byte_range:
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return StreamingResponse(read_range(sha256, start, end), status_code=206 if byte_range else 200,
+                             media_type=media_type, headers=headers)
+
+@app.get("/catalog/search")
+def catalog_search(q: str = Query(..., min_length=1, max_length=100),
+                   limit: int = Query(10, ge=1, le=50), user: Dict = Depends(current_user)):
+    """Manufacturer/model autocomplete from the in-memory catalog index"""
+    return {"items": get_catalog(get_conn()).search(q, limit)}
+
+@app.get("/public/status/{reg_no}")
+def public_status(reg_no: str, request: Request, chassis_suffix: str = Query(..., min_length=4)):
+    """Unauthenticated status lookup; needs the last characters of the chassis number"""
+    client = client_address(request.client.host if request.client else None,
+                            request.headers.get('X-Forwarded-For')) or 'unknown'
+    try:
+        record = lookup_status(get_conn(shard_for_reg_no(reg_no)), reg_no, chassis_suffix, client)
+    except LookupThrottled as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    if not record:
+        raise HTTPException(status_code=404, detail="No registration matches these details")
+    return record
+
+def _page(rows: List[Dict], limit: int) -> Dict:
+    """Wrap a keyset page with the cursor for the next request"""
+    next_after = rows[-1]['registration_id'] if len(rows) == limit else None
+    return {"items": rows, "next_after_id": next_after}
@@ -0,0 +1,149 @@
+"""Query budgets: a server-enforced time limit and a row cap per page or query class.
+
+Each budget says how long the database may spend on any one SELECT and how
+many rows a listing may show. The time limit is set as the session's
+max_execution_time (max_statement_time on MariaDB) on connections reserved
+for that budget, so the server itself stops a statement that runs over and
+frees its thread; the page gets BudgetExceeded and says so instead of
+hanging. A connection is never switched between budgets: another thread
+could be running a statement on it under the old limit.
+Listings fetch one row more than their cap to know when they were cut.
+
+Admission classes (see rto_admission) are budgets too: their pooled
+connections carry the class's time limit. Runs, overruns and truncated
+listings are counted per budget in each process (System Logs page).
+Override the defaults with RTO_QUERY_BUDGETS, seconds and rows per budget,
+0 for no limit:
+
+    export RTO_QUERY_BUDGETS="pending=5:500,export=300:0"
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Tuple
+
+import pymysql
+
+from rto_rows import Columns
+
+# budget: (seconds per SELECT, rows shown); None means no limit
+QUERY_BUDGETS = {
+    'critical': (5.0, None),          # login and session checks
+    'dashboard': (2.0, None),         # sidebar stats, dashboard cards, recent activity
+    'export': (120.0, 100_000),       # explorer CSV export
+    'page': (10.0, None),             # any page query without a budget of its own
+    'pending': (3.0, 200),            # Approve Registrations, pending tab
+    'decided': (2.0, 20),             # Approve Registrations, approved/rejected tabs
+    'my_applications': (2.0, 500),
+    'explorer': (5.0, None),          # pages are already bounded by the page size
+    'analytics': (10.0, None),
+}
+ER_QUERY_TIMEOUT = 3024      # MySQL: maximum statement execution time exceeded
+ER_STATEMENT_TIMEOUT = 1969  # MariaDB: max_statement_time exceeded
+
+
+def parse_budgets(spec: str) -> Dict[str, Tuple[Optional[float], Optional[int]]]:
+    """QUERY_BUDGETS with 'name=seconds:rows,...' overrides applied; a part left out keeps its default"""
+    budgets = dict(QUERY_BUDGETS)
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, limits = item.partition('=')
+        seconds, _, rows = limits.partition(':')
+        default_seconds, default_rows = budgets.get(name.strip(), (None, None))
+        budgets[name.strip()] = (
+            (float(seconds) or None) if seconds else default_seconds,
+            (int(rows) or None) if rows else default_rows,
+        )
+    return budgets
+
+BUDGETS = parse_budgets(os.environ.get("RTO_QUERY_BUDGETS", ""))
+
+
+class BudgetExceeded(Exception):
+    """Raised when the server stopped a statement that ran past its budget's time limit"""
+
+    def __init__(self, budget: str):
+        super().__init__(f"This view took longer than {BUDGETS[budget][0]:g}s to load and was stopped. "
+                         f"Narrow the date range or filters and try again.")
+        self.budget = budget
+
+def is_timeout(error: Exception) -> bool:
+    """Whether a MySQL error is a statement stopped by its time limit"""
+    return (isinstance(error, pymysql.MySQLError) and bool(error.args)
+            and error.args[0] in (ER_QUERY_TIMEOUT, ER_STATEMENT_TIMEOUT))
+
+# --- Enforcement ---
+def limit_statements(conn, budget: str):
+    """Have the server stop this connection's SELECTs that run past the budget's time limit.
+
+    conn must be reserved for this budget (see the class pools in
+    rto_admission); it is an error to move a connection to another budget. The SET is only issued for a new server session, so
+    reusing a connection costs nothing.
+    """
+    seconds = BUDGETS[budget][0] or 0
+    applied = (conn.thread_id(), seconds)
+    current = getattr(conn, '_statement_limit', None)
+    if current == applied:
+        return
+    if current is not None and current[0] == applied[0]:
+        raise ValueError(f"Connection is reserved for a {current[1]:g}s budget, not {budget}")
+    cursor = conn.cursor()
+    try:
+        if 'MariaDB' in conn.get_server_info():
+            cursor.execute("SET SESSION max_statement_time = %s", (seconds,))
+        else:
+            cursor.execute("SET SESSION max_execution_time = %s", (int(seconds * 1000),))
+    finally:
+        cursor.close()
+    conn._statement_limit = applied
+
+def row_limit(budget: str) -> Optional[int]:
+    """LIMIT to fetch for a listing under budget: one more row than it may show"""
+    rows = BUDGETS[budget][1]
+    return rows + 1 if rows else None
+
+def cap_rows(budget: str, rows):
+    """(rows cut to the budget's cap, whether anything was cut); rows is a list or Columns"""
+    cap = BUDGETS[budget][1]
+    if not cap or len(rows) <= cap:
+        return rows, False
+    _record(budget, truncated=True)
+    return (rows.head(cap) if isinstance(rows, Columns) else rows[:cap]), True
+
+@contextmanager
+def within_budget(budget: str):
+    """Time the queries run inside and turn a server-side timeout into BudgetExceeded"""
+    started = time.monotonic()
+    try:
+        yield
+    except pymysql.MySQLError as e:
+        if not is_timeout(e):
+            raise
+        _record(budget, time.monotonic() - started, overrun=True)
+        raise BudgetExceeded(budget) from e
+    _record(budget, time.monotonic() - started)
+
+# --- Metrics ---
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+def _record(budget: str, seconds: Optional[float] = None, overrun: bool = False, truncated: bool = False):
+    with _stats_lock:
+        stats = _stats.setdefault(budget, {'runs': 0, 'overruns': 0, 'truncated': 0, 'seconds': 0.0, 'slowest': 0.0})
+        if seconds is not None:
+            stats['runs'] += 1
+            stats['seconds'] += seconds
+            stats['slowest'] = max(stats['slowest'], seconds)
+        stats['overruns'] += overrun
+        stats['truncated'] += truncated
+
+def budget_stats() -> List[Dict[str, Any]]:
+    """Limits and counters of every budget used in this process, most overruns first"""
+    with _stats_lock:
+        rows = [{'budget': budget, 'seconds_limit': BUDGETS.get(budget, (None, None))[0],
+                 'rows_limit': BUDGETS.get(budget, (None, None))[1], 'runs': int(stats['runs']),
+                 'overruns': int(stats['overruns']), 'truncated': int(stats['truncated']),
+                 'mean': stats['seconds'] / stats['runs'] if stats['runs'] else None,
+                 'slowest': stats['slowest'] if stats['runs'] else None}
+                for budget, stats in _stats.items()]
+    return sorted(rows, key=lambda row: (-row['overruns'], -row['truncated'], row['budget']))
@@ -0,0 +1,310 @@
+"""Application-level cache shared by every app process.
+
+The backend is chosen with RTO_CACHE_URL:
+
+    memory://                     in-process only (default)
+    sqlite:////var/lib/rto/cache.db   one SQLite file shared by local processes
+    redis://localhost:6379/0      Redis, shared across nodes (needs `redis`)
+
+It holds the dashboard stats, rate-limit counters, session tokens and the
+public status lookups. Values are cached in each process as well; when a
+key is invalidated, the change is broadcast to the other processes so they
+drop their local copies.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Any, List, Tuple
+
+CACHE_URL = os.environ.get("RTO_CACHE_URL", "memory://")
+LOCAL_MAX_ENTRIES = 100_000
+INVALIDATION_POLL_INTERVAL = 0.5  # seconds between checks for remote invalidations
+INVALIDATION_CHANNEL = "rto:invalidate"
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a per-entry TTL"""
+
+    def __init__(self, max_entries: int = LOCAL_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= now:
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+# --- Backends ---
+class MemoryBackend:
+    """Process-local backend; nothing to broadcast"""
+
+    shared = False
+
+    def __init__(self):
+        self._values = TTLCache()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._values.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._values.set(key, value, ttl)
+
+    def delete(self, key: str):
+        self._values.invalidate(key)
+
+    def incr(self, key: str, amount: int, ttl: float) -> int:
+        now = time.monotonic()
+        with self._lock:
+            value, expires = self._counters.get(key, (0, now + ttl))
+            if expires <= now:
+                value, expires = 0, now + ttl
+            value += amount
+            self._counters[key] = (value, expires)
+            if len(self._counters) > LOCAL_MAX_ENTRIES:
+                self._counters = {k: v for k, v in self._counters.items() if v[1] > now}
+            return value
+
+    def publish(self, key: str):
+        pass
+
+    def poll_invalidations(self) -> List[str]:
+        return []
+
+
+class SQLiteBackend:
+    """Backend in a SQLite file (WAL mode) shared by the processes of one host"""
+
+    shared = True
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_values (
+                    key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_counters (
+                    key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires REAL NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_invalidations (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, created REAL NOT NULL
+                )
+            """)
+            row = self._conn.execute("SELECT MAX(seq) FROM cache_invalidations").fetchone()
+        self._last_seq = row[0] or 0
+        self._last_purge = time.time()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache_values WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_values (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl)
+            )
+            self._purge()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_values WHERE key = ?", (key,))
+
+    def incr(self, key: str, amount: int, ttl: float) -> int:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO cache_counters (key, value, expires) VALUES (?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    value = CASE WHEN expires <= ? THEN excluded.value ELSE value + excluded.value END,
+                    expires = CASE WHEN expires <= ? THEN excluded.expires ELSE expires END
+            """, (key, amount, now + ttl, now, now))
+            return self._conn.execute(
+                "SELECT value FROM cache_counters WHERE key = ?", (key,)
+            ).fetchone()[0]
+
+    def publish(self, key: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO cache_invalidations (key, created) VALUES (?, ?)", (key, time.time())
+            )
+
+    def poll_invalidations(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, key FROM cache_invalidations WHERE seq > ? ORDER BY seq", (self._last_seq,)
+            ).fetchall()
+        if rows:
+            self._last_seq = rows[-1][0]
+        return [key for _, key in rows]
+
+    def _purge(self):
+        """Drop expired rows at most once a minute; caller holds the lock"""
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        self._conn.execute("DELETE FROM cache_values WHERE expires <= ?", (now,))
+        self._conn.execute("DELETE FROM cache_counters WHERE expires <= ?", (now,))
+        self._conn.execute("DELETE FROM cache_invalidations WHERE created <= ?", (now - 600,))
+
+
+class RedisBackend:
+    """Backend in Redis, shared across hosts"""
+
+    shared = True
+
+    def __init__(self, url: str):
+        import redis  # optional dependency, only needed for redis:// URLs
+        self._redis = redis.Redis.from_url(url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(INVALIDATION_CHANNEL)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._redis.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._redis.set(key, value, px=int(ttl * 1000))
+
+    def delete(self, key: str):
+        self._redis.delete(key)
+
+    def incr(self, key: str, amount: int, ttl: float) -> int:
+        value = self._redis.incrby(key, amount)
+        if value == amount:
+            self._redis.pexpire(key, int(ttl * 1000))
+        return value
+
+    def publish(self, key: str):
+        self._redis.publish(INVALIDATION_CHANNEL, key)
+
+    def poll_invalidations(self) -> List[str]:
+        keys = []
+        with self._lock:
+            message = self._pubsub.get_message(timeout=0)
+            while message:
+                keys.append(message['data'].decode('utf-8'))
+                message = self._pubsub.get_message(timeout=0)
+        return keys
+
+# --- Shared Cache ---
+class SharedCache:
+    """Cache over a backend with a per-process near cache kept coherent by invalidations"""
+
+    def __init__(self, backend, local_ttl: float = 5.0):
+        self.backend = backend
+        self.local_ttl = local_ttl
+        self._local = TTLCache() if backend.shared else None
+        self._next_poll = 0.0
+
+    def _sync(self):
+        if self._local is None:
+            return
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        self._next_poll = now + INVALIDATION_POLL_INTERVAL
+        for key in self.backend.poll_invalidations():
+            self._local.invalidate(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        self._sync()
+        if self._local is not None:
+            value = self._local.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        raw = self.backend.get(key)
+        if raw is None:
+            return default
+        value = pickle.loads(raw)
+        if self._local is not None:
+            self._local.set(key, value, self.local_ttl)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        self.backend.set(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ttl)
+        if self._local is not None:
+            self._local.set(key, value, min(ttl, self.local_ttl))
+
+    def invalidate(self, key: str):
+        """Delete a key everywhere and tell the other processes to drop their copy"""
+        self.backend.delete(key)
+        if self._local is not None:
+            self._local.invalidate(key)
+            self.backend.publish(key)
+
+    def incr(self, key: str, amount: int = 1, ttl: float = 60) -> int:
+        """Atomically add to a counter that resets ttl seconds after it was created"""
+        return self.backend.incr(key, amount, ttl)
+
+
+class RateLimiter:
+    """Fixed-window request counter per client, shared through the cache"""
+
+    def __init__(self, cache: SharedCache, name: str, per_minute: int):
+        self.cache = cache
+        self.name = name
+        self.per_minute = per_minute
+
+    def allow(self, client: str) -> bool:
+        window = int(time.time() // 60)
+        return self.cache.incr(f"rl:{self.name}:{client}:{window}", 1, 61) <= self.per_minute
+
+
+_MISSING = object()
+_cache: Optional[SharedCache] = None
+_cache_lock = threading.Lock()
+
+def create_backend(url: str):
+    """Backend for a cache URL"""
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBackend(url)
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    raise ValueError(f"Unsupported cache URL: {url}")
+
+def get_cache() -> SharedCache:
+    """The process-wide shared cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SharedCache(create_backend(CACHE_URL))
+    return _cache
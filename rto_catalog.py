@@ -0,0 +1,385 @@
+"""Canonical manufacturer/model catalog with an in-memory prefix index.
+
+vehicle_manufacturers and vehicle_models hold one row per real make and
+model. vehicle_model_aliases maps known misspellings to a model, and
+vehicles.model_id points at the catalog. Each process keeps a CatalogIndex:
+sorted search keys that are answered with bisect, so autocomplete never
+touches the database. The index is reloaded when catalog_state.version
+changes; every catalog write bumps it.
+
+The catalog lives in the home database while vehicles live on the shards:
+seeding reads the spellings of every shard and normalizing rewrites every
+shard's vehicles.
+
+    python rto_catalog.py --import catalog.csv      # manufacturer,model[,vehicle_type[,aliases]]
+    python rto_catalog.py --seed --min-count 3      # catalog from spellings already in vehicles
+    python rto_catalog.py --normalize [--fuzzy]     # point existing vehicles at catalog ids
+"""
+import argparse
+import csv
+import difflib
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Optional, Dict, List, Iterable, Tuple
+
+CATALOG_CHECK_INTERVAL = 30  # seconds between version checks per process
+NORMALIZE_BATCH_SIZE = 5000
+FUZZY_CUTOFF = 0.88
+
+
+def search_key(text: str) -> str:
+    """Lower-case words separated by single spaces, for prefix search"""
+    return ' '.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+def match_key(text: str) -> str:
+    """Letters and digits only, so 'Swift-Dzire' and 'swift dzire' compare equal"""
+    return ''.join(re.findall(r'[a-z0-9]+', text.lower()))
+
+# --- Schema ---
+def ensure_catalog_schema(conn):
+    """Create the catalog tables"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS vehicle_manufacturers (
+                manufacturer_id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                name_key VARCHAR(100) NOT NULL UNIQUE
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS vehicle_models (
+                model_id INT AUTO_INCREMENT PRIMARY KEY,
+                manufacturer_id INT NOT NULL,
+                name VARCHAR(100) NOT NULL,
+                name_key VARCHAR(100) NOT NULL,
+                vehicle_type VARCHAR(20),
+                UNIQUE KEY uq_model (manufacturer_id, name_key),
+                FOREIGN KEY (manufacturer_id) REFERENCES vehicle_manufacturers(manufacturer_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS vehicle_model_aliases (
+                alias_key VARCHAR(200) PRIMARY KEY,
+                model_id INT NOT NULL,
+                FOREIGN KEY (model_id) REFERENCES vehicle_models(model_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_state (
+                id TINYINT PRIMARY KEY,
+                version INT NOT NULL
+            )
+        """)
+        cursor.execute("INSERT IGNORE INTO catalog_state (id, version) VALUES (1, 0)")
+        conn.commit()
+    finally:
+        cursor.close()
+
+def _bump_version(cursor):
+    cursor.execute("UPDATE catalog_state SET version = version + 1 WHERE id = 1")
+
+# --- Index ---
+class CatalogIndex:
+    """Sorted prefix index over 'manufacturer model' and 'model' search keys"""
+
+    __slots__ = ('version', 'models', 'keys', 'refs', 'by_manufacturer', 'by_match_key')
+
+    def __init__(self, version: int, models: List[tuple], aliases: Iterable[Tuple[str, int]] = ()):
+        # models: (model_id, manufacturer, model, vehicle_type)
+        self.version = version
+        self.models = {row[0]: row for row in models}
+        pairs = []
+        self.by_manufacturer: Dict[str, List[tuple]] = defaultdict(list)
+        self.by_match_key: Dict[str, int] = {}
+        for model_id, manufacturer, model, _ in models:
+            pairs.append((search_key(f"{manufacturer} {model}"), model_id))
+            pairs.append((search_key(model), model_id))
+            self.by_manufacturer[manufacturer].append((model, model_id))
+            self.by_match_key[match_key(manufacturer + model)] = model_id
+        for alias_key, model_id in aliases:
+            if model_id in self.models:
+                self.by_match_key.setdefault(alias_key, model_id)
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.refs = [model_id for _, model_id in pairs]
+        for models_of in self.by_manufacturer.values():
+            models_of.sort()
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def search(self, prefix: str, limit: int = 10) -> List[Dict]:
+        """Models whose full or model-only name starts with prefix"""
+        key = search_key(prefix)
+        if not key:
+            return []
+        results, seen = [], set()
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i].startswith(key) and len(results) < limit:
+            model_id = self.refs[i]
+            if model_id not in seen:
+                seen.add(model_id)
+                results.append(self.describe(model_id))
+            i += 1
+        return results
+
+    def describe(self, model_id: int) -> Dict:
+        model_id, manufacturer, model, vehicle_type = self.models[model_id]
+        return {'model_id': model_id, 'manufacturer': manufacturer, 'model': model,
+                'vehicle_type': vehicle_type}
+
+    def manufacturer_names(self) -> List[str]:
+        return sorted(self.by_manufacturer)
+
+    def models_of(self, manufacturer: str) -> List[Tuple[str, int]]:
+        """(model, model_id) of one manufacturer, by name"""
+        return self.by_manufacturer.get(manufacturer, [])
+
+    def resolve(self, manufacturer: str, model: str) -> Optional[Dict]:
+        """Catalog entry for a free-text spelling, by exact key or alias"""
+        model_id = self.by_match_key.get(match_key(manufacturer + model))
+        return self.describe(model_id) if model_id is not None else None
+
+
+_index: Optional[CatalogIndex] = None
+_checked_at = 0.0
+_index_lock = threading.Lock()
+
+def _catalog_version(cursor) -> int:
+    cursor.execute("SELECT version FROM catalog_state WHERE id = 1")
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
+def load_index(conn) -> CatalogIndex:
+    """Read the whole catalog into a new index"""
+    cursor = conn.cursor()
+    try:
+        version = _catalog_version(cursor)
+        cursor.execute("""
+            SELECT m.model_id, f.name AS manufacturer, m.name AS model, m.vehicle_type
+            FROM vehicle_models m
+            JOIN vehicle_manufacturers f ON m.manufacturer_id = f.manufacturer_id
+        """)
+        models = [(r['model_id'], r['manufacturer'], r['model'], r['vehicle_type']) for r in cursor.fetchall()]
+        cursor.execute("SELECT alias_key, model_id FROM vehicle_model_aliases")
+        aliases = [(r['alias_key'], r['model_id']) for r in cursor.fetchall()]
+    finally:
+        cursor.close()
+    return CatalogIndex(version, models, aliases)
+
+def get_catalog(conn) -> CatalogIndex:
+    """This process's index, reloaded when the catalog version has moved.
+
+    conn is None while the database is unreachable: the last index loaded
+    (or an empty one) is served until it is back.
+    """
+    global _index, _checked_at
+    if conn is None:
+        return _index if _index is not None else CatalogIndex(0, [])
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < CATALOG_CHECK_INTERVAL:
+        return _index
+    with _index_lock:
+        if _index is None or now - _checked_at >= CATALOG_CHECK_INTERVAL:
+            cursor = conn.cursor()
+            try:
+                version = _catalog_version(cursor)
+            finally:
+                cursor.close()
+            if _index is None or _index.version != version:
+                _index = load_index(conn)
+            _checked_at = now
+    return _index
+
+def canonicalize(conn, vehicle_data: dict) -> dict:
+    """vehicle_data with catalog spellings and model_id when the model is known"""
+    entry = get_catalog(conn).resolve(vehicle_data['manufacturer'], vehicle_data['model'])
+    if entry is None:
+        return dict(vehicle_data, model_id=None)
+    return dict(vehicle_data, manufacturer=entry['manufacturer'], model=entry['model'],
+                model_id=entry['model_id'])
+
+# --- Writes ---
+def import_catalog(conn, rows: Iterable[Dict]) -> int:
+    """Add manufacturer/model rows with optional vehicle_type and ';'-separated model misspellings"""
+    cursor = conn.cursor()
+    imported = 0
+    try:
+        for row in rows:
+            manufacturer, model = row['manufacturer'].strip(), row['model'].strip()
+            if not manufacturer or not model:
+                continue
+            cursor.execute("""
+                INSERT INTO vehicle_manufacturers (name, name_key) VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE manufacturer_id = LAST_INSERT_ID(manufacturer_id)
+            """, (manufacturer, match_key(manufacturer)))
+            manufacturer_id = cursor.lastrowid
+            cursor.execute("""
+                INSERT INTO vehicle_models (manufacturer_id, name, name_key, vehicle_type)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE model_id = LAST_INSERT_ID(model_id),
+                    vehicle_type = COALESCE(VALUES(vehicle_type), vehicle_type)
+            """, (manufacturer_id, model, match_key(model), row.get('vehicle_type') or None))
+            model_id = cursor.lastrowid
+            aliases = [a for a in (row.get('aliases') or '').split(';') if a.strip()]
+            if aliases:
+                cursor.executemany("""
+                    INSERT IGNORE INTO vehicle_model_aliases (alias_key, model_id) VALUES (%s, %s)
+                """, [(match_key(manufacturer + alias), model_id) for alias in aliases])
+            imported += 1
+        _bump_version(cursor)
+        conn.commit()
+        return imported
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _vehicle_spellings(conn) -> List[Dict]:
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT manufacturer, model, vehicle_type, COUNT(*) AS uses
+            FROM vehicles
+            GROUP BY manufacturer, model, vehicle_type
+        """)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def seed_from_vehicles(conn, min_count: int = 3, sharded: bool = True) -> int:
+    """Catalog the most common spelling of every make/model seen at least min_count times.
+
+    Spellings are counted over every shard's vehicles, or only conn's with
+    sharded=False; the catalog is written through conn.
+    """
+    if sharded:
+        from rto_shards import scatter
+        spellings = [row for rows in scatter(_vehicle_spellings).values() for row in rows]
+    else:
+        spellings = _vehicle_spellings(conn)
+
+    groups: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+    types: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+    for row in spellings:
+        key = (match_key(row['manufacturer']), match_key(row['model']))
+        groups[key][(row['manufacturer'].strip(), row['model'].strip())] += row['uses']
+        types[key][row['vehicle_type']] += row['uses']
+    rows = []
+    for key, counts in groups.items():
+        if sum(counts.values()) >= min_count:
+            manufacturer, model = counts.most_common(1)[0][0]
+            rows.append({'manufacturer': manufacturer, 'model': model,
+                         'vehicle_type': types[key].most_common(1)[0][0]})
+    return import_catalog(conn, rows)
+
+def normalize_vehicles(conn, fuzzy: bool = False, batch_size: int = NORMALIZE_BATCH_SIZE,
+                       sharded: bool = True) -> Dict:
+    """Point uncatalogued vehicles at catalog models and rewrite their spelling.
+
+    Vehicles are rewritten on every shard, or only in conn's database with
+    sharded=False. With fuzzy=True, close misspellings within the same
+    manufacturer are matched too and saved in conn's catalog as aliases so
+    later lookups are exact.
+    """
+    index = load_index(conn)
+    model_keys = defaultdict(dict)  # manufacturer match key -> model match key -> model_id
+    for model_id, manufacturer, model, _ in index.models.values():
+        model_keys[match_key(manufacturer)][match_key(model)] = model_id
+
+    matched, new_aliases, unmatched = 0, {}, Counter()
+    if sharded:
+        from rto_shards import SHARDS, open_shard
+        for shard in SHARDS:
+            with open_shard(shard) as db:
+                matched += _normalize_batches(db, index, model_keys, fuzzy, batch_size, new_aliases, unmatched)
+    else:
+        matched = _normalize_batches(conn, index, model_keys, fuzzy, batch_size, new_aliases, unmatched)
+
+    if new_aliases:
+        cursor = conn.cursor()
+        try:
+            cursor.executemany("""
+                INSERT IGNORE INTO vehicle_model_aliases (alias_key, model_id) VALUES (%s, %s)
+            """, list(new_aliases.items()))
+            _bump_version(cursor)
+            conn.commit()
+        finally:
+            cursor.close()
+    return {'matched': matched, 'new_aliases': len(new_aliases),
+            'unmatched': sum(unmatched.values()), 'top_unmatched': unmatched.most_common(20)}
+
+def _normalize_batches(conn, index: CatalogIndex, model_keys: Dict, fuzzy: bool, batch_size: int,
+                       new_aliases: Dict[str, int], unmatched: Counter) -> int:
+    """Normalize one database's vehicles in id batches; the number matched"""
+    matched, last_id = 0, 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute("""
+                SELECT vehicle_id, manufacturer, model FROM vehicles
+                WHERE model_id IS NULL AND vehicle_id > %s
+                ORDER BY vehicle_id
+                LIMIT %s
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['vehicle_id']
+
+            updates = []
+            for row in rows:
+                entry = index.resolve(row['manufacturer'], row['model'])
+                if entry is None and fuzzy:
+                    candidates = model_keys.get(match_key(row['manufacturer']), {})
+                    close = difflib.get_close_matches(match_key(row['model']), list(candidates),
+                                                      n=1, cutoff=FUZZY_CUTOFF)
+                    if close:
+                        entry = index.describe(candidates[close[0]])
+                        new_aliases[match_key(row['manufacturer'] + row['model'])] = entry['model_id']
+                if entry is None:
+                    unmatched[(row['manufacturer'], row['model'])] += 1
+                    continue
+                updates.append((entry['model_id'], entry['manufacturer'], entry['model'], row['vehicle_id']))
+
+            if updates:
+                cursor.executemany("""
+                    UPDATE vehicles SET model_id = %s, manufacturer = %s, model = %s
+                    WHERE vehicle_id = %s
+                """, updates)
+            conn.commit()
+            matched += len(updates)
+    finally:
+        cursor.close()
+    return matched
+
+if __name__ == "__main__":
+    from rto_core import connect, ensure_schema
+
+    parser = argparse.ArgumentParser(description="Maintain the vehicle catalog")
+    parser.add_argument('--import', dest='import_path', help="CSV with manufacturer,model[,vehicle_type,aliases]")
+    parser.add_argument('--seed', action='store_true', help="catalog spellings already used in vehicles")
+    parser.add_argument('--min-count', type=int, default=3)
+    parser.add_argument('--normalize', action='store_true', help="map existing vehicles to catalog ids")
+    parser.add_argument('--fuzzy', action='store_true', help="also match close misspellings")
+    args = parser.parse_args()
+
+    conn = connect()
+    ensure_schema(conn)
+    ensure_catalog_schema(conn)
+    if args.import_path:
+        with open(args.import_path, newline='', encoding='utf-8') as f:
+            print(f"Imported {import_catalog(conn, csv.DictReader(f))} models")
+    if args.seed:
+        print(f"Seeded {seed_from_vehicles(conn, args.min_count)} models")
+    if args.normalize:
+        result = normalize_vehicles(conn, fuzzy=args.fuzzy)
+        print(f"Matched {result['matched']} vehicles, {result['new_aliases']} new aliases, "
+              f"{result['unmatched']} unmatched")
+        for (manufacturer, model), count in result['top_unmatched']:
+            print(f"  {count:>6}  {manufacturer} / {model}")
@@ -0,0 +1,764 @@
+"""Registration workflow shared by the Streamlit app and the HTTP API.
+
+Nothing in this module imports Streamlit, so it can be reused from worker
+processes, the API service and command-line tools.
+"""
+import os
+import re
+import secrets
+from datetime import date
+from typing import Optional, Dict, List, Tuple
+
+import bcrypt
+import pymysql
+from pymysql import IntegrityError
+from pymysql.constants.ER import DUP_ENTRY as ER_DUP_ENTRY
+
+from rto_cache import get_cache
+from rto_status import invalidate_status
+
+# --- Database Configuration & Security ---
+DB_HOST = os.environ.get("RTO_DB_HOST", "localhost")
+DB_PORT = int(os.environ.get("RTO_DB_PORT", "3306"))
+DB_USER = os.environ.get("RTO_DB_USER", "root")
+DB_PASSWORD = os.environ.get("RTO_DB_PASSWORD", "P@sahu15")
+DB_NAME = os.environ.get("RTO_DB_NAME", "rto_vehicle_system")
+
+# Status a registration may move to, and the statuses it may move from
+STATUS_TRANSITIONS = {
+    'verified': ('pending',),
+    'approved': ('pending', 'verified'),
+    'rejected': ('pending', 'verified'),
+}
+
+
+# Shared cache key of the dashboard statistics; dropped on every write
+STATS_CACHE_KEY = 'stats:global'
+
+def owner_stats_key(owner_id: int) -> str:
+    """Shared cache key of one owner's dashboard; dropped when any of their registrations changes"""
+    return f"stats:owner:{owner_id}"
+
+
+# One outbox row per channel the owner can be reached on, for the status just set
+ENQUEUE_NOTIFICATIONS_SQL = """
+    INSERT INTO notification_outbox (registration_id, reg_no, event, channel, recipient,
+        full_name, remarks)
+    SELECT r.registration_id, r.reg_no, r.status, c.channel,
+           CASE c.channel WHEN 'email' THEN u.email ELSE u.phone END,
+           u.full_name, r.remarks
+    FROM registrations r
+    JOIN users u ON r.owner_id = u.user_id
+    CROSS JOIN (SELECT 'email' AS channel UNION ALL SELECT 'sms') c
+    WHERE r.registration_id = %s
+    AND COALESCE(CASE c.channel WHEN 'email' THEN u.email ELSE u.phone END, '') <> ''
+"""
+
+
+class WorkflowError(Exception):
+    """Raised when a registration action cannot be applied"""
+
+class DuplicateVehicle(WorkflowError):
+    """Raised when the engine or chassis number is already registered"""
+
+# Whole submission in one call: idempotency check, vehicle insert,
+# registration number, registration and its fee share a single transaction.
+SUBMIT_REGISTRATION_PROC = """
+    CREATE PROCEDURE submit_registration(
+        IN p_idempotency_key VARCHAR(64), IN p_owner_id INT,
+        IN p_engine_no VARCHAR(50), IN p_chassis_no VARCHAR(50),
+        IN p_manufacturer VARCHAR(100), IN p_model VARCHAR(100), IN p_model_id INT,
+        IN p_vehicle_type VARCHAR(20), IN p_fuel_type VARCHAR(20),
+        IN p_color VARCHAR(50), IN p_manufacturing_year INT, IN p_seating_capacity INT,
+        IN p_state VARCHAR(50), IN p_district VARCHAR(50),
+        IN p_fee DECIMAL(10, 2), IN p_fee_version INT
+    )
+    proc: BEGIN
+        DECLARE v_vehicle_id INT;
+        DECLARE v_state_code CHAR(2) DEFAULT UPPER(LEFT(p_state, 2));
+        DECLARE v_series CHAR(2) DEFAULT DATE_FORMAT(CURDATE(), '%y');
+        DECLARE v_number INT;
+        DECLARE v_reg_no VARCHAR(20);
+        DECLARE v_registration_id INT;
+        DECLARE EXIT HANDLER FOR SQLEXCEPTION
+        BEGIN
+            ROLLBACK;
+            RESIGNAL;
+        END;
+
+        START TRANSACTION;
+
+        -- A retry blocks here until the first attempt commits or rolls back
+        IF p_idempotency_key IS NOT NULL THEN
+            INSERT IGNORE INTO submission_keys (owner_id, idempotency_key)
+            VALUES (p_owner_id, p_idempotency_key);
+            IF ROW_COUNT() = 0 THEN
+                SET v_reg_no = (SELECT reg_no FROM submission_keys
+                                WHERE owner_id = p_owner_id
+                                AND idempotency_key = p_idempotency_key);
+                COMMIT;
+                SELECT v_reg_no AS reg_no, TRUE AS replayed;
+                LEAVE proc;
+            END IF;
+        END IF;
+
+        -- The unique engine/chassis indexes reject duplicates
+        INSERT INTO vehicles (engine_no, chassis_no, manufacturer, model, model_id,
+        vehicle_type, fuel_type, color, manufacturing_year, seating_capacity)
+        VALUES (p_engine_no, p_chassis_no, p_manufacturer, p_model, p_model_id,
+        p_vehicle_type, p_fuel_type, p_color, p_manufacturing_year, p_seating_capacity);
+        SET v_vehicle_id = LAST_INSERT_ID();
+
+        INSERT INTO registration_series (state_code, series_year, last_number)
+        VALUES (v_state_code, v_series, LAST_INSERT_ID(1))
+        ON DUPLICATE KEY UPDATE last_number = LAST_INSERT_ID(last_number + 1);
+        SET v_number = LAST_INSERT_ID();
+
+        -- Format: StateCode-SeriesNumber-UniqueNumber
+        SET v_reg_no = CONCAT(v_state_code, v_series,
+                              IF(v_number < 10000, LPAD(v_number, 4, '0'), v_number));
+
+        INSERT INTO registrations (reg_no, vehicle_id, owner_id, state, district,
+        application_date, status)
+        VALUES (v_reg_no, v_vehicle_id, p_owner_id, p_state, p_district, CURDATE(), 'pending');
+        SET v_registration_id = LAST_INSERT_ID();
+
+        -- Fee quoted by rto_fees from the schedule in force today
+        IF p_fee IS NOT NULL THEN
+            INSERT INTO payments (registration_id, amount, payment_mode, payment_status, fee_version)
+            VALUES (v_registration_id, p_fee, 'online', 'pending', p_fee_version);
+        END IF;
+
+        IF p_idempotency_key IS NOT NULL THEN
+            UPDATE submission_keys SET reg_no = v_reg_no
+            WHERE owner_id = p_owner_id AND idempotency_key = p_idempotency_key;
+        END IF;
+
+        COMMIT;
+        SELECT v_reg_no AS reg_no, FALSE AS replayed;
+    END
+"""
+
+# Registration counts per state and year, the starting point of registration_series
+SERIES_BACKFILL_SQL = """
+    INSERT IGNORE INTO registration_series (state_code, series_year, last_number)
+    SELECT UPPER(LEFT(state, 2)), DATE_FORMAT(application_date, '%y'), COUNT(*)
+    FROM registrations
+    GROUP BY UPPER(LEFT(state, 2)), DATE_FORMAT(application_date, '%y')
+"""
+
+# Secondary indexes created by ensure_schema: name -> (table, columns).
+# Listing filters and sorts are restricted to these access paths.
+INDEXES = {
+    'idx_reg_status_date': ('registrations', 'status, application_date, registration_id'),
+    'idx_reg_state_district_date': ('registrations', 'state, district, application_date, registration_id'),
+    'idx_reg_date': ('registrations', 'application_date, registration_id'),
+    'idx_reg_owner_date': ('registrations', 'owner_id, application_date'),
+    'idx_reg_created': ('registrations', 'created_at'),
+    'idx_users_full_name': ('users', 'full_name'),
+    'idx_vehicles_model': ('vehicles', 'model_id'),
+    'idx_outbox_sent': ('notification_outbox', 'state, sent_at'),
+}
+
+# Columns added after the first release: (table, column) -> definition
+COLUMNS = {
+    ('vehicles', 'model_id'): 'INT NULL AFTER model',  # vehicle catalog id, see rto_catalog
+    ('payments', 'fee_version'): 'INT NULL AFTER amount',  # fee schedule version, see rto_fees
+}
+
+# Stored routines created by ensure_schema: name -> (kind, version, DDL).
+# Bump the version when the DDL changes so existing databases pick it up.
+ROUTINES = {
+    'submit_registration': ('PROCEDURE', 'v3', SUBMIT_REGISTRATION_PROC),
+}
+
+
+def connect(database: str = DB_NAME, cursorclass=pymysql.cursors.DictCursor,
+            host: str = DB_HOST, port: int = DB_PORT):
+    """Open a new database connection"""
+    return pymysql.connect(
+        host=host,
+        port=port,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=database,
+        charset='utf8mb4',
+        cursorclass=cursorclass
+    )
+
+# --- Security Functions ---
+def hash_password(password: str) -> str:
+    """Hash password using bcrypt"""
+    salt = bcrypt.gensalt()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
+    return hashed.decode('utf-8')
+
+def verify_password(password: str, hashed: str) -> bool:
+    """Verify password against hash"""
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+def sanitize_input(text: str) -> str:
+    """Basic input sanitization"""
+    return re.sub(r'[<>"\']', '', text).strip()
+
+# --- Schema Setup ---
+def ensure_schema(conn):
+    """Create all necessary tables with proper schema design."""
+    cursor = conn.cursor()
+    try:
+        # Users table for authentication and roles
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                full_name VARCHAR(100) NOT NULL,
+                email VARCHAR(100),
+                phone VARCHAR(15),
+                role ENUM('admin', 'user', 'inspector') DEFAULT 'user',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_active BOOLEAN DEFAULT TRUE
+            )
+        """)
+
+        # Vehicles table with comprehensive details
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS vehicles (
+                vehicle_id INT AUTO_INCREMENT PRIMARY KEY,
+                engine_no VARCHAR(50) UNIQUE NOT NULL,
+                chassis_no VARCHAR(50) UNIQUE NOT NULL,
+                manufacturer VARCHAR(100) NOT NULL,
+                model VARCHAR(100) NOT NULL,
+                model_id INT,
+                vehicle_type ENUM('2-wheeler', '3-wheeler', '4-wheeler', 'commercial', 'other') NOT NULL,
+                fuel_type ENUM('petrol', 'diesel', 'electric', 'cng', 'hybrid') NOT NULL,
+                color VARCHAR(50),
+                manufacturing_year YEAR,
+                seating_capacity INT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Registrations table with status tracking
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS registrations (
+                registration_id INT AUTO_INCREMENT PRIMARY KEY,
+                reg_no VARCHAR(20) UNIQUE NOT NULL,
+                vehicle_id INT,
+                owner_id INT,
+                state VARCHAR(50) NOT NULL,
+                district VARCHAR(50) NOT NULL,
+                application_date DATE NOT NULL,
+                registration_date DATE,
+                status ENUM('pending', 'approved', 'rejected', 'verified') DEFAULT 'pending',
+                status_updated_by INT,
+                status_updated_at TIMESTAMP,
+                remarks TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (vehicle_id) REFERENCES vehicles(vehicle_id),
+                FOREIGN KEY (owner_id) REFERENCES users(user_id),
+                FOREIGN KEY (status_updated_by) REFERENCES users(user_id)
+            )
+        """)
+
+        # Payment tracking (optional)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS payments (
+                payment_id INT AUTO_INCREMENT PRIMARY KEY,
+                registration_id INT,
+                amount DECIMAL(10, 2) NOT NULL,
+                payment_mode ENUM('online', 'cash', 'cheque') NOT NULL,
+                transaction_id VARCHAR(100),
+                payment_status ENUM('pending', 'completed', 'failed') DEFAULT 'pending',
+                payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (registration_id) REFERENCES registrations(registration_id)
+            )
+        """)
+
+        # Audit logs for security
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS audit_logs (
+                log_id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT,
+                action VARCHAR(100) NOT NULL,
+                table_name VARCHAR(50),
+                record_id INT,
+                old_values TEXT,
+                new_values TEXT,
+                ip_address VARCHAR(45),
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+        """)
+
+        # API access tokens (only the SHA-256 of a token is stored)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS api_tokens (
+                token_hash CHAR(64) PRIMARY KEY,
+                user_id INT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                revoked BOOLEAN DEFAULT FALSE,
+                FOREIGN KEY (user_id) REFERENCES users(user_id)
+            )
+        """)
+
+        # Per-state, per-year counters behind registration numbers
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS registration_series (
+                state_code CHAR(2) NOT NULL,
+                series_year CHAR(2) NOT NULL,
+                last_number INT NOT NULL,
+                PRIMARY KEY (state_code, series_year)
+            )
+        """)
+
+        # Client-supplied idempotency keys and the reg_no they produced
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS submission_keys (
+                owner_id INT NOT NULL,
+                idempotency_key VARCHAR(64) NOT NULL,
+                reg_no VARCHAR(20),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (owner_id, idempotency_key)
+            )
+        """)
+
+        # Owner notifications written with each status change, delivered by rto_notify
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                outbox_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                registration_id INT NOT NULL,
+                reg_no VARCHAR(20) NOT NULL,
+                event VARCHAR(20) NOT NULL,
+                channel ENUM('email', 'sms') NOT NULL,
+                recipient VARCHAR(100) NOT NULL,
+                full_name VARCHAR(100),
+                remarks TEXT,
+                state ENUM('pending', 'sent', 'dead') DEFAULT 'pending',
+                attempts INT NOT NULL DEFAULT 0,
+                next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                last_error VARCHAR(255),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at DATETIME,
+                INDEX idx_outbox_due (state, channel, next_attempt_at)
+            )
+        """)
+
+        # Seed the counters once from the registrations that already exist
+        cursor.execute("SELECT 1 FROM registration_series LIMIT 1")
+        if not cursor.fetchone():
+            cursor.execute(SERIES_BACKFILL_SQL)
+
+        # Versions of the stored routines and triggers created below
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_objects (
+                object_name VARCHAR(64) PRIMARY KEY,
+                version VARCHAR(20) NOT NULL
+            )
+        """)
+
+        for (table, column), definition in COLUMNS.items():
+            ensure_column(cursor, table, column, definition)
+
+        for name, (kind, version, ddl) in ROUTINES.items():
+            ensure_object(cursor, kind, name, version, ddl)
+
+        for name, (table, columns) in INDEXES.items():
+            ensure_index(cursor, table, name, columns)
+
+        conn.commit()
+
+        # Create default admin user if not exists
+        cursor.execute("SELECT * FROM users WHERE username = 'admin'")
+        if not cursor.fetchone():
+            admin_hash = hash_password("admin@123")
+            cursor.execute("""
+                INSERT INTO users (username, password_hash, full_name, role)
+                VALUES ('admin', %s, 'System Administrator', 'admin')
+            """, (admin_hash,))
+            conn.commit()
+    finally:
+        cursor.close()
+
+def ensure_object(cursor, kind: str, name: str, version: str, ddl: str):
+    """(Re)create a stored routine or trigger unless this version already exists"""
+    cursor.execute("SELECT version FROM schema_objects WHERE object_name = %s", (name,))
+    existing = cursor.fetchone()
+    if existing and existing['version'] == version:
+        return
+    cursor.execute(f"DROP {kind} IF EXISTS {name}")
+    cursor.execute(ddl)
+    cursor.execute("""
+        INSERT INTO schema_objects (object_name, version) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE version = VALUES(version)
+    """, (name, version))
+
+def lock_registrations(cursor):
+    """Hold off writes to registrations, and so their triggers, until the transaction ends"""
+    cursor.execute("SELECT COUNT(*) AS n FROM registrations FORCE INDEX (PRIMARY) LOCK IN SHARE MODE")
+
+def ensure_column(cursor, table: str, name: str, definition: str):
+    """Add a column to an existing table unless it is already there"""
+    cursor.execute("""
+        SELECT 1 FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        LIMIT 1
+    """, (table, name))
+    if not cursor.fetchone():
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+def ensure_index(cursor, table: str, name: str, columns: str):
+    """Create a secondary index unless it already exists"""
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        LIMIT 1
+    """, (table, name))
+    if not cursor.fetchone():
+        cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+
+# --- Authentication ---
+def authenticate(conn, username: str, password: str) -> Optional[Dict]:
+    """Return the active user matching the credentials, or None"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT * FROM users WHERE username = %s AND is_active = TRUE", (username,))
+        user = cursor.fetchone()
+        if user and verify_password(password, user['password_hash']):
+            return user
+        return None
+    finally:
+        cursor.close()
+
+def get_active_user(conn, user_id: int) -> Optional[Dict]:
+    """The user's current row if the account is still active, else None"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT * FROM users WHERE user_id = %s AND is_active = TRUE", (user_id,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+# --- Browser Sessions ---
+# The app keeps logins in the shared cache under session:<token>; the token
+# reaches the browser only as an HttpOnly cookie set by the API (see rto_api)
+SESSION_COOKIE = 'rto_sid'
+SESSION_TTL = 8 * 3600  # seconds a login stays valid in the shared session store
+SECURE_COOKIE = os.environ.get("RTO_COOKIE_SECURE", "1") == "1"  # 0 only for plain-HTTP testing
+HANDOFF_TTL = 60        # seconds the browser has to pick up a handed-off session
+
+def hand_off_session(token: str) -> str:
+    """One-time code under which the API's /session endpoints pick up token ('' clears the cookie)"""
+    code = secrets.token_urlsafe(24)
+    get_cache().set(f"session_handoff:{code}", token, HANDOFF_TTL)
+    return code
+
+def redeem_session_handoff(code: str) -> Optional[str]:
+    """The token handed off under code, once; None for an unknown, expired or used code"""
+    key = f"session_handoff:{code}"
+    token = get_cache().get(key)
+    get_cache().invalidate(key)
+    return token
+
+# --- Registration Workflow ---
+def create_registration(conn, vehicle_data: dict, owner_id: int,
+                        idempotency_key: Optional[str] = None) -> str:
+    """Submit a vehicle and its pending registration in one round trip, returning the reg_no.
+
+    Submitting again with the same idempotency_key returns the original reg_no
+    instead of creating a second registration. A 'fee' in vehicle_data (see
+    rto_fees.with_fee) is recorded as the registration's pending payment.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "CALL submit_registration(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            (
+                idempotency_key, owner_id,
+                vehicle_data['engine_no'], vehicle_data['chassis_no'],
+                vehicle_data['manufacturer'], vehicle_data['model'], vehicle_data.get('model_id'),
+                vehicle_data['vehicle_type'], vehicle_data['fuel_type'],
+                vehicle_data['color'], vehicle_data['manufacturing_year'],
+                vehicle_data['seating_capacity'],
+                vehicle_data['state'], vehicle_data['district'],
+                vehicle_data.get('fee'), vehicle_data.get('fee_version')
+            )
+        )
+        reg_no = cursor.fetchone()['reg_no']
+        get_cache().invalidate(STATS_CACHE_KEY)
+        get_cache().invalidate(owner_stats_key(owner_id))
+        return reg_no
+
+    except IntegrityError as e:
+        conn.rollback()
+        if e.args and e.args[0] == ER_DUP_ENTRY and ('engine_no' in str(e) or 'chassis_no' in str(e)):
+            raise DuplicateVehicle("Engine or Chassis number already exists!")
+        raise WorkflowError("Database error, please try again.")
+    except (pymysql.OperationalError, pymysql.InterfaceError):
+        # Connection trouble: the caller may retry or spool with the same idempotency key
+        raise
+    except pymysql.MySQLError:
+        conn.rollback()
+        raise WorkflowError("Database error, please try again.")
+    finally:
+        cursor.close()
+
+def update_registration_status(conn, registration_id: int, status: str,
+                               actor_id: int, remarks: Optional[str] = None) -> bool:
+    """Move a registration to a new status; returns False if it was not eligible"""
+    if status not in STATUS_TRANSITIONS:
+        raise WorkflowError(f"Unknown status: {status}")
+    if status == 'rejected' and not remarks:
+        raise WorkflowError("Please provide remarks for rejection")
+
+    assignments = ["status = %s", "status_updated_by = %s", "status_updated_at = NOW()"]
+    params = [status, actor_id]
+    if status == 'approved':
+        assignments.append("registration_date = CURDATE()")
+    if remarks:
+        assignments.append("remarks = %s")
+        params.append(remarks)
+
+    allowed_from = STATUS_TRANSITIONS[status]
+    params.append(registration_id)
+    params.extend(allowed_from)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            UPDATE registrations
+            SET {', '.join(assignments)}
+            WHERE registration_id = %s
+            AND status IN ({', '.join(['%s'] * len(allowed_from))})
+        """, params)
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return False
+
+        # Queued in the same transaction; delivery happens in rto_notify workers
+        cursor.execute(ENQUEUE_NOTIFICATIONS_SQL, (registration_id,))
+        cursor.execute("SELECT reg_no, owner_id FROM registrations WHERE registration_id = %s",
+                       (registration_id,))
+        row = cursor.fetchone()
+        conn.commit()
+
+        get_cache().invalidate(STATS_CACHE_KEY)
+        if row:
+            invalidate_status(row['reg_no'])
+            get_cache().invalidate(owner_stats_key(row['owner_id']))
+        return True
+    except pymysql.MySQLError:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+# --- Queries ---
+# The *_query builders return (sql, params) so listings can run them on
+# compact tuple cursors (see rto_rows) while the API keeps dict rows.
+
+def pending_registrations_query(after: Optional[Tuple[date, int]] = None,
+                                limit: Optional[int] = None) -> Tuple[str, List]:
+    """Pending registrations with owner and vehicle details, oldest first.
+
+    after is the (application_date, registration_id) of the last row already
+    seen; the cursor follows the sort order so no row is skipped.
+    """
+    query = """
+        SELECT r.registration_id, r.reg_no, r.application_date,
+               u.full_name, u.phone, v.vehicle_id, v.engine_no, v.chassis_no,
+               v.manufacturer, v.model, v.vehicle_type, v.fuel_type, v.color,
+               v.manufacturing_year, v.seating_capacity
+        FROM registrations r
+        JOIN users u ON r.owner_id = u.user_id
+        JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+        WHERE r.status = 'pending'
+    """
+    params = []
+    if after:
+        # Spelled out rather than as a row comparison so it stays a range on idx_reg_status_date
+        query += " AND (r.application_date > %s OR (r.application_date = %s AND r.registration_id > %s))"
+        params += [after[0], after[0], after[1]]
+    query += " ORDER BY r.application_date, r.registration_id"
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+def owner_applications_query(owner_id: int, date_from: date, date_to: date,
+                             search_type: Optional[str] = None, search_term: Optional[str] = None,
+                             after_id: int = 0, limit: Optional[int] = None) -> Tuple[str, List]:
+    """Applications of one owner, optionally filtered the way My Applications does"""
+    query = """
+        SELECT r.registration_id, r.reg_no, r.application_date, r.status, r.registration_date,
+               v.model, v.vehicle_type, v.fuel_type, r.remarks
+        FROM registrations r
+        JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+        WHERE r.owner_id = %s
+        AND r.application_date BETWEEN %s AND %s
+        AND r.registration_id > %s
+    """
+    params = [owner_id, date_from, date_to, after_id]
+
+    if search_term:
+        if search_type == "Registration Number":
+            query += " AND r.reg_no LIKE %s"
+            params.append(f"%{search_term}%")
+        elif search_type == "Vehicle Model":
+            query += " AND v.model LIKE %s"
+            params.append(f"%{search_term}%")
+        elif search_type == "Status":
+            query += " AND r.status = %s"
+            params.append(search_term)
+
+    query += " ORDER BY r.registration_id"
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+def recent_activity_query(limit: int = 10) -> Tuple[str, List]:
+    """Latest registrations for the dashboard, newest first"""
+    return """
+        SELECT r.reg_no, r.status, r.application_date, u.full_name, v.model, r.created_at
+        FROM registrations r
+        JOIN users u ON r.owner_id = u.user_id
+        JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+        ORDER BY r.created_at DESC
+        LIMIT %s
+    """, [limit]
+
+def decided_registrations_query(status: str, limit: int = 20) -> Tuple[str, List]:
+    """Most recently decided registrations of one status, for the admin status tabs"""
+    return """
+        SELECT r.reg_no, r.application_date, r.registration_date,
+               u.full_name, v.model, r.status, r.remarks, r.status_updated_at
+        FROM registrations r
+        JOIN users u ON r.owner_id = u.user_id
+        JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+        WHERE r.status = %s
+        ORDER BY r.status_updated_at DESC
+        LIMIT %s
+    """, [status, limit]
+
+def owner_summary_query(owner_id: int, limit: int = 5) -> Tuple[str, List]:
+    """An owner's latest registrations, each carrying the status counts of all of them.
+
+    The window counts run over every row idx_reg_owner_date finds for the
+    owner before LIMIT applies, so one pass answers both.
+    """
+    return """
+        SELECT r.registration_id, r.reg_no, r.status, r.application_date, r.status_updated_at,
+               r.remarks, v.manufacturer, v.model,
+               COUNT(*) OVER () AS total,
+               SUM(r.status = 'pending') OVER () AS pending,
+               SUM(r.status = 'verified') OVER () AS verified,
+               SUM(r.status = 'approved') OVER () AS approved,
+               SUM(r.status = 'rejected') OVER () AS rejected
+        FROM registrations r
+        JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+        WHERE r.owner_id = %s
+        ORDER BY r.application_date DESC, r.registration_id DESC
+        LIMIT %s
+    """, [owner_id, limit]
+
+def compute_owner_summary(conn, owner_id: int, limit: int = 5) -> Dict:
+    """Status counts and latest registrations of one owner on one shard"""
+    rows = _fetch_dicts(conn, *owner_summary_query(owner_id, limit))
+    counts = {key: int(rows[0][key]) if rows else 0
+              for key in ('total', 'pending', 'verified', 'approved', 'rejected')}
+    latest = [{key: row[key] for key in ('registration_id', 'reg_no', 'status', 'application_date',
+                                         'status_updated_at', 'remarks', 'manufacturer', 'model')}
+              for row in rows]
+    return {'counts': counts, 'latest': latest}
+
+def compute_registration_stats(conn) -> Dict:
+    """Dashboard statistics of one shard; merge shards with merge_counts"""
+    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        stats = {}
+
+        # Basic counts
+        cursor.execute("SELECT COUNT(*) as total FROM registrations")
+        stats['total'] = cursor.fetchone()['total']
+
+        cursor.execute("SELECT COUNT(*) as pending FROM registrations WHERE status = 'pending'")
+        stats['pending'] = cursor.fetchone()['pending']
+
+        cursor.execute("SELECT COUNT(*) as approved FROM registrations WHERE status = 'approved'")
+        stats['approved'] = cursor.fetchone()['approved']
+
+        # Monthly registrations
+        cursor.execute("""
+            SELECT DATE_FORMAT(application_date, '%Y-%m') as month, 
+                   COUNT(*) as count
+            FROM registrations
+            WHERE application_date >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH)
+            GROUP BY month
+            ORDER BY month
+        """)
+        stats['monthly'] = cursor.fetchall()
+
+        # Vehicle type distribution
+        cursor.execute("""
+            SELECT v.vehicle_type, COUNT(*) as count
+            FROM vehicles v
+            JOIN registrations r ON v.vehicle_id = r.vehicle_id
+            GROUP BY v.vehicle_type
+        """)
+        stats['vehicle_types'] = cursor.fetchall()
+
+        # Fuel type analysis
+        cursor.execute("""
+            SELECT v.fuel_type, COUNT(*) as count
+            FROM vehicles v
+            JOIN registrations r ON v.vehicle_id = r.vehicle_id
+            GROUP BY v.fuel_type
+        """)
+        stats['fuel_types'] = cursor.fetchall()
+
+        # Decided applications, the base of the approval rate
+        cursor.execute("""
+            SELECT COUNT(*) as decided
+            FROM registrations
+            WHERE status IN ('approved', 'rejected')
+        """)
+        stats['decided'] = cursor.fetchone()['decided']
+
+        return stats
+    finally:
+        cursor.close()
+
+def _fetch_dicts(conn, query: str, params: List) -> List[Dict]:
+    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def get_pending_registrations(conn, after: Optional[Tuple[date, int]] = None,
+                              limit: Optional[int] = None) -> List[Dict]:
+    """Pending registrations as dict rows"""
+    return _fetch_dicts(conn, *pending_registrations_query(after, limit))
+
+def get_owner_applications(conn, owner_id: int, date_from: date, date_to: date,
+                           search_type: Optional[str] = None, search_term: Optional[str] = None,
+                           after_id: int = 0, limit: Optional[int] = None) -> List[Dict]:
+    """Owner applications as dict rows"""
+    return _fetch_dicts(conn, *owner_applications_query(owner_id, date_from, date_to, search_type,
+                                                        search_term, after_id, limit))
+
+def get_registration(conn, reg_no: str) -> Optional[Dict]:
+    """Single registration by reg_no"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT r.registration_id, r.reg_no, r.owner_id, r.state, r.district,
+                   r.application_date, r.registration_date, r.status, r.remarks
+            FROM registrations r
+            WHERE r.reg_no = %s
+        """, (reg_no,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
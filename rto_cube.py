@@ -0,0 +1,224 @@
+"""Pre-aggregated registration cube for the Analytics page.
+
+registration_cube holds registration counts per period at day, week, month
+and year grain, sliced by state, district, vehicle type, fuel type and
+status. Triggers on registrations keep it current, so every Analytics
+query reads a small number of cube rows instead of grouping the raw
+registrations and vehicles tables.
+
+Each shard keeps the cube of its own registrations. Rebuild every
+shard's cube from scratch with:
+
+    python rto_cube.py --rebuild
+"""
+import argparse
+from datetime import date, timedelta
+from typing import Optional, Dict, List
+
+from rto_core import ensure_object, lock_registrations
+
+GRAINS = ('day', 'week', 'month', 'year')
+DIMENSIONS = ('state', 'district', 'vehicle_type', 'fuel_type', 'status')
+
+# Start of the period containing {d}, for the grain named by g.grain
+PERIOD_START_SQL = """
+    CASE g.grain
+        WHEN 'day' THEN {d}
+        WHEN 'week' THEN {d} - INTERVAL WEEKDAY({d}) DAY
+        WHEN 'month' THEN {d} - INTERVAL (DAYOFMONTH({d}) - 1) DAY
+        ELSE MAKEDATE(YEAR({d}), 1)
+    END
+"""
+
+GRAIN_ROWS_SQL = """
+    (SELECT 'day' AS grain UNION ALL SELECT 'week'
+     UNION ALL SELECT 'month' UNION ALL SELECT 'year') g
+"""
+
+def _apply_row_sql(row: str, delta: int) -> str:
+    """Statement adding delta to every grain's cube cell for the OLD/NEW row"""
+    sign = '+' if delta > 0 else '-'
+    return f"""
+        INSERT INTO registration_cube (grain, period_start, state, district,
+                                       vehicle_type, fuel_type, status, reg_count)
+        SELECT g.grain, {PERIOD_START_SQL.format(d=f'{row}.application_date')},
+               {row}.state, {row}.district, v.vehicle_type, v.fuel_type, {row}.status, {delta}
+        FROM vehicles v
+        CROSS JOIN {GRAIN_ROWS_SQL}
+        WHERE v.vehicle_id = {row}.vehicle_id
+        ON DUPLICATE KEY UPDATE reg_count = reg_count {sign} 1
+    """
+
+CUBE_TRIGGERS = {
+    'registrations_cube_insert': ('TRIGGER', 'v1', f"""
+        CREATE TRIGGER registrations_cube_insert AFTER INSERT ON registrations
+        FOR EACH ROW {_apply_row_sql('NEW', 1)}
+    """),
+    'registrations_cube_update': ('TRIGGER', 'v1', f"""
+        CREATE TRIGGER registrations_cube_update AFTER UPDATE ON registrations
+        FOR EACH ROW
+        BEGIN
+            IF NOT (OLD.status <=> NEW.status AND OLD.state <=> NEW.state
+                    AND OLD.district <=> NEW.district
+                    AND OLD.application_date <=> NEW.application_date
+                    AND OLD.vehicle_id <=> NEW.vehicle_id) THEN
+                {_apply_row_sql('OLD', -1)};
+                {_apply_row_sql('NEW', 1)};
+            END IF;
+        END
+    """),
+    'registrations_cube_delete': ('TRIGGER', 'v1', f"""
+        CREATE TRIGGER registrations_cube_delete AFTER DELETE ON registrations
+        FOR EACH ROW {_apply_row_sql('OLD', -1)}
+    """),
+}
+
+# --- Schema ---
+def ensure_cube_schema(conn):
+    """Create the cube table and its maintenance triggers, backfilling a new cube"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS registration_cube (
+                grain ENUM('day', 'week', 'month', 'year') NOT NULL,
+                period_start DATE NOT NULL,
+                state VARCHAR(50) NOT NULL,
+                district VARCHAR(50) NOT NULL,
+                vehicle_type VARCHAR(20) NOT NULL,
+                fuel_type VARCHAR(20) NOT NULL,
+                status VARCHAR(10) NOT NULL,
+                reg_count INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (grain, period_start, state, district, vehicle_type, fuel_type, status),
+                INDEX idx_cube_state (grain, state, period_start)
+            )
+        """)
+
+        cursor.execute("SELECT 1 FROM registration_cube LIMIT 1")
+        new_cube = not cursor.fetchone()
+
+        for name, (kind, version, ddl) in CUBE_TRIGGERS.items():
+            ensure_object(cursor, kind, name, version, ddl)
+        conn.commit()
+    finally:
+        cursor.close()
+    # Only now that the triggers count every new write can the backfill miss none
+    if new_cube:
+        rebuild_cube(conn)
+
+def _fill_cube(cursor):
+    """Aggregate every registration into the cube in one pass per grain"""
+    cursor.execute(f"""
+        INSERT INTO registration_cube (grain, period_start, state, district,
+                                       vehicle_type, fuel_type, status, reg_count)
+        SELECT g.grain, {PERIOD_START_SQL.format(d='r.application_date')} AS period,
+               r.state, r.district, v.vehicle_type, v.fuel_type, r.status, COUNT(*)
+        FROM registrations r
+        JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+        CROSS JOIN {GRAIN_ROWS_SQL}
+        GROUP BY g.grain, period, r.state, r.district, v.vehicle_type, v.fuel_type, r.status
+    """)
+
+def rebuild_cube(conn):
+    """Recompute the whole cube from registrations, with writes held off meanwhile"""
+    cursor = conn.cursor()
+    try:
+        lock_registrations(cursor)
+        cursor.execute("DELETE FROM registration_cube")
+        _fill_cube(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+# --- Queries ---
+def period_start(day: date, grain: str) -> date:
+    """Start of the period containing day"""
+    if grain == 'week':
+        return day - timedelta(days=day.weekday())
+    if grain == 'month':
+        return day.replace(day=1)
+    if grain == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+def query_cube(conn, grain: str, date_from: date, date_to: date,
+               filters: Optional[Dict[str, List[str]]] = None,
+               group_by: Optional[str] = None, by_period: bool = True) -> List[Dict]:
+    """Registration counts for a slice of the cube.
+
+    Periods that overlap [date_from, date_to] are counted whole. filters maps
+    a dimension to the values to keep; group_by adds one dimension column.
+    """
+    if grain not in GRAINS:
+        raise ValueError(f"Unknown grain: {grain}")
+    if group_by is not None and group_by not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {group_by}")
+
+    columns = []
+    if by_period:
+        columns.append('period_start')
+    if group_by:
+        columns.append(group_by)
+
+    query = "SELECT " + ", ".join(columns + ["SUM(reg_count) AS count"]) + """
+        FROM registration_cube
+        WHERE grain = %s AND period_start BETWEEN %s AND %s
+    """
+    params = [grain, period_start(date_from, grain), date_to]
+
+    for dimension, values in (filters or {}).items():
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {dimension}")
+        if values:
+            query += f" AND {dimension} IN ({', '.join(['%s'] * len(values))})"
+            params.extend(values)
+
+    if columns:
+        query += f" GROUP BY {', '.join(columns)} HAVING count > 0 ORDER BY {', '.join(columns)}"
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    for row in rows:
+        row['count'] = int(row['count'] or 0)
+    return rows
+
+def dimension_values(conn, dimension: str, filters: Optional[Dict[str, List[str]]] = None) -> List[str]:
+    """Distinct values of a dimension, narrowed by the filters (for drill-down)"""
+    if dimension not in DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {dimension}")
+    query = f"SELECT DISTINCT {dimension} AS value FROM registration_cube WHERE grain = 'year'"
+    params = []
+    for name, values in (filters or {}).items():
+        if name not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension: {name}")
+        if values:
+            query += f" AND {name} IN ({', '.join(['%s'] * len(values))})"
+            params.extend(values)
+    query += f" AND reg_count > 0 ORDER BY {dimension}"
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        return [row['value'] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the registration cube")
+    parser.add_argument('--rebuild', action='store_true', help="recompute the cube from registrations")
+    args = parser.parse_args()
+
+    from rto_shards import SHARDS, open_shard
+
+    for shard in SHARDS:
+        with open_shard(shard) as db:
+            ensure_cube_schema(db)
+            if args.rebuild:
+                rebuild_cube(db)
+                print(f"{shard}: registration cube rebuilt")
@@ -0,0 +1,405 @@
+"""Content-addressed store for registration documents.
+
+Uploads are streamed to disk in CHUNK_SIZE pieces while being hashed and
+kept once per SHA-256 under documents/blobs/ab/cd/<sha256>. The same scan
+uploaded twice therefore takes the space of one. The database only holds
+metadata:
+  * document_blobs has one row per distinct content;
+  * registration_documents records which blob a registration uses as which
+    document type.
+
+Thumbnails and PDF page images are made in a background process pool after
+the upload is stored, so neither the form nor the database waits on them.
+Reviewers see those small previews. The API serves originals with HTTP
+Range support behind short-lived signed URLs.
+
+    python rto_documents.py --process-pending   # previews missed by a crash or restart
+    python rto_documents.py --gc                # delete blobs no registration refers to
+
+Blob files are shared by every shard (see rto_shards), so the maintenance
+commands look at the metadata of all of them.
+
+Links are signed with RTO_DOCUMENT_SECRET. Without it, the first process
+generates a key and keeps it in DOCUMENTS_DIR, which the app and the API
+share anyway, so every process signs and checks links with the same key.
+"""
+import argparse
+import hashlib
+import hmac
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, List, Iterator, Tuple
+from urllib.parse import urlencode
+
+from rto_shards import SHARDS, connect_shard
+
+DOCUMENTS_DIR = os.environ.get(
+    "RTO_DOCUMENTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'documents')
+)
+# Shared by the app and the API so links signed by one are accepted by the other
+DOCUMENT_SECRET = os.environ.get("RTO_DOCUMENT_SECRET")
+SECRET_FILE = os.path.join(DOCUMENTS_DIR, 'signing.key')
+API_URL = os.environ.get("RTO_API_URL", "http://localhost:8000")
+
+CHUNK_SIZE = 1 << 20
+MAX_DOCUMENT_BYTES = 20 << 20
+SIGNED_URL_TTL = 600
+PROCESS_WORKERS = 2
+THUMBNAIL_SIZE = (320, 320)
+PREVIEW_PAGES = 5  # PDF pages rendered for reviewers
+GC_MIN_AGE = 24 * 3600
+
+DOC_TYPES = {
+    'address_proof': "Address Proof",
+    'identity_proof': "Identity Proof",
+    'invoice': "Vehicle Invoice",
+}
+
+MIME_SIGNATURES = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+)
+
+
+class DocumentError(Exception):
+    """Raised for uploads or range requests that cannot be served"""
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(DOCUMENTS_DIR, 'blobs', sha256[:2], sha256[2:4], sha256)
+
+def preview_dir(sha256: str) -> str:
+    return os.path.join(DOCUMENTS_DIR, 'previews', sha256[:2], sha256)
+
+def detect_mime(head: bytes) -> Optional[str]:
+    """Accepted MIME type of a file from its first bytes"""
+    return next((mime for signature, mime in MIME_SIGNATURES if head.startswith(signature)), None)
+
+# --- Storing ---
+def store_upload(fileobj) -> Dict:
+    """Stream a file-like object into the store; returns {'sha256', 'size', 'mime_type'}"""
+    tmp_dir = os.path.join(DOCUMENTS_DIR, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, secrets.token_hex(16))
+    digest = hashlib.sha256()
+    size = 0
+    mime_type = None
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if mime_type is None:
+                    mime_type = detect_mime(chunk)
+                    if mime_type is None:
+                        raise DocumentError("Only PDF, PNG and JPEG documents are accepted")
+                size += len(chunk)
+                if size > MAX_DOCUMENT_BYTES:
+                    raise DocumentError(f"Documents may be at most {MAX_DOCUMENT_BYTES >> 20} MB")
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise DocumentError("The uploaded document is empty")
+
+        sha256 = digest.hexdigest()
+        final_path = blob_path(sha256)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)  # same content already stored
+            os.utime(final_path)  # fresh again, so garbage collection leaves it alone
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+        return {'sha256': sha256, 'size': size, 'mime_type': mime_type}
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# --- Metadata ---
+def ensure_documents_schema(conn):
+    """Create the document metadata tables"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS document_blobs (
+                sha256 CHAR(64) PRIMARY KEY,
+                size_bytes BIGINT NOT NULL,
+                mime_type VARCHAR(50) NOT NULL,
+                page_count INT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                processed_at DATETIME,
+                INDEX idx_blobs_unprocessed (processed_at)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS registration_documents (
+                document_id INT AUTO_INCREMENT PRIMARY KEY,
+                registration_id INT NOT NULL,
+                doc_type VARCHAR(20) NOT NULL,
+                sha256 CHAR(64) NOT NULL,
+                original_name VARCHAR(255),
+                uploaded_by INT,
+                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_registration_doc (registration_id, doc_type),
+                INDEX idx_documents_blob (sha256),
+                FOREIGN KEY (registration_id) REFERENCES registrations(registration_id),
+                FOREIGN KEY (sha256) REFERENCES document_blobs(sha256)
+            )
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+def attach_documents(conn, reg_no: str, documents: Dict[str, Tuple[Dict, str]], uploaded_by: int):
+    """Link stored blobs to a registration: {doc_type: (store_upload() result, original name)}"""
+    cursor = conn.cursor()
+    try:
+        for doc_type, (blob, original_name) in documents.items():
+            if doc_type not in DOC_TYPES:
+                raise DocumentError(f"Unknown document type: {doc_type}")
+            cursor.execute("""
+                INSERT IGNORE INTO document_blobs (sha256, size_bytes, mime_type)
+                VALUES (%s, %s, %s)
+            """, (blob['sha256'], blob['size'], blob['mime_type']))
+            cursor.execute("""
+                INSERT INTO registration_documents (registration_id, doc_type, sha256,
+                    original_name, uploaded_by)
+                SELECT registration_id, %s, %s, %s, %s FROM registrations WHERE reg_no = %s
+                ON DUPLICATE KEY UPDATE sha256 = VALUES(sha256),
+                    original_name = VALUES(original_name), uploaded_at = CURRENT_TIMESTAMP
+            """, (doc_type, blob['sha256'], original_name[:255], uploaded_by, reg_no))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def get_registration_documents(conn, registration_id: int) -> List[Dict]:
+    """Documents of one registration with their blob metadata"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT d.doc_type, d.sha256, d.original_name, d.uploaded_at,
+                   b.size_bytes, b.mime_type, b.page_count, b.processed_at
+            FROM registration_documents d
+            JOIN document_blobs b ON d.sha256 = b.sha256
+            WHERE d.registration_id = %s
+            ORDER BY d.doc_type
+        """, (registration_id,))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+# --- Background Processing ---
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def schedule_processing(blobs: List[Dict]):
+    """Queue preview generation without waiting for it"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: the pool may be started from a threaded web server
+            _executor = ProcessPoolExecutor(PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    for blob in blobs:
+        _executor.submit(process_blob, blob['sha256'], blob['mime_type'])
+
+def _render_previews(sha256: str, mime_type: str) -> Optional[int]:
+    """Write thumb.png (and page-N.png for PDFs); returns the PDF page count"""
+    try:
+        from PIL import Image  # optional: previews are skipped without Pillow
+    except ImportError:
+        return None
+    out_dir = preview_dir(sha256)
+    os.makedirs(out_dir, exist_ok=True)
+
+    if mime_type != 'application/pdf':
+        with Image.open(blob_path(sha256)) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            image.convert('RGB').save(os.path.join(out_dir, 'thumb.png'))
+        return None
+
+    try:
+        import pypdfium2 as pdfium  # optional: PDF pages need pypdfium2
+    except ImportError:
+        return None
+    pdf = pdfium.PdfDocument(blob_path(sha256))
+    try:
+        page_count = len(pdf)
+        for index in range(min(page_count, PREVIEW_PAGES)):
+            page_image = pdf[index].render(scale=1.5).to_pil()
+            page_image.save(os.path.join(out_dir, f'page-{index + 1}.png'))
+            if index == 0:
+                page_image.thumbnail(THUMBNAIL_SIZE)
+                page_image.save(os.path.join(out_dir, 'thumb.png'))
+        return page_count
+    finally:
+        pdf.close()
+
+def process_blob(sha256: str, mime_type: str):
+    """Runs in a pool process: render previews and mark the blob processed"""
+    try:
+        page_count = _render_previews(sha256, mime_type)
+    except Exception as e:  # a corrupt scan must not stop the pool
+        print(f"preview of {sha256} failed: {e}")
+        page_count = None
+    # The same content may be attached on several shards
+    for shard in SHARDS:
+        conn = connect_shard(shard)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE document_blobs SET page_count = %s, processed_at = NOW() WHERE sha256 = %s
+            """, (page_count, sha256))
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+def preview_images(sha256: str) -> Dict[str, object]:
+    """{'thumbnail': path or None, 'pages': [paths]} of the rendered previews"""
+    out_dir = preview_dir(sha256)
+    thumbnail = os.path.join(out_dir, 'thumb.png')
+    pages = []
+    for index in range(1, PREVIEW_PAGES + 1):
+        path = os.path.join(out_dir, f'page-{index}.png')
+        if not os.path.exists(path):
+            break
+        pages.append(path)
+    return {'thumbnail': thumbnail if os.path.exists(thumbnail) else None, 'pages': pages}
+
+# --- Serving ---
+_signing_key: Optional[bytes] = None
+
+def _shared_secret() -> str:
+    """The generated key in SECRET_FILE, created by whichever process gets there first"""
+    if not os.path.exists(SECRET_FILE):
+        os.makedirs(DOCUMENTS_DIR, exist_ok=True)
+        tmp = f"{SECRET_FILE}.tmp{os.getpid()}"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='ascii') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(tmp, SECRET_FILE)  # fails if another process won, so both end up reading its key
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+    with open(SECRET_FILE, encoding='ascii') as f:
+        return f.read().strip()
+
+def _signature(sha256: str, expires: int) -> str:
+    global _signing_key
+    if _signing_key is None:
+        _signing_key = (DOCUMENT_SECRET or _shared_secret()).encode('utf-8')
+    return hmac.new(_signing_key, f"{sha256}:{expires}".encode('utf-8'), hashlib.sha256).hexdigest()
+
+def signed_url(sha256: str, ttl: int = SIGNED_URL_TTL) -> str:
+    """API link to an original that works without a token until it expires"""
+    expires = int(time.time()) + ttl
+    return f"{API_URL}/documents/{sha256}?{urlencode({'expires': expires, 'sig': _signature(sha256, expires)})}"
+
+def verify_signature(sha256: str, expires: int, sig: str) -> bool:
+    return expires >= time.time() and hmac.compare_digest(_signature(sha256, expires), sig)
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a single 'bytes=' range, None for the whole file"""
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None  # multi-range requests get the whole file
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise DocumentError(f"Range not satisfiable for {size} bytes")
+    return start, end
+
+def read_range(sha256: str, start: int, end: int) -> Iterator[bytes]:
+    """Bytes start..end (inclusive) of a blob in CHUNK_SIZE pieces"""
+    with open(blob_path(sha256), 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+# --- Maintenance ---
+def process_pending(conn) -> int:
+    """Render previews of blobs that were stored but never processed"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT sha256, mime_type FROM document_blobs WHERE processed_at IS NULL")
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    for row in rows:
+        process_blob(row['sha256'], row['mime_type'])
+    return len(rows)
+
+def collect_garbage(conns: List, min_age: int = GC_MIN_AGE) -> int:
+    """Delete blob files that no registration on any of the shard connections refers to
+    (uploads of failed submissions)"""
+    blobs_dir = os.path.join(DOCUMENTS_DIR, 'blobs')
+    candidates = []
+    for root, _, files in os.walk(blobs_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if time.time() - os.path.getmtime(path) > min_age:
+                candidates.append((name, path))
+
+    removed = 0
+    cursors = [conn.cursor() for conn in conns]
+    try:
+        for i in range(0, len(candidates), 500):
+            batch = candidates[i:i + 500]
+            referenced = set()
+            for cursor in cursors:
+                cursor.execute(f"""
+                    SELECT DISTINCT sha256 FROM registration_documents
+                    WHERE sha256 IN ({', '.join(['%s'] * len(batch))})
+                """, [name for name, _ in batch])
+                referenced.update(row['sha256'] for row in cursor.fetchall())
+            for name, path in batch:
+                if name not in referenced:
+                    os.remove(path)
+                    for cursor in cursors:
+                        cursor.execute("DELETE FROM document_blobs WHERE sha256 = %s", (name,))
+                    removed += 1
+            for conn in conns:
+                conn.commit()
+    finally:
+        for cursor in cursors:
+            cursor.close()
+    return removed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the document store")
+    parser.add_argument('--process-pending', action='store_true', help="render missing previews")
+    parser.add_argument('--gc', action='store_true', help="delete unreferenced blobs")
+    args = parser.parse_args()
+
+    conns = [connect_shard(shard) for shard in SHARDS]
+    for conn in conns:
+        ensure_documents_schema(conn)
+    if args.process_pending:
+        print(f"Processed {sum(process_pending(conn) for conn in conns)} documents")
+    if args.gc:
+        print(f"Removed {collect_garbage(conns)} unreferenced blobs")
@@ -0,0 +1,277 @@
+"""Server-side registration explorer for admins.
+
+Filters, sorting and keyset pagination run in MySQL over the indexed
+registrations columns. Every page is a bounded range read, however deep
+the user pages. Facet counts are computed in one pass. Without an owner
+filter they come from the registration cube. With one they come from a
+single GROUP BY, which is cached, or replaced by the optimizer's row
+estimate when the match is too large to count interactively.
+
+With several shards (see rto_shards) each page and facet count is fetched
+from every shard and combined with merge_pages() and merge_facets().
+"""
+import hashlib
+import json
+from dataclasses import dataclass, field
+from datetime import date
+from functools import cmp_to_key
+from typing import Optional, Dict, List, Tuple, Any, Callable
+
+from rto_cache import get_cache
+from rto_rows import Columns, fetch_columns, fetch_records
+from rto_shards import merge_sorted
+
+FACET_DIMENSIONS = ('state', 'district', 'vehicle_type', 'fuel_type', 'status')
+FACET_CACHE_TTL = 120
+FACET_EXACT_LIMIT = 500_000  # estimated matches above this are not counted exactly
+PAGE_SIZES = (25, 50, 100, 200)
+
+# Sortable columns: NOT NULL and covered by an index on registrations
+SORT_COLUMNS = {
+    'application_date': 'r.application_date',
+    'created_at': 'r.created_at',
+    'reg_no': 'r.reg_no',
+    'state': 'r.state',
+    'district': 'r.district',
+}
+
+SELECT_SQL = """
+    SELECT r.registration_id, r.reg_no, r.application_date, r.created_at, r.status,
+           r.state, r.district, u.full_name, v.manufacturer, v.model,
+           v.vehicle_type, v.fuel_type
+    FROM registrations r
+    JOIN users u ON r.owner_id = u.user_id
+    JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+"""
+
+FILTER_COLUMNS = {
+    'state': 'r.state',
+    'district': 'r.district',
+    'status': 'r.status',
+    'vehicle_type': 'v.vehicle_type',
+    'fuel_type': 'v.fuel_type',
+}
+
+
+@dataclass
+class ExplorerQuery:
+    """Filters and ordering of one explorer view"""
+    date_from: date
+    date_to: date
+    filters: Dict[str, List[str]] = field(default_factory=dict)
+    owner: str = ''
+    sort: List[Tuple[str, str]] = field(default_factory=lambda: [('application_date', 'desc')])
+
+    def cache_key(self) -> str:
+        payload = json.dumps([str(self.date_from), str(self.date_to),
+                              {k: sorted(v) for k, v in sorted(self.filters.items()) if v},
+                              self.owner.strip().lower()])
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _where(query: ExplorerQuery) -> Tuple[str, List[Any]]:
+    clauses = ["r.application_date BETWEEN %s AND %s"]
+    params: List[Any] = [query.date_from, query.date_to]
+    for name, values in query.filters.items():
+        if name not in FILTER_COLUMNS:
+            raise ValueError(f"Unknown filter: {name}")
+        if values:
+            clauses.append(f"{FILTER_COLUMNS[name]} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+    if query.owner.strip():
+        # Prefix match so the users.full_name index can be used
+        clauses.append("u.full_name LIKE %s")
+        params.append(query.owner.strip().replace('%', r'\%').replace('_', r'\_') + '%')
+    return " AND ".join(clauses), params
+
+def _order(query: ExplorerQuery) -> List[Tuple[str, str, str]]:
+    """(name, SQL column, direction) per sort key, ending with registration_id as tiebreaker"""
+    order = []
+    for name, direction in query.sort:
+        if name not in SORT_COLUMNS:
+            raise ValueError(f"Unknown sort column: {name}")
+        if direction not in ('asc', 'desc'):
+            raise ValueError(f"Unknown sort direction: {direction}")
+        order.append((name, SORT_COLUMNS[name], direction))
+    last_direction = order[-1][2] if order else 'desc'
+    order.append(('registration_id', 'r.registration_id', last_direction))
+    return order
+
+def _keyset(order: List[Tuple[str, str, str]], after: Tuple) -> Tuple[str, List[Any]]:
+    """Rows strictly after the cursor in the given multi-column order"""
+    disjuncts, params = [], []
+    for i, (_, column, direction) in enumerate(order):
+        parts = []
+        for (_, prev_column, _), value in zip(order[:i], after[:i]):
+            parts.append(f"{prev_column} = %s")
+            params.append(value)
+        parts.append(f"{column} {'>' if direction == 'asc' else '<'} %s")
+        params.append(after[i])
+        disjuncts.append("(" + " AND ".join(parts) + ")")
+    return "(" + " OR ".join(disjuncts) + ")", params
+
+def _order_sql(order: List[Tuple[str, str, str]]) -> str:
+    return ', '.join(f'{column} {direction.upper()}' for _, column, direction in order)
+
+def fetch_page(conn, query: ExplorerQuery, page_size: int,
+               after: Optional[Tuple] = None) -> Tuple[List[tuple], Optional[Tuple]]:
+    """One page of matching registrations and the cursor of the next page (None at the end)"""
+    where, params = _where(query)
+    order = _order(query)
+    if after is not None:
+        keyset, keyset_params = _keyset(order, after)
+        where += " AND " + keyset
+        params += keyset_params
+
+    records = fetch_records(conn, f"""
+        {SELECT_SQL}
+        WHERE {where}
+        ORDER BY {_order_sql(order)}
+        LIMIT %s
+    """, params + [page_size + 1])
+
+    if len(records) <= page_size:
+        return records, None
+    records = records[:page_size]
+    last = records[-1]
+    return records, tuple(getattr(last, name) for name, _, _ in order)
+
+def _sort_value(value):
+    # MySQL compares the text columns case-insensitively
+    return value.casefold() if isinstance(value, str) else value
+
+def order_key(query: ExplorerQuery) -> Callable:
+    """Python sort key matching the page ORDER BY, for merging records from several shards"""
+    order = _order(query)
+
+    def compare(a, b) -> int:
+        for name, _, direction in order:
+            x, y = _sort_value(getattr(a, name)), _sort_value(getattr(b, name))
+            if x != y:
+                return (-1 if x < y else 1) * (1 if direction == 'asc' else -1)
+        return 0
+    return cmp_to_key(compare)
+
+def merge_pages(pages: List[Tuple[List[tuple], Optional[Tuple]]], query: ExplorerQuery,
+                page_size: int) -> Tuple[List[tuple], Optional[Tuple]]:
+    """The same fetch_page() from every shard combined into one page and its next cursor"""
+    merged = merge_sorted([records for records, _ in pages], key=order_key(query))
+    if len(merged) <= page_size and all(cursor is None for _, cursor in pages):
+        return merged, None
+    records = merged[:page_size]
+    last = records[-1]
+    return records, tuple(getattr(last, name) for name, _, _ in _order(query))
+
+def export_columns(conn, query: ExplorerQuery, limit: Optional[int] = None) -> Columns:
+    """Every matching registration in view order (at most limit), read unbuffered"""
+    where, params = _where(query)
+    sql = f"""
+        {SELECT_SQL}
+        WHERE {where}
+        ORDER BY {_order_sql(_order(query))}
+    """
+    if limit:
+        sql += " LIMIT %s"
+        params = params + [limit]
+    return fetch_columns(conn, sql, params, stream=True)
+
+# --- Facets ---
+def _cube_grain(date_from: date, date_to: date) -> str:
+    """Coarsest cube grain whose periods exactly tile the date range"""
+    next_day = date.fromordinal(date_to.toordinal() + 1)
+    if date_from.month == 1 and date_from.day == 1 and next_day.month == 1 and next_day.day == 1:
+        return 'year'
+    if date_from.day == 1 and next_day.day == 1:
+        return 'month'
+    return 'day'
+
+def _facets_from_rows(rows) -> Dict[str, Dict[str, int]]:
+    facets = {dimension: {} for dimension in FACET_DIMENSIONS}
+    for row in rows:
+        count = int(row.count)
+        for dimension in FACET_DIMENSIONS:
+            value = getattr(row, dimension)
+            facets[dimension][value] = facets[dimension].get(value, 0) + count
+    return facets
+
+def _cube_facets(conn, query: ExplorerQuery):
+    grain = _cube_grain(query.date_from, query.date_to)
+    clauses = ["grain = %s", "period_start BETWEEN %s AND %s"]
+    params: List[Any] = [grain, query.date_from, query.date_to]
+    for name, values in query.filters.items():
+        if values:
+            clauses.append(f"{name} IN ({', '.join(['%s'] * len(values))})")
+            params.extend(values)
+    return fetch_records(conn, f"""
+        SELECT {', '.join(FACET_DIMENSIONS)}, SUM(reg_count) AS count
+        FROM registration_cube
+        WHERE {' AND '.join(clauses)}
+        GROUP BY {', '.join(FACET_DIMENSIONS)}
+        HAVING count > 0
+    """, params)
+
+def _estimated_matches(conn, where: str, params: List[Any]) -> int:
+    """Optimizer's estimate of matching registrations"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            EXPLAIN SELECT r.registration_id
+            FROM registrations r
+            JOIN users u ON r.owner_id = u.user_id
+            JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+            WHERE {where}
+        """, params)
+        plan = cursor.fetchall()
+    finally:
+        cursor.close()
+    estimate = 1
+    for step in plan:
+        estimate *= max(int(step['rows'] or 1), 1) * float(step.get('filtered') or 100) / 100
+    return int(estimate)
+
+def facet_counts(conn, query: ExplorerQuery, shard: str = '') -> Dict[str, Any]:
+    """Total and per-value counts for each facet dimension, all filters applied.
+
+    Returns {'total': int, 'exact': bool, 'facets': {dimension: {value: count}} or None}.
+    shard keeps the cached counts of different shards apart.
+    """
+    if not query.owner.strip():
+        facets = _facets_from_rows(_cube_facets(conn, query))
+        return {'total': sum(facets['status'].values()), 'exact': True, 'facets': facets}
+
+    cache = get_cache()
+    key = f"explorer:facets:{shard}:{query.cache_key()}"
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    where, params = _where(query)
+    estimate = _estimated_matches(conn, where, params)
+    if estimate > FACET_EXACT_LIMIT:
+        result = {'total': estimate, 'exact': False, 'facets': None}
+    else:
+        rows = fetch_records(conn, f"""
+            SELECT r.state, r.district, v.vehicle_type, v.fuel_type, r.status, COUNT(*) AS count
+            FROM registrations r
+            JOIN users u ON r.owner_id = u.user_id
+            JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+            WHERE {where}
+            GROUP BY r.state, r.district, v.vehicle_type, v.fuel_type, r.status
+        """, params)
+        facets = _facets_from_rows(rows)
+        result = {'total': sum(facets['status'].values()), 'exact': True, 'facets': facets}
+    cache.set(key, result, FACET_CACHE_TTL)
+    return result
+
+def merge_facets(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """facet_counts() of every shard added up"""
+    merged = {'total': sum(result['total'] for result in results),
+              'exact': all(result['exact'] for result in results),
+              'facets': None}
+    if all(result['facets'] is not None for result in results):
+        merged['facets'] = {dimension: {} for dimension in FACET_DIMENSIONS}
+        for result in results:
+            for dimension, counts in result['facets'].items():
+                for value, count in counts.items():
+                    merged['facets'][dimension][value] = merged['facets'][dimension].get(value, 0) + count
+    return merged
@@ -0,0 +1,423 @@
+"""Registration fees from a versioned, table-driven fee schedule.
+
+A schedule is a set of fee_rules published under one version with the date
+it takes effect. Each rule belongs to one component:
+
+    base     amount added per vehicle type
+    seating  amount added for a seating-capacity range
+    fuel     factor per fuel type (electric can be waived with 0)
+    age      factor for a vehicle-age range (years since manufacture)
+    state    factor per state, by its full name (case and spacing ignored)
+
+fee = (base + seating) * fuel * age * state, rounded to paise. vehicle_type,
+fuel_type and state may be left empty to match anything; the most specific
+matching rule wins within a component. Published versions are never edited:
+a change is a new version, so historical registrations can always be
+recomputed with the schedule that was in force on their application date.
+There is no built-in schedule: until one is imported, submissions are
+stored without a fee and `--reconcile --fix` prices them afterwards.
+
+Each process compiles every version into dense lookup tables, so a single
+quote is a few dict lookups. Bulk recomputation indexes NumPy arrays built
+from the same tables, a whole shard at a time.
+
+    python rto_fees.py --import fees.csv --effective-from 2026-04-01
+    python rto_fees.py --quote 4-wheeler petrol 5 2019 Maharashtra
+    python rto_fees.py --reconcile --from 2025-01-01 [--fix]
+    python rto_fees.py --list
+
+fees.csv columns: component,vehicle_type,fuel_type,state,min_value,max_value,value
+"""
+import argparse
+import csv
+import threading
+import time
+from bisect import bisect_right
+from datetime import date
+from decimal import Decimal
+from typing import Optional, Dict, List, Iterable, Tuple
+
+from rto_core import ensure_column
+from rto_rows import fetch_columns
+from rto_shards import SHARDS, open_shard
+
+FEE_CHECK_INTERVAL = 30  # seconds between version checks per process
+VEHICLE_TYPES = ('2-wheeler', '3-wheeler', '4-wheeler', 'commercial', 'other')
+FUEL_TYPES = ('petrol', 'diesel', 'electric', 'cng', 'hybrid')
+COMPONENTS = ('base', 'seating', 'fuel', 'age', 'state')
+MAX_SEATS = 50   # seating capacities above this use the MAX_SEATS entry
+MAX_AGE = 60     # ages above this use the MAX_AGE entry
+RECONCILE_BATCH = 5000
+
+
+class FeeError(Exception):
+    """Raised when a fee schedule is invalid"""
+
+
+def state_key(state: Optional[str]) -> str:
+    """A state name as state rules match it: lower case with single spaces"""
+    return ' '.join((state or '').split()).casefold()
+
+# --- Schema ---
+def ensure_fee_schema(conn):
+    """Create the fee schedule tables"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fee_schedules (
+                version INT AUTO_INCREMENT PRIMARY KEY,
+                effective_from DATE NOT NULL,
+                note VARCHAR(255),
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_fee_effective (effective_from)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fee_rules (
+                rule_id INT AUTO_INCREMENT PRIMARY KEY,
+                version INT NOT NULL,
+                component ENUM('base', 'seating', 'fuel', 'age', 'state') NOT NULL,
+                vehicle_type VARCHAR(20),
+                fuel_type VARCHAR(20),
+                state VARCHAR(50),
+                min_value INT,
+                max_value INT,
+                value DECIMAL(12, 4) NOT NULL,
+                INDEX idx_fee_rules_version (version),
+                FOREIGN KEY (version) REFERENCES fee_schedules(version)
+            )
+        """)
+        ensure_column(cursor, 'fee_rules', 'state', 'VARCHAR(50) NULL AFTER fuel_type')
+        conn.commit()
+    finally:
+        cursor.close()
+
+# --- Compiled Schedules ---
+def _matches(rule: Dict, vehicle_type=None, fuel_type=None, state=None, value=None) -> bool:
+    if rule.get('vehicle_type') and rule['vehicle_type'] != vehicle_type:
+        return False
+    if rule.get('fuel_type') and rule['fuel_type'] != fuel_type:
+        return False
+    if rule.get('state') and state_key(rule['state']) != state:
+        return False
+    if value is not None:
+        if rule.get('min_value') is not None and value < rule['min_value']:
+            return False
+        if rule.get('max_value') is not None and value > rule['max_value']:
+            return False
+    return True
+
+def _pick(rules: List[Dict], neutral: Decimal, **match) -> Decimal:
+    """Value of the most specific matching rule (later rules win ties), or neutral"""
+    best, best_rank = neutral, -1
+    for rank_order, rule in enumerate(rules):
+        if not _matches(rule, **match):
+            continue
+        specificity = sum(1 for key in ('vehicle_type', 'fuel_type', 'state', 'min_value', 'max_value')
+                          if rule.get(key) is not None and rule.get(key) != '')
+        rank = specificity * len(rules) + rank_order
+        if rank > best_rank:
+            best, best_rank = Decimal(str(rule['value'])), rank
+    return best
+
+
+class FeeSchedule:
+    """One published version, compiled into lookup tables"""
+
+    __slots__ = ('version', 'effective_from', 'amounts', 'age_factors', 'state_factors',
+                 'default_state', '_arrays')
+
+    def __init__(self, version: int, effective_from: date, rules: Iterable[Dict]):
+        self.version = version
+        self.effective_from = effective_from
+        by_component: Dict[str, List[Dict]] = {component: [] for component in COMPONENTS}
+        for rule in rules:
+            if rule['component'] not in by_component:
+                raise FeeError(f"Unknown fee component: {rule['component']}")
+            if rule.get('vehicle_type') and rule['vehicle_type'] not in VEHICLE_TYPES:
+                raise FeeError(f"Unknown vehicle type: {rule['vehicle_type']}")
+            if rule.get('fuel_type') and rule['fuel_type'] not in FUEL_TYPES:
+                raise FeeError(f"Unknown fuel type: {rule['fuel_type']}")
+            by_component[rule['component']].append(rule)
+
+        # (base + seating) * fuel for every type, fuel and capacity
+        self.amounts: Dict[Tuple[str, str, int], float] = {}
+        for vehicle_type in VEHICLE_TYPES:
+            base = _pick(by_component['base'], Decimal(0), vehicle_type=vehicle_type)
+            for fuel_type in FUEL_TYPES:
+                fuel = _pick(by_component['fuel'], Decimal(1), vehicle_type=vehicle_type, fuel_type=fuel_type)
+                for seats in range(MAX_SEATS + 1):
+                    seating = _pick(by_component['seating'], Decimal(0), vehicle_type=vehicle_type, value=seats)
+                    self.amounts[vehicle_type, fuel_type, seats] = float((base + seating) * fuel)
+        self.age_factors: Dict[Tuple[str, int], float] = {
+            (vehicle_type, age): float(_pick(by_component['age'], Decimal(1), vehicle_type=vehicle_type, value=age))
+            for vehicle_type in VEHICLE_TYPES for age in range(MAX_AGE + 1)
+        }
+        self.state_factors: Dict[str, float] = {}
+        for rule in by_component['state']:
+            if rule.get('state'):
+                key = state_key(rule['state'])
+                self.state_factors[key] = float(_pick(by_component['state'], Decimal(1), state=key))
+        self.default_state = float(_pick(by_component['state'], Decimal(1), state=None))
+        self._arrays = None
+
+    def fee(self, vehicle_type: str, fuel_type: str, seating_capacity: int,
+            age: int, state: str) -> float:
+        seats = min(max(int(seating_capacity or 0), 0), MAX_SEATS)
+        age = min(max(int(age), 0), MAX_AGE)
+        return round(self.amounts[vehicle_type, fuel_type, seats]
+                     * self.age_factors[vehicle_type, age]
+                     * self.state_factors.get(state_key(state), self.default_state), 2)
+
+    def arrays(self):
+        """(amounts[type, fuel, seats], age_factors[type, age], state keys, state factors + default)"""
+        if self._arrays is None:
+            import numpy as np  # only the bulk path needs NumPy
+            amounts = np.array([[[self.amounts[t, f, s] for s in range(MAX_SEATS + 1)] for f in FUEL_TYPES]
+                                for t in VEHICLE_TYPES])
+            ages = np.array([[self.age_factors[t, a] for a in range(MAX_AGE + 1)] for t in VEHICLE_TYPES])
+            keys = sorted(self.state_factors)
+            states = np.array([self.state_factors[k] for k in keys] + [self.default_state])
+            self._arrays = (amounts, ages, keys, states)
+        return self._arrays
+
+
+class FeeBook:
+    """Every published schedule, ordered by the date it takes effect"""
+
+    __slots__ = ('schedules', 'starts', 'latest_version')
+
+    def __init__(self, schedules: List[FeeSchedule]):
+        self.schedules = sorted(schedules, key=lambda s: (s.effective_from, s.version))
+        self.starts = [s.effective_from for s in self.schedules]
+        self.latest_version = max((s.version for s in schedules), default=0)
+
+    def schedule_on(self, day: date) -> Optional[FeeSchedule]:
+        i = bisect_right(self.starts, day)
+        return self.schedules[i - 1] if i else None
+
+    def quote(self, vehicle_data: Dict, on: Optional[date] = None) -> Optional[Tuple[float, int]]:
+        """(fee, schedule version) for one submission, or None before the first schedule"""
+        on = on or date.today()
+        schedule = self.schedule_on(on)
+        if schedule is None:
+            return None
+        fee = schedule.fee(vehicle_data['vehicle_type'], vehicle_data['fuel_type'],
+                           vehicle_data['seating_capacity'],
+                           on.year - int(vehicle_data['manufacturing_year']), vehicle_data['state'])
+        return fee, schedule.version
+
+    def quote_frame(self, frame):
+        """Vectorized quotes for a DataFrame with vehicle_type, fuel_type, seating_capacity,
+        manufacturing_year, state and application_date columns.
+
+        Returns (fees, versions) arrays; NaN and 0 where no schedule was in force.
+        """
+        import numpy as np
+        import pandas as pd
+
+        days = pd.to_datetime(frame['application_date']).to_numpy(dtype='datetime64[D]')
+        starts = np.array(self.starts, dtype='datetime64[D]')
+        which = np.searchsorted(starts, days, side='right') - 1
+        type_codes = pd.Categorical(frame['vehicle_type'], categories=VEHICLE_TYPES).codes
+        fuel_codes = pd.Categorical(frame['fuel_type'], categories=FUEL_TYPES).codes
+        if (type_codes < 0).any() or (fuel_codes < 0).any():
+            raise FeeError("Unknown vehicle or fuel type in the batch")
+        seats = np.clip(frame['seating_capacity'].fillna(0).to_numpy(dtype=int), 0, MAX_SEATS)
+        years = days.astype('datetime64[Y]').astype(int) + 1970
+        ages = np.clip(years - frame['manufacturing_year'].to_numpy(dtype=int), 0, MAX_AGE)
+        state_keys = frame['state'].fillna('').str.split().str.join(' ').str.casefold()
+
+        fees = np.full(len(frame), np.nan)
+        versions = np.zeros(len(frame), dtype=int)
+        for i in np.unique(which[which >= 0]):
+            schedule = self.schedules[i]
+            amounts, age_factors, keys, state_factors = schedule.arrays()
+            rows = which == i
+            # States without a rule land on the default factor at the end of the array
+            state_index = pd.Categorical(state_keys[rows], categories=keys).codes.copy()
+            state_index[state_index < 0] = len(keys)
+            fees[rows] = np.round(amounts[type_codes[rows], fuel_codes[rows], seats[rows]]
+                                  * age_factors[type_codes[rows], ages[rows]]
+                                  * state_factors[state_index], 2)
+            versions[rows] = schedule.version
+        return fees, versions
+
+
+def load_fee_book(conn) -> FeeBook:
+    """Read and compile every published schedule"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT version, effective_from FROM fee_schedules")
+        versions = cursor.fetchall()
+        cursor.execute("""
+            SELECT version, component, vehicle_type, fuel_type, state, min_value, max_value, value
+            FROM fee_rules ORDER BY version, rule_id
+        """)
+        rules = cursor.fetchall()
+    finally:
+        cursor.close()
+    by_version: Dict[int, List[Dict]] = {row['version']: [] for row in versions}
+    for rule in rules:
+        by_version[rule['version']].append(rule)
+    return FeeBook([FeeSchedule(row['version'], row['effective_from'], by_version[row['version']])
+                    for row in versions])
+
+
+_book: Optional[FeeBook] = None
+_checked_at = 0.0
+_book_lock = threading.Lock()
+
+def get_fee_book(conn) -> FeeBook:
+    """This process's compiled schedules, reloaded when a new version is published"""
+    global _book, _checked_at
+    if conn is None:
+        return _book if _book is not None else FeeBook([])
+    now = time.monotonic()
+    if _book is not None and now - _checked_at < FEE_CHECK_INTERVAL:
+        return _book
+    with _book_lock:
+        if _book is None or now - _checked_at >= FEE_CHECK_INTERVAL:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM fee_schedules")
+                version = cursor.fetchone()['version']
+            finally:
+                cursor.close()
+            if _book is None or _book.latest_version != version:
+                _book = load_fee_book(conn)
+            _checked_at = now
+    return _book
+
+def with_fee(conn, vehicle_data: Dict, on: Optional[date] = None) -> Dict:
+    """vehicle_data with the fee and fee_version due today (both None without a schedule)"""
+    quote = get_fee_book(conn).quote(vehicle_data, on)
+    fee, version = quote if quote else (None, None)
+    return dict(vehicle_data, fee=fee, fee_version=version)
+
+def publish_schedule(conn, effective_from: date, rules: Iterable[Dict], note: Optional[str] = None) -> int:
+    """Store rules as a new schedule version taking effect on effective_from"""
+    rules = [dict(rule) for rule in rules]
+    FeeSchedule(0, effective_from, rules)  # raises FeeError before anything is written
+    cursor = conn.cursor()
+    try:
+        cursor.execute("INSERT INTO fee_schedules (effective_from, note) VALUES (%s, %s)",
+                       (effective_from, note))
+        version = cursor.lastrowid
+        cursor.executemany("""
+            INSERT INTO fee_rules (version, component, vehicle_type, fuel_type, state,
+                min_value, max_value, value)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, [(version, rule['component'], rule.get('vehicle_type') or None, rule.get('fuel_type') or None,
+               ' '.join((rule.get('state') or '').split()) or None, rule.get('min_value'), rule.get('max_value'),
+               rule['value']) for rule in rules])
+        conn.commit()
+        return version
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+# --- Reconciliation ---
+def reconcile(book: FeeBook, conn, date_from: Optional[date] = None, date_to: Optional[date] = None,
+              fix: bool = False) -> Dict[str, int]:
+    """Recompute the fees of one shard's registrations against the schedules in force.
+
+    Registrations without a payment row get one (pending) and pending payments
+    with the wrong amount are corrected when fix is set. Completed payments are
+    only counted, never changed.
+    """
+    import numpy as np
+    import pandas as pd
+
+    columns = fetch_columns(conn, """
+        SELECT r.registration_id, r.application_date, r.state, v.vehicle_type, v.fuel_type,
+               v.seating_capacity, v.manufacturing_year, p.payment_id, p.amount, p.payment_status
+        FROM registrations r
+        JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+        LEFT JOIN payments p ON p.registration_id = r.registration_id
+        WHERE r.application_date BETWEEN %s AND %s
+    """, (date_from or date.min, date_to or date.max), stream=True)
+    frame = pd.DataFrame(dict(zip(columns.names, columns.data)))
+    if frame.empty:
+        return {'checked': 0, 'missing': 0, 'wrong': 0, 'paid_differs': 0}
+    fees, versions = book.quote_frame(frame)
+    priced = ~np.isnan(fees)
+    paid = frame['amount'].astype(float).to_numpy()
+    missing = priced & frame['payment_id'].isna().to_numpy()
+    differs = priced & ~missing & (np.abs(paid - fees) > 0.005)
+    pending = (frame['payment_status'] == 'pending').to_numpy()
+    wrong = differs & pending
+
+    if fix:
+        cursor = conn.cursor()
+        try:
+            inserts = [(int(frame['registration_id'].iat[i]), float(fees[i]), int(versions[i]))
+                       for i in np.flatnonzero(missing)]
+            updates = [(float(fees[i]), int(versions[i]), int(frame['payment_id'].iat[i]))
+                       for i in np.flatnonzero(wrong)]
+            for start in range(0, len(inserts), RECONCILE_BATCH):
+                cursor.executemany("""
+                    INSERT INTO payments (registration_id, amount, payment_mode, payment_status, fee_version)
+                    VALUES (%s, %s, 'online', 'pending', %s)
+                """, inserts[start:start + RECONCILE_BATCH])
+                conn.commit()
+            for start in range(0, len(updates), RECONCILE_BATCH):
+                cursor.executemany("""
+                    UPDATE payments SET amount = %s, fee_version = %s
+                    WHERE payment_id = %s AND payment_status = 'pending'
+                """, updates[start:start + RECONCILE_BATCH])
+                conn.commit()
+        finally:
+            cursor.close()
+    return {'checked': len(frame), 'missing': int(missing.sum()), 'wrong': int(wrong.sum()),
+            'paid_differs': int((differs & ~pending).sum())}
+
+# --- Command-Line Interface ---
+if __name__ == "__main__":
+    from rto_core import connect
+
+    parser = argparse.ArgumentParser(description="Manage fee schedules and reconcile payments")
+    parser.add_argument("--import", dest="import_path", help="Publish the rules in a CSV file as a new version")
+    parser.add_argument("--effective-from", type=date.fromisoformat, help="Date the imported schedule takes effect")
+    parser.add_argument("--note")
+    parser.add_argument("--quote", nargs=5, metavar=("TYPE", "FUEL", "SEATS", "YEAR", "STATE"))
+    parser.add_argument("--reconcile", action="store_true", help="Check every shard's payments against the schedules")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat)
+    parser.add_argument("--fix", action="store_true", help="With --reconcile: add missing and correct pending payments")
+    parser.add_argument("--list", action="store_true", help="Show the published schedule versions")
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        ensure_fee_schema(conn)
+        if args.import_path:
+            if not args.effective_from:
+                parser.error("--import needs --effective-from")
+            with open(args.import_path, newline='', encoding='utf-8') as f:
+                rows = [{key: (value.strip() or None) for key, value in row.items()} for row in csv.DictReader(f)]
+            for row in rows:
+                for key in ('min_value', 'max_value'):
+                    row[key] = int(row[key]) if row.get(key) else None
+            version = publish_schedule(conn, args.effective_from, rows, args.note)
+            print(f"Published {len(rows)} rules as version {version}, effective {args.effective_from}")
+        book = load_fee_book(conn)
+        if args.list:
+            for schedule in book.schedules:
+                print(f"version {schedule.version}  effective {schedule.effective_from}")
+        if args.quote:
+            vehicle_type, fuel_type, seats, year, state = args.quote
+            quote = book.quote({'vehicle_type': vehicle_type, 'fuel_type': fuel_type,
+                                'seating_capacity': int(seats), 'manufacturing_year': int(year), 'state': state})
+            print(f"₹{quote[0]:,.2f} (schedule version {quote[1]})" if quote else "No schedule in force")
+        if args.reconcile:
+            for shard in SHARDS:
+                with open_shard(shard) as db:
+                    result = reconcile(book, db, args.date_from, args.date_to, args.fix)
+                print(f"{shard}: {result['checked']} checked, {result['missing']} without payment, "
+                      f"{result['wrong']} pending with a wrong amount, {result['paid_differs']} paid amounts differ"
+                      + (" (fixed)" if args.fix else ""))
+    finally:
+        conn.close()
@@ -0,0 +1,285 @@
+"""Memory accounting for app sessions, and tracemalloc snapshots on demand.
+
+Every rerun records an estimate of the session's state size under the page
+it rendered, so the System Logs page can show what a session costs, which
+pages are heavy, and how many sessions a replica can hold. A session over
+its budget drops its largest rebuildable entries (export files, page
+cursors); a replica over its budget does the same for every session that
+reruns until it is back under.
+
+Allocation tracing is off by default because it slows every allocation.
+An admin can switch it on, take snapshots and compare them to see which
+lines of code are holding on to memory. With RTO_SNAPSHOT_DIR set, each
+snapshot is also saved there so it can be compared offline:
+
+    python rto_memory.py --compare before.snap after.snap
+    python rto_memory.py --top after.snap --limit 40
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Iterable
+
+SESSION_MEMORY_BUDGET = int(os.environ.get("RTO_SESSION_MEMORY_KB", "4096")) * 1024
+REPLICA_MEMORY_BUDGET = int(os.environ.get("RTO_REPLICA_MEMORY_MB", "0")) * 1024 * 1024  # 0: no cap
+SESSION_IDLE = 3600    # seconds before a session that stopped rerunning is forgotten
+TRACE_FRAMES = 10      # stack depth kept per traced allocation
+MAX_SNAPSHOTS = 5      # snapshots kept in memory per process
+SNAPSHOT_DIR = os.environ.get("RTO_SNAPSHOT_DIR")
+IGNORED_FILES = ("<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>",
+                 "<unknown>", tracemalloc.__file__)
+
+
+# --- Size Estimates ---
+def approx_size(obj: Any) -> int:
+    """Bytes held by obj and everything it references, counting shared objects once.
+
+    DataFrames report their own deep usage; modules, classes and functions
+    are not counted since they are shared by the whole process.
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (type, type(sys), type(approx_size))):
+            continue
+        seen.add(id(item))
+        if hasattr(item, 'memory_usage') and hasattr(item, 'columns'):
+            total += int(item.memory_usage(deep=True).sum())
+            continue
+        total += sys.getsizeof(item, 0)
+        if isinstance(item, (str, bytes, bytearray, int, float, bool)) or item is None:
+            continue
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        else:
+            if hasattr(item, '__dict__'):
+                stack.append(vars(item))
+            for slot in getattr(type(item), '__slots__', ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return total
+
+def process_rss() -> Optional[int]:
+    """Resident memory of this process in bytes, where the platform reports it"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Peak rather than current, and in KiB on Linux but bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def format_bytes(size: Optional[float]) -> str:
+    if size is None:
+        return "n/a"
+    for unit in ('B', 'KB', 'MB'):
+        if abs(size) < 1024:
+            return f"{size:,.0f} {unit}" if unit == 'B' else f"{size:,.1f} {unit}"
+        size /= 1024
+    return f"{size:,.1f} GB"
+
+
+# --- Session Ledger ---
+class MemoryLedger:
+    """Latest state size of each live session in this process, and per-page history"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._pages: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, session_id: str, page: str, state_bytes: int, render_peak: Optional[int] = None):
+        now = time.time()
+        with self._lock:
+            self._sessions[session_id] = {'page': page, 'bytes': state_bytes,
+                                          'render_peak': render_peak, 'seen': now}
+            stats = self._pages.setdefault(page, {'reruns': 0, 'total': 0, 'max': 0, 'peak_max': 0})
+            stats['reruns'] += 1
+            stats['total'] += state_bytes
+            stats['max'] = max(stats['max'], state_bytes)
+            if render_peak is not None:
+                stats['peak_max'] = max(stats['peak_max'], render_peak)
+            for stale in [s for s, entry in self._sessions.items() if now - entry['seen'] > SESSION_IDLE]:
+                del self._sessions[stale]
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(entry['bytes'] for entry in self._sessions.values())
+
+    def sessions(self) -> List[Dict[str, Any]]:
+        """Live sessions, largest first"""
+        with self._lock:
+            rows = [dict(entry, session=session_id) for session_id, entry in self._sessions.items()]
+        return sorted(rows, key=lambda row: -row['bytes'])
+
+    def pages(self) -> List[Dict[str, Any]]:
+        """Mean and largest session state seen on each page, heaviest first"""
+        with self._lock:
+            rows = [{'page': page, 'reruns': stats['reruns'], 'mean': stats['total'] / stats['reruns'],
+                     'max': stats['max'], 'render_peak_max': stats['peak_max'] or None}
+                    for page, stats in self._pages.items()]
+        return sorted(rows, key=lambda row: -row['mean'])
+
+    def sizing(self) -> Dict[str, Any]:
+        """Totals for this replica and how many more sessions its budget allows"""
+        sessions = self.sessions()
+        sizes = sorted(row['bytes'] for row in sessions)
+        p95 = sizes[int(len(sizes) * 0.95) if len(sizes) > 1 else 0] if sizes else None
+        rss = process_rss()
+        headroom = None
+        if REPLICA_MEMORY_BUDGET and rss is not None and p95:
+            headroom = max(0, (REPLICA_MEMORY_BUDGET - rss) // p95)
+        return {'sessions': len(sizes), 'total': sum(sizes), 'p95': p95, 'rss': rss,
+                'budget': REPLICA_MEMORY_BUDGET or None, 'headroom': headroom}
+
+ledger = MemoryLedger()
+
+def trim_session(state: Dict[str, Any], droppable: Iterable[str], budget: int) -> List[str]:
+    """Delete droppable keys from state, largest first, until it fits in budget.
+
+    Returns the keys removed. state is anything with mapping access,
+    st.session_state included.
+    """
+    sizes = {key: approx_size(state[key]) for key in droppable if key in state}
+    size = approx_size({key: state[key] for key in list(state.keys())})
+    dropped = []
+    for key in sorted(sizes, key=lambda k: -sizes[k]):
+        if size <= budget:
+            break
+        del state[key]
+        size -= sizes[key]
+        dropped.append(key)
+    return dropped
+
+def account_session(session_id: str, page: str, state: Dict[str, Any], droppable: Iterable[str],
+                    render_peak: Optional[int] = None) -> List[str]:
+    """Record the session's state size after a rerun, trimming it if over budget.
+
+    Returns the keys dropped to stay within the session or replica budget.
+    """
+    droppable = list(droppable)
+    size = approx_size({key: state[key] for key in list(state.keys())})
+    dropped = []
+    if size > SESSION_MEMORY_BUDGET:
+        dropped = trim_session(state, droppable, SESSION_MEMORY_BUDGET)
+    elif REPLICA_MEMORY_BUDGET and (process_rss() or 0) > REPLICA_MEMORY_BUDGET:
+        dropped = trim_session(state, droppable, 0)
+    if dropped:
+        size = approx_size({key: state[key] for key in list(state.keys())})
+    ledger.record(session_id, page, size, render_peak)
+    return dropped
+
+
+# --- Allocation Tracing ---
+_snapshots: "OrderedDict[str, tracemalloc.Snapshot]" = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+def start_tracing(frames: int = TRACE_FRAMES):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+def stop_tracing():
+    """Stop tracing and drop the snapshots taken while it ran"""
+    tracemalloc.stop()
+    with _snapshots_lock:
+        _snapshots.clear()
+
+def is_tracing() -> bool:
+    return tracemalloc.is_tracing()
+
+def traced_memory() -> Optional[Dict[str, int]]:
+    """{'current', 'peak'} bytes allocated since tracing started, or None when off"""
+    if not tracemalloc.is_tracing():
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    return {'current': current, 'peak': peak}
+
+def reset_peak():
+    """Start a new peak measurement (Python 3.9+), e.g. at the start of a rerun"""
+    if tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+def _filtered(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    return snapshot.filter_traces([tracemalloc.Filter(False, name) for name in IGNORED_FILES])
+
+def take_snapshot(label: Optional[str] = None) -> str:
+    """Snapshot current allocations under label (default: the time), returning the label"""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Allocation tracing is not running")
+    label = label or time.strftime('%H:%M:%S')
+    snapshot = _filtered(tracemalloc.take_snapshot())
+    if SNAPSHOT_DIR:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        name = f"{os.getpid()}-{time.strftime('%Y%m%d')}-{label}".replace(':', '')
+        snapshot.dump(os.path.join(SNAPSHOT_DIR, f"{name}.snap"))
+    with _snapshots_lock:
+        _snapshots[label] = snapshot
+        _snapshots.move_to_end(label)
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return label
+
+def snapshot_labels() -> List[str]:
+    """Labels of the snapshots held, oldest first"""
+    with _snapshots_lock:
+        return list(_snapshots)
+
+def get_snapshot(label: str) -> tracemalloc.Snapshot:
+    with _snapshots_lock:
+        return _snapshots[label]
+
+def _location(trace) -> str:
+    frame = trace.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+def top_allocations(snapshot: tracemalloc.Snapshot, limit: int = 25,
+                    group_by: str = 'lineno') -> List[Dict[str, Any]]:
+    """Largest allocation sites in a snapshot"""
+    return [{'location': _location(stat), 'size': stat.size, 'count': stat.count}
+            for stat in snapshot.statistics(group_by)[:limit]]
+
+def compare_snapshots(old: tracemalloc.Snapshot, new: tracemalloc.Snapshot, limit: int = 25,
+                      group_by: str = 'lineno') -> List[Dict[str, Any]]:
+    """Allocation sites that grew the most between two snapshots"""
+    return [{'location': _location(stat), 'size_diff': stat.size_diff, 'count_diff': stat.count_diff,
+             'size': stat.size, 'count': stat.count}
+            for stat in new.compare_to(old, group_by)[:limit]]
+
+
+# --- Command-Line Interface ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect saved tracemalloc snapshots")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Show what grew between two snapshots")
+    action.add_argument("--top", metavar="SNAPSHOT", help="Show the largest allocation sites")
+    parser.add_argument("--limit", type=int, default=25)
+    parser.add_argument("--group-by", choices=('lineno', 'filename', 'traceback'), default='lineno')
+    args = parser.parse_args()
+
+    if args.compare:
+        rows = compare_snapshots(tracemalloc.Snapshot.load(args.compare[0]),
+                                 tracemalloc.Snapshot.load(args.compare[1]), args.limit, args.group_by)
+        for row in rows:
+            print(f"{format_bytes(row['size_diff']):>12} {row['count_diff']:>+9}  {row['location']}")
+    else:
+        rows = top_allocations(tracemalloc.Snapshot.load(args.top), args.limit, args.group_by)
+        for row in rows:
+            print(f"{format_bytes(row['size']):>12} {row['count']:>9}  {row['location']}")
@@ -0,0 +1,424 @@
+"""Query plan regression guard.
+
+Runs the read paths of the app and the API against a seeded scratch
+database through a recording connection, so the exact statements (and
+parameters) the code issues are captured. Each one is then EXPLAINed with
+FORMAT=JSON and reduced to its access type, key and rows examined per
+table, plus filesort and temporary-table use. The summary is compared with
+a stored baseline: a worse access type, a new filesort or temporary table,
+or a jump in rows examined is reported as a regression. Both MySQL's and
+MariaDB's EXPLAIN documents are understood, but a baseline is only compared
+with plans from the same kind of server.
+
+    python rto_plans.py --seed 200000     # (re)create the scratch database with synthetic data
+    python rto_plans.py --record          # store the current plans as the baseline
+    python rto_plans.py                   # compare against the baseline; exit status 1 on regressions
+    python rto_plans.py --show            # print every statement's plan
+
+The scratch database is RTO_PLAN_DB (default rto_plan_check) on the
+RTO_DB_HOST server; it is never the application database. Seeding is
+deterministic, so a baseline recorded on one machine holds on another.
+Statements are keyed by workload entry and position, so an edited query is
+still compared with its old plan. A query added to the app belongs in
+workload() below.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+from typing import Optional, Dict, List, Any, Callable, Tuple
+
+import pymysql
+
+from rto_budgets import row_limit
+from rto_catalog import ensure_catalog_schema, load_index, seed_from_vehicles
+from rto_core import (
+    DB_NAME, SERIES_BACKFILL_SQL, compute_owner_summary, compute_registration_stats, connect,
+    decided_registrations_query, ensure_schema, get_pending_registrations, get_registration, hash_password,
+    owner_applications_query, pending_registrations_query, recent_activity_query
+)
+from rto_cube import dimension_values, ensure_cube_schema, query_cube, rebuild_cube
+from rto_documents import ensure_documents_schema
+from rto_explorer import ExplorerQuery, export_columns, facet_counts, fetch_page
+from rto_rows import fetch_columns
+from rto_sla import ensure_sla_schema, refresh_sla_sketches, sla_percentiles
+from rto_status import lookup_status
+
+PLAN_DB = os.environ.get("RTO_PLAN_DB", "rto_plan_check")
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plan_baseline.json')
+DEFAULT_REGISTRATIONS = 200_000
+SEED_BATCH = 5000
+FIRST_OWNER_ID = 1000
+ROWS_GROWTH = 1.5      # rows examined may grow this much before it counts as a regression...
+ROWS_SLACK = 1000      # ...and by at least this many rows, to ignore estimate noise
+# Best to worst, as documented for EXPLAIN's access type
+ACCESS_TYPES = ('system', 'const', 'eq_ref', 'ref', 'fulltext', 'ref_or_null', 'unique_subquery',
+                'index_subquery', 'index_merge', 'range', 'index', 'ALL')
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+STATES = {
+    'Maharashtra': ['Mumbai', 'Pune', 'Nagpur', 'Nashik'],
+    'Karnataka': ['Bengaluru', 'Mysuru', 'Mangaluru'],
+    'Tamil Nadu': ['Chennai', 'Coimbatore', 'Madurai'],
+    'Gujarat': ['Ahmedabad', 'Surat', 'Vadodara'],
+    'Delhi': ['New Delhi'],
+    'Kerala': ['Kochi', 'Thiruvananthapuram'],
+}
+MODELS = [('Maruti Suzuki', 'Swift', '4-wheeler'), ('Maruti Suzuki', 'Baleno', '4-wheeler'),
+          ('Hyundai', 'Creta', '4-wheeler'), ('Tata', 'Nexon', '4-wheeler'),
+          ('Honda', 'Activa', '2-wheeler'), ('Hero', 'Splendor', '2-wheeler'),
+          ('Bajaj', 'RE', '3-wheeler'), ('Ashok Leyland', 'Dost', 'commercial')]
+FUELS = ['petrol', 'diesel', 'electric', 'cng', 'hybrid']
+STATUS_WEIGHTS = {'pending': 30, 'verified': 10, 'approved': 50, 'rejected': 10}
+
+
+# --- Statement Capture ---
+class _RecordingCursor:
+    """Cursor that notes every statement before running it"""
+
+    def __init__(self, cursor, log: List[Tuple[str, Any]]):
+        self._cursor = cursor
+        self._log = log
+
+    def execute(self, query, args=None):
+        self._log.append((query, args))
+        return self._cursor.execute(query, args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class RecordingConnection:
+    """Connection wrapper whose cursors record what they execute"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.log: List[Tuple[str, Any]] = []
+
+    def cursor(self, *args, **kwargs):
+        return _RecordingCursor(self._conn.cursor(*args, **kwargs), self.log)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def workload(sample: Dict[str, Any]) -> List[Tuple[str, Callable]]:
+    """(name, fn(conn)) for every read path of the app and the API"""
+    today = date.today()
+    month_ago = today - timedelta(days=30)
+    half_year = today - timedelta(days=180)
+    owner = sample['owner_id']
+    explorer = ExplorerQuery(half_year, today)
+    narrowed = ExplorerQuery(half_year, today, {'state': [sample['state']], 'status': ['pending']},
+                             owner=sample['full_name'][:3], sort=[('reg_no', 'asc')])
+
+    def next_explorer_page(conn):
+        _, cursor = fetch_page(conn, explorer, 50)
+        return fetch_page(conn, explorer, 50, cursor)
+
+    def series_backfill(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(SERIES_BACKFILL_SQL)
+        finally:
+            cursor.close()
+        conn.rollback()
+
+    return [
+        ('dashboard stats', compute_registration_stats),
+        ('recent activity', lambda conn: fetch_columns(conn, *recent_activity_query())),
+        ('owner dashboard', lambda conn: compute_owner_summary(conn, owner)),
+        ('pending queue', lambda conn: fetch_columns(
+            conn, *pending_registrations_query(limit=row_limit('pending')))),
+        ('pending queue page (API)', lambda conn: get_pending_registrations(
+            conn, (sample['application_date'], sample['registration_id']), 50)),
+        ('approved tab', lambda conn: fetch_columns(
+            conn, *decided_registrations_query('approved', row_limit('decided')))),
+        ('rejected tab', lambda conn: fetch_columns(
+            conn, *decided_registrations_query('rejected', row_limit('decided')))),
+        ('my applications', lambda conn: fetch_columns(
+            conn, *owner_applications_query(owner, month_ago, today,
+                limit=row_limit('my_applications')))),
+        ('my applications by reg_no', lambda conn: fetch_columns(
+            conn, *owner_applications_query(owner, month_ago, today, "Registration Number", sample['reg_no'],
+                limit=row_limit('my_applications')))),
+        ('my applications by model', lambda conn: fetch_columns(
+            conn, *owner_applications_query(owner, month_ago, today, "Vehicle Model", sample['model'],
+                limit=row_limit('my_applications')))),
+        ('my applications by status', lambda conn: fetch_columns(
+            conn, *owner_applications_query(owner, month_ago, today, "Status", 'pending',
+                limit=row_limit('my_applications')))),
+        ('registration by reg_no (API)', lambda conn: get_registration(conn, sample['reg_no'])),
+        ('public status lookup', lambda conn: lookup_status(conn, sample['reg_no'], sample['chassis_no'],
+                                                            'plan-check')),
+        ('explorer page', lambda conn: fetch_page(conn, explorer, 50)),
+        ('explorer next page', next_explorer_page),
+        ('explorer filtered page', lambda conn: fetch_page(conn, narrowed, 50)),
+        ('explorer facets', lambda conn: facet_counts(conn, explorer, 'plan-check')),
+        ('explorer export', lambda conn: export_columns(conn, narrowed, row_limit('export'))),
+        ('analytics trend', lambda conn: query_cube(conn, 'month', half_year, today, group_by='vehicle_type')),
+        ('analytics drill-down', lambda conn: dimension_values(conn, 'district', {'state': [sample['state']]})),
+        ('analytics sla', lambda conn: sla_percentiles(conn, half_year, today, group_by='state')),
+        ('catalog load', load_index),
+        ('registration series backfill', series_backfill),
+    ]
+
+def sample_values(conn) -> Dict[str, Any]:
+    """Realistic parameters taken from the seeded data"""
+    cursor = conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        cursor.execute("""
+            SELECT r.owner_id, u.full_name FROM registrations r JOIN users u ON r.owner_id = u.user_id
+            GROUP BY r.owner_id, u.full_name ORDER BY COUNT(*) DESC LIMIT 1
+        """)
+        sample = cursor.fetchone()
+        cursor.execute("""
+            SELECT r.registration_id, r.reg_no, r.application_date, r.state, v.model, v.chassis_no
+            FROM registrations r JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+            WHERE r.owner_id = %s ORDER BY r.registration_id LIMIT 1
+        """, (sample['owner_id'],))
+        sample.update(cursor.fetchone())
+        return sample
+    finally:
+        cursor.close()
+
+def collect(conn) -> List[Tuple[str, str, Any]]:
+    """(key, sql, params) of every explainable statement the workload issues"""
+    statements = []
+    for name, run in workload(sample_values(conn)):
+        recorder = RecordingConnection(conn)
+        run(recorder)
+        explainable = [(sql, params) for sql, params in recorder.log
+                       if sql.lstrip().split(None, 1)[0].upper() in EXPLAINABLE]
+        for i, (sql, params) in enumerate(explainable, start=1):
+            statements.append((f"{name} #{i}", sql, params))
+    return statements
+
+
+# --- Plans ---
+def summarize_plan(plan: Dict) -> Dict[str, Any]:
+    """Per-table access and statement-wide flags from an EXPLAIN FORMAT=JSON document.
+
+    MySQL flags sorts and temporary tables with using_filesort and
+    using_temporary_table and counts rows_examined_per_scan; MariaDB nests
+    filesort and temporary_table objects and counts rows.
+    """
+    tables: Dict[str, Dict[str, Any]] = {}
+    flags = {'filesort': False, 'temporary': False}
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+        if node.get('using_filesort') or 'filesort' in node:
+            flags['filesort'] = True
+        if node.get('using_temporary_table') or 'temporary_table' in node:
+            flags['temporary'] = True
+        table = node.get('table')
+        if isinstance(table, dict) and 'table_name' in table:
+            name = table['table_name']
+            while name in tables:  # the same alias in a subquery
+                name += "'"
+            tables[name] = {'access_type': table.get('access_type'), 'key': table.get('key'),
+                            'rows': int(table.get('rows_examined_per_scan', table.get('rows', 0)))}
+        stack.extend(reversed(list(node.values())))
+    query_block = plan.get('query_block', {})
+    cost = query_block.get('cost_info', {}).get('query_cost', query_block.get('cost'))  # MariaDB 11+: cost
+    return {'tables': tables, 'rows': sum(t['rows'] for t in tables.values()),
+            'cost': float(cost) if cost is not None else None, **flags}
+
+def explain(conn, sql: str, params: Any) -> Dict[str, Any]:
+    cursor = conn.cursor(pymysql.cursors.Cursor)
+    try:
+        cursor.execute("EXPLAIN FORMAT=JSON " + sql, params)
+        return summarize_plan(json.loads(cursor.fetchone()[0]))
+    finally:
+        cursor.close()
+        conn.rollback()
+
+def server_kind(conn) -> str:
+    return 'MariaDB' if 'MariaDB' in conn.get_server_info() else 'MySQL'
+
+def current_plans(conn) -> Dict[str, Dict[str, Any]]:
+    """Plan summary of every statement, with the server kind and a shortened copy of its SQL"""
+    plans = {}
+    server = server_kind(conn)
+    for key, sql, params in collect(conn):
+        plans[key] = dict(explain(conn, sql, params), server=server, sql=' '.join(sql.split())[:300])
+    return plans
+
+def _access_rank(access_type: Optional[str]) -> int:
+    return ACCESS_TYPES.index(access_type) if access_type in ACCESS_TYPES else -1
+
+def regressions(baseline: Dict[str, Dict], current: Dict[str, Dict]) -> List[str]:
+    """What got worse, one line per finding"""
+    found = []
+    for key, plan in current.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        for table, access in plan['tables'].items():
+            old = before['tables'].get(table)
+            if old is None:
+                continue
+            if _access_rank(access['access_type']) > _access_rank(old['access_type']):
+                found.append(f"{key}: {table} access {old['access_type']} ({old['key'] or 'no key'}) "
+                             f"-> {access['access_type']} ({access['key'] or 'no key'})")
+            if access['rows'] > old['rows'] * ROWS_GROWTH and access['rows'] - old['rows'] > ROWS_SLACK:
+                found.append(f"{key}: {table} rows examined {old['rows']:,} -> {access['rows']:,}")
+        for flag, label in (('filesort', "filesort"), ('temporary', "temporary table")):
+            if plan[flag] and not before[flag]:
+                found.append(f"{key}: now uses a {label}")
+    return found
+
+
+# --- Seeding ---
+def _require_scratch_db():
+    if PLAN_DB == DB_NAME:
+        sys.exit(f"RTO_PLAN_DB must not be the application database ({DB_NAME})")
+
+def _scratch_connection():
+    _require_scratch_db()
+    return connect(database=PLAN_DB)
+
+def seed(registrations: int = DEFAULT_REGISTRATIONS, seed_value: int = 42):
+    """Recreate the scratch database and fill it with synthetic, reproducible data"""
+    _require_scratch_db()
+    server = connect(database=None)
+    try:
+        cursor = server.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS `{PLAN_DB}`")
+        cursor.execute(f"CREATE DATABASE `{PLAN_DB}`")
+        cursor.close()
+    finally:
+        server.close()
+
+    conn = _scratch_connection()
+    try:
+        for ensure in (ensure_schema, ensure_cube_schema, ensure_sla_schema,
+                       ensure_documents_schema, ensure_catalog_schema):
+            ensure(conn)
+        rng = random.Random(seed_value)
+        cursor = conn.cursor()
+        try:
+            # Explicit ids, clear of the admin account ensure_schema creates
+            owners = max(1, registrations // 3)
+            password = hash_password('plan-check')  # one hash: bcrypt per user would dominate seeding
+            users = [(FIRST_OWNER_ID + i, f"user{i}", password,
+                      f"{rng.choice(['Asha', 'Ravi', 'Meera', 'Arjun'])} Owner{i}",
+                      f"user{i}@example.com", f"9{i:09d}", 'user') for i in range(owners)]
+            for start in range(0, len(users), SEED_BATCH):
+                cursor.executemany("""
+                    INSERT INTO users (user_id, username, password_hash, full_name, email, phone, role)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, users[start:start + SEED_BATCH])
+
+            today = date.today()
+            statuses = list(STATUS_WEIGHTS)
+            weights = list(STATUS_WEIGHTS.values())
+            counters: Dict[Tuple[str, str], int] = {}
+            for start in range(0, registrations, SEED_BATCH):
+                vehicles, rows = [], []
+                for i in range(start, min(start + SEED_BATCH, registrations)):
+                    manufacturer, model, vehicle_type = rng.choice(MODELS)
+                    vehicles.append((i + 1, f"ENG{i:09d}", f"CHS{i:09d}", manufacturer, model, vehicle_type,
+                                     rng.choice(FUELS), 'White', rng.randint(2005, today.year),
+                                     2 if vehicle_type == '2-wheeler' else 5))
+                    state = rng.choice(list(STATES))
+                    applied = today - timedelta(days=rng.randint(0, 730))
+                    series = (state[:2].upper(), applied.strftime('%y'))
+                    counters[series] = counters.get(series, 0) + 1
+                    status = rng.choices(statuses, weights)[0]
+                    decided = datetime.combine(applied, datetime.min.time()) + timedelta(days=rng.randint(1, 30))
+                    rows.append((f"{series[0]}{series[1]}{counters[series]:04d}",
+                                 i + 1, FIRST_OWNER_ID + rng.randrange(owners),
+                                 state, rng.choice(STATES[state]), applied,
+                                 decided.date() if status == 'approved' else None, status,
+                                 decided if status != 'pending' else None,
+                                 "Documents incomplete" if status == 'rejected' else None,
+                                 datetime.combine(applied, datetime.min.time())))
+                cursor.executemany("""
+                    INSERT INTO vehicles (vehicle_id, engine_no, chassis_no, manufacturer, model,
+                        vehicle_type, fuel_type, color, manufacturing_year, seating_capacity)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, vehicles)
+                cursor.executemany("""
+                    INSERT INTO registrations (reg_no, vehicle_id, owner_id, state, district,
+                        application_date, registration_date, status, status_updated_at, remarks, created_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, rows)
+                conn.commit()
+            cursor.execute("DELETE FROM registration_series")
+            cursor.execute(SERIES_BACKFILL_SQL)
+            conn.commit()
+            for table in ('users', 'vehicles', 'registrations', 'registration_status_history'):
+                cursor.execute(f"ANALYZE TABLE {table}")
+                cursor.fetchall()
+        finally:
+            cursor.close()
+        rebuild_cube(conn)
+        while refresh_sla_sketches(conn):
+            pass
+        seed_from_vehicles(conn, sharded=False)
+    finally:
+        conn.close()
+
+
+# --- Command-Line Interface ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EXPLAIN the app's queries and compare with a baseline")
+    parser.add_argument("--seed", type=int, nargs='?', const=DEFAULT_REGISTRATIONS, metavar="REGISTRATIONS",
+                        help="Recreate the scratch database with this many registrations")
+    parser.add_argument("--record", action="store_true", help="Store the current plans as the baseline")
+    parser.add_argument("--show", action="store_true", help="Print every statement's plan")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed)
+        print(f"Seeded {PLAN_DB} with {args.seed:,} registrations")
+
+    conn = _scratch_connection()
+    try:
+        plans = current_plans(conn)
+    finally:
+        conn.close()
+
+    if args.show:
+        for key, plan in plans.items():
+            flags = [label for flag, label in (('filesort', 'filesort'), ('temporary', 'temporary'))
+                     if plan[flag]]
+            print(f"{key}  cost={plan['cost']}  {' '.join(flags)}")
+            for table, access in plan['tables'].items():
+                print(f"    {table:<12} {access['access_type'] or '-':<8} {access['key'] or '-':<32} "
+                      f"rows={access['rows']:,}")
+
+    if args.record:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(plans, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Recorded {len(plans)} statement plans in {args.baseline}")
+    elif not os.path.exists(args.baseline):
+        sys.exit(f"No baseline at {args.baseline}; run with --record first")
+    else:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        recorded_on = {plan.get('server', 'MySQL') for plan in baseline.values()}
+        running_on = {plan['server'] for plan in plans.values()}
+        if running_on - recorded_on:
+            sys.exit(f"The baseline was recorded on {', '.join(sorted(recorded_on))} but this server is "
+                     f"{', '.join(sorted(running_on))}; record a baseline for it with --record")
+        for key in sorted(set(plans) - set(baseline)):
+            print(f"new statement (not in baseline): {key}")
+        for key in sorted(set(baseline) - set(plans)):
+            print(f"statement no longer issued: {key}")
+        found = regressions(baseline, plans)
+        for line in found:
+            print(f"REGRESSION {line}")
+        print(f"{len(plans)} statements checked, {len(found)} regressions")
+        sys.exit(1 if found else 0)
@@ -0,0 +1,332 @@
+"""Pre-rendered district reports for the inspector Reports page.
+
+A scheduler renders the standard reports in a process pool and stores
+each run as a versioned set of files:
+
+    reports/<report>/<version>/report.html   table and chart
+    reports/<report>/<version>/report.csv
+    reports/<report>/<version>/report.pdf    only when reportlab is installed
+    reports/<report>/latest.json             manifest of the newest version
+
+Every report covers all shards: each query runs on every shard and the
+per-district rows are added up. A report is rebuilt when the data has
+changed since its last version (a shard's registration_status_history
+high-water mark moved) or when it is older than REFRESH_AFTER. Opening the
+Reports page only reads these files.
+
+    python rto_reports.py --watch --interval 300 --workers 3
+    python rto_reports.py --force              # rebuild everything once
+"""
+import argparse
+import html
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from typing import Optional, Dict, List, Sequence
+
+from rto_rows import Columns, fetch_columns
+from rto_shards import scatter
+
+REPORTS_DIR = os.environ.get(
+    "RTO_REPORTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports')
+)
+REPORT_MONTHS = 12
+REFRESH_AFTER = 6 * 3600  # pending ages move with the calendar even when no data changes
+KEEP_VERSIONS = 10
+AGING_BUCKETS = ((0, 7), (8, 15), (16, 30), (31, 60), (61, None))
+
+REPORTS = {
+    'district_volumes': "Registrations per District by Month",
+    'inspection_outcomes': "Inspection Outcomes per District",
+    'pending_aging': "Pending Applications by Age",
+}
+
+
+def _window_start(today: date, months: int) -> date:
+    month_index = today.year * 12 + today.month - 1 - (months - 1)
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def _on_all_shards(query: str, params: Sequence = ()) -> List[Columns]:
+    return list(scatter(lambda conn: fetch_columns(conn, query, params)).values())
+
+def _sum_by_district(parts: List[Columns], maxima: Sequence[str] = ()) -> Dict[tuple, Dict[str, float]]:
+    """Per-shard rows keyed by (state, district) with their other columns added up, or maxed for maxima.
+
+    A state's rows live on one shard except while it is being moved, when
+    both shards may hold some of them.
+    """
+    totals: Dict[tuple, Dict[str, float]] = {}
+    for part in parts:
+        for row in part.rows():
+            values = dict(zip(part.names, row))
+            into = totals.setdefault((values.pop('state'), values.pop('district')), {})
+            for column, value in values.items():
+                value = float(value or 0)
+                if column in maxima:
+                    into[column] = max(into.get(column, value), value)
+                else:
+                    into[column] = into.get(column, 0) + value
+    return totals
+
+# --- Report Queries ---
+def district_volumes(months: int = REPORT_MONTHS) -> Columns:
+    """Monthly registrations per district, one column per month, from the cube"""
+    start = _window_start(date.today(), months)
+    parts = _on_all_shards("""
+        SELECT state, district, period_start, SUM(reg_count) AS registrations
+        FROM registration_cube
+        WHERE grain = 'month' AND period_start >= %s
+        GROUP BY state, district, period_start
+    """, (start,))
+    month_labels = []
+    month = start
+    while month <= date.today():
+        month_labels.append(month.strftime('%Y-%m'))
+        month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+    table: Dict[tuple, Dict[str, int]] = {}
+    for part in parts:
+        for state, district, period, count in part.rows():
+            cells, label = table.setdefault((state, district), {}), period.strftime('%Y-%m')
+            cells[label] = cells.get(label, 0) + int(count)
+    keys = sorted(table)
+    data = [[k[0] for k in keys], [k[1] for k in keys]]
+    for label in month_labels:
+        data.append([table[k].get(label, 0) for k in keys])
+    data.append([sum(table[k].values()) for k in keys])
+    return Columns(['state', 'district'] + month_labels + ['total'], data)
+
+def inspection_outcomes(months: int = REPORT_MONTHS) -> Columns:
+    """Verified / approved / rejected decisions per district and their average turnaround"""
+    # Rates and averages are taken after adding up the shards' sums and counts
+    totals = _sum_by_district(_on_all_shards("""
+        SELECT state, district,
+               SUM(to_status = 'verified') AS verified,
+               SUM(to_status = 'approved') AS approved,
+               SUM(to_status = 'rejected') AS rejected,
+               SUM(duration_seconds) AS decision_seconds,
+               COUNT(duration_seconds) AS decisions_timed
+        FROM registration_status_history
+        WHERE to_status IN ('verified', 'approved', 'rejected') AND changed_at >= %s
+        GROUP BY state, district
+    """, (_window_start(date.today(), months),)))
+    keys = sorted(totals)
+    data = [[k[0] for k in keys], [k[1] for k in keys]]
+    for status in ('verified', 'approved', 'rejected'):
+        data.append([int(totals[k][status]) for k in keys])
+    decided = [totals[k]['approved'] + totals[k]['rejected'] for k in keys]
+    data.append([round(100 * totals[k]['approved'] / n, 1) if n else None for k, n in zip(keys, decided)])
+    data.append([round(totals[k]['decision_seconds'] / totals[k]['decisions_timed'] / 86400, 1)
+                 if totals[k]['decisions_timed'] else None for k in keys])
+    return Columns(['state', 'district', 'verified', 'approved', 'rejected',
+                    'approval_rate', 'avg_days_to_decision'], data)
+
+def pending_aging(months: int = REPORT_MONTHS) -> Columns:
+    """Open applications per district bucketed by days since application"""
+    buckets, labels = [], []
+    for low, high in AGING_BUCKETS:
+        label = f"{low}+ days" if high is None else f"{low}-{high} days"
+        condition = (f"DATEDIFF(CURDATE(), application_date) >= {low}" if high is None else
+                     f"DATEDIFF(CURDATE(), application_date) BETWEEN {low} AND {high}")
+        buckets.append(f"SUM({condition}) AS `{label}`")
+        labels.append(label)
+    totals = _sum_by_district(_on_all_shards(f"""
+        SELECT state, district, {', '.join(buckets)}, COUNT(*) AS total_open,
+               MAX(DATEDIFF(CURDATE(), application_date)) AS oldest_days
+        FROM registrations
+        WHERE status IN ('pending', 'verified')
+        GROUP BY state, district
+    """), maxima=('oldest_days',))
+    keys = sorted(totals, key=lambda k: -totals[k]['oldest_days'])
+    names = ['state', 'district'] + labels + ['total_open', 'oldest_days']
+    return Columns(names, [[k[0] for k in keys], [k[1] for k in keys]]
+                   + [[int(totals[k][name]) for k in keys] for name in names[2:]])
+
+BUILDERS = {
+    'district_volumes': district_volumes,
+    'inspection_outcomes': inspection_outcomes,
+    'pending_aging': pending_aging,
+}
+
+# --- Rendering ---
+def _chart_html(name: str, table: Columns) -> str:
+    """Plotly chart of the report, or nothing when plotly is not installed"""
+    try:
+        import plotly.graph_objects as go  # optional in the report workers
+    except ImportError:
+        return ''
+    if not len(table):
+        return ''
+    labels = [f"{d}, {s}" for s, d in zip(table['state'], table['district'])]
+    fig = go.Figure()
+    if name == 'district_volumes':
+        top = sorted(range(len(table)), key=lambda i: -table['total'][i])[:10]
+        months = table.names[2:-1]
+        for i in top:
+            fig.add_trace(go.Scatter(x=months, y=[table[m][i] for m in months],
+                                     mode='lines+markers', name=labels[i]))
+        fig.update_layout(title="Top 10 districts")
+    elif name == 'inspection_outcomes':
+        for status in ('verified', 'approved', 'rejected'):
+            fig.add_trace(go.Bar(x=labels, y=[int(v or 0) for v in table[status]], name=status))
+        fig.update_layout(barmode='stack')
+    else:
+        for bucket in table.names[2:2 + len(AGING_BUCKETS)]:
+            fig.add_trace(go.Bar(x=labels, y=[int(v or 0) for v in table[bucket]], name=bucket))
+        fig.update_layout(barmode='stack')
+    fig.update_layout(height=420, margin=dict(l=20, r=20, t=40, b=20))
+    return fig.to_html(include_plotlyjs='cdn', full_html=False)
+
+def render_html(name: str, table: Columns, generated_at: datetime) -> str:
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(REPORTS[name])}</title>
+<style>
+body {{ font-family: sans-serif; margin: 16px; }}
+table {{ border-collapse: collapse; font-size: 13px; }}
+th, td {{ border: 1px solid #cbd5e1; padding: 4px 8px; text-align: right; }}
+th {{ background: #f1f5f9; }}
+</style></head>
+<body>
+<h2>{html.escape(REPORTS[name])}</h2>
+<p>Generated {generated_at.strftime('%Y-%m-%d %H:%M')}</p>
+{_chart_html(name, table)}
+{table.to_html()}
+</body></html>
+"""
+
+def render_pdf(name: str, table: Columns, generated_at: datetime, path: str) -> bool:
+    """Write the table as a PDF; False when reportlab is not installed"""
+    try:
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import A4, landscape
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle
+    except ImportError:
+        return False
+    styles = getSampleStyleSheet()
+    grid = Table([table.names] + [['' if v is None else str(v) for v in row] for row in table.rows()],
+                 repeatRows=1)
+    grid.setStyle(TableStyle([
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+    ]))
+    SimpleDocTemplate(path, pagesize=landscape(A4)).build([
+        Paragraph(REPORTS[name], styles['Title']),
+        Paragraph(f"Generated {generated_at.strftime('%Y-%m-%d %H:%M')}", styles['Normal']),
+        grid,
+    ])
+    return True
+
+def _write_json(path: str, payload: dict):
+    """Replace a JSON file atomically so readers never see a partial manifest"""
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+def render_report(name: str, data_version: int, months: int = REPORT_MONTHS) -> dict:
+    """Build one report in this process and publish it as the latest version"""
+    table = BUILDERS[name](months)
+
+    generated_at = datetime.now()
+    version = generated_at.strftime('%Y%m%dT%H%M%S')
+    final_dir = os.path.join(REPORTS_DIR, name, version)
+    work_dir = final_dir + '.partial'
+    os.makedirs(work_dir, exist_ok=True)
+
+    files = ['report.html', 'report.csv']
+    with open(os.path.join(work_dir, 'report.html'), 'w', encoding='utf-8') as f:
+        f.write(render_html(name, table, generated_at))
+    with open(os.path.join(work_dir, 'report.csv'), 'w', encoding='utf-8', newline='') as f:
+        f.write(table.to_csv())
+    if render_pdf(name, table, generated_at, os.path.join(work_dir, 'report.pdf')):
+        files.append('report.pdf')
+
+    manifest = {'report': name, 'version': version, 'generated_at': generated_at.isoformat(),
+                'data_version': data_version, 'rows': len(table), 'files': files}
+    _write_json(os.path.join(work_dir, 'manifest.json'), manifest)
+    os.replace(work_dir, final_dir)
+    _write_json(os.path.join(REPORTS_DIR, name, 'latest.json'), manifest)
+    for old_version in list_versions(name)[KEEP_VERSIONS:]:
+        shutil.rmtree(os.path.join(REPORTS_DIR, name, old_version), ignore_errors=True)
+    return manifest
+
+# --- Reading ---
+def list_versions(name: str) -> List[str]:
+    """Published versions of a report, newest first"""
+    report_dir = os.path.join(REPORTS_DIR, name)
+    if not os.path.isdir(report_dir):
+        return []
+    return sorted((v for v in os.listdir(report_dir)
+                   if not v.endswith('.partial') and os.path.isdir(os.path.join(report_dir, v))),
+                  reverse=True)
+
+def load_manifest(name: str, version: Optional[str] = None) -> Optional[dict]:
+    """Manifest of a version, or of the latest one"""
+    path = (os.path.join(REPORTS_DIR, name, 'latest.json') if version is None
+            else os.path.join(REPORTS_DIR, name, version, 'manifest.json'))
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def read_artifact(name: str, version: str, filename: str) -> bytes:
+    with open(os.path.join(REPORTS_DIR, name, version, filename), 'rb') as f:
+        return f.read()
+
+# --- Scheduling ---
+def _history_mark(conn) -> int:
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COALESCE(MAX(history_id), 0) AS version FROM registration_status_history")
+        return int(cursor.fetchone()['version'])
+    finally:
+        cursor.close()
+
+def current_data_version() -> int:
+    """Sum of the shards' status-history high-water marks: moves on every submission and status change"""
+    return sum(scatter(_history_mark).values())
+
+def due_reports(data_version: int, force: bool = False) -> List[str]:
+    """Reports whose latest version is missing, behind the data or too old"""
+    due = []
+    for name in REPORTS:
+        manifest = load_manifest(name)
+        if (force or manifest is None or manifest['data_version'] != data_version
+                or time.time() - datetime.fromisoformat(manifest['generated_at']).timestamp() > REFRESH_AFTER):
+            due.append(name)
+    return due
+
+def render_due(pool: ProcessPoolExecutor, force: bool = False) -> List[dict]:
+    data_version = current_data_version()
+    futures = {pool.submit(render_report, name, data_version): name for name in due_reports(data_version, force)}
+    manifests = []
+    for future in as_completed(futures):
+        try:
+            manifests.append(future.result())
+        except Exception as e:
+            print(f"{futures[future]}: failed: {e}")
+    return manifests
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render the inspector reports")
+    parser.add_argument('--workers', type=int, default=len(REPORTS))
+    parser.add_argument('--watch', action='store_true', help="keep checking for data changes")
+    parser.add_argument('--interval', type=int, default=300, help="seconds between checks with --watch")
+    parser.add_argument('--force', action='store_true', help="rebuild even if nothing changed")
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        force = args.force
+        while True:
+            for manifest in render_due(pool, force):
+                print(f"{manifest['report']}: version {manifest['version']} ({manifest['rows']} rows)")
+            force = False
+            if not args.watch:
+                break
+            time.sleep(args.interval)
@@ -0,0 +1,112 @@
+"""Compact result handling for large listings and exports.
+
+Queries here run on plain tuple cursors instead of DictCursor, so no
+per-row dict is built. Results come back either as slotted record tuples
+(attribute access, no per-row __dict__) or as columns (one list per
+column). Columns render straight to HTML or CSV, or to an Arrow table
+when pyarrow is installed, without going through a DataFrame.
+"""
+import csv
+import html
+import io
+from collections import namedtuple
+from functools import lru_cache
+from typing import Optional, Dict, List, Callable, Iterable, Sequence, Tuple
+
+import pymysql
+
+FETCH_CHUNK = 5000
+
+
+@lru_cache(maxsize=256)
+def record_type(fields: Tuple[str, ...]):
+    """Tuple-backed record class with __slots__ = () for a column list"""
+    base = namedtuple('Record', fields)
+    return type('Record', (base,), {'__slots__': ()})
+
+def _field_names(cursor) -> Tuple[str, ...]:
+    return tuple(column[0] for column in cursor.description)
+
+def fetch_records(conn, query: str, params: Sequence = (), stream: bool = False) -> List[tuple]:
+    """Rows as slotted records; stream=True reads unbuffered for very large results"""
+    cursor = conn.cursor(pymysql.cursors.SSCursor if stream else pymysql.cursors.Cursor)
+    try:
+        cursor.execute(query, params)
+        make = record_type(_field_names(cursor))._make
+        records = []
+        while True:
+            chunk = cursor.fetchmany(FETCH_CHUNK)
+            if not chunk:
+                return records
+            records.extend(map(make, chunk))
+    finally:
+        cursor.close()
+
+
+class Columns:
+    """Column-oriented result: names plus one list per column"""
+
+    __slots__ = ('names', 'data')
+
+    def __init__(self, names: Sequence[str], data: List[list]):
+        self.names = list(names)
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data[0]) if self.data else 0
+
+    def __getitem__(self, name: str) -> list:
+        return self.data[self.names.index(name)]
+
+    def drop(self, *names: str) -> 'Columns':
+        keep = [i for i, name in enumerate(self.names) if name not in names]
+        return Columns([self.names[i] for i in keep], [self.data[i] for i in keep])
+
+    def head(self, n: int) -> 'Columns':
+        return Columns(self.names, [column[:n] for column in self.data])
+
+    def rows(self) -> Iterable[tuple]:
+        return zip(*self.data)
+
+    def to_csv(self) -> str:
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(self.names)
+        writer.writerows(self.rows())
+        return out.getvalue()
+
+    def to_html(self, formatters: Optional[Dict[str, Callable]] = None) -> str:
+        """HTML table; values are escaped unless a formatter renders the column"""
+        formatters = formatters or {}
+        cells = []
+        for name, values in zip(self.names, self.data):
+            formatter = formatters.get(name)
+            if formatter:
+                cells.append([formatter(v) for v in values])
+            else:
+                cells.append(['' if v is None else html.escape(str(v)) for v in values])
+        head = ''.join(f"<th>{html.escape(name)}</th>" for name in self.names)
+        body = ''.join(f"<tr>{''.join(f'<td>{c}</td>' for c in row)}</tr>" for row in zip(*cells))
+        return (f'<table border="1" class="dataframe"><thead><tr>{head}</tr></thead>'
+                f'<tbody>{body}</tbody></table>')
+
+    def to_arrow(self):
+        """pyarrow.Table of the columns (needs pyarrow)"""
+        import pyarrow as pa  # optional dependency
+        return pa.table(dict(zip(self.names, self.data)))
+
+def fetch_columns(conn, query: str, params: Sequence = (), stream: bool = False) -> Columns:
+    """Rows transposed into per-column lists, chunk by chunk"""
+    cursor = conn.cursor(pymysql.cursors.SSCursor if stream else pymysql.cursors.Cursor)
+    try:
+        cursor.execute(query, params)
+        names = _field_names(cursor)
+        data = [[] for _ in names]
+        while True:
+            chunk = cursor.fetchmany(FETCH_CHUNK)
+            if not chunk:
+                return Columns(names, data)
+            for column, values in zip(data, zip(*chunk)):
+                column.extend(values)
+    finally:
+        cursor.close()
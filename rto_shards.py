@@ -0,0 +1,807 @@
+"""Route registration data to database shards by state.
+
+Each shard is a complete RTO schema. It holds the registrations, vehicles,
+documents, status history and outbox rows of the states assigned to it.
+Users, API tokens, the vehicle catalog and the shard directory stay in the
+home database (RTO_DB_NAME). A shard keeps mirrored copies of the user rows
+its registrations refer to, without their password hashes.
+
+Shards are listed in RTO_SHARDS as name=database (on RTO_DB_HOST) or
+name=host:port/database. A local setup can therefore run several shards as
+schemas of one MySQL server:
+
+    RTO_SHARDS="north=rto_north,south=rto_south,west=db2.internal:3306/rto_west"
+
+Without RTO_SHARDS the home database is the only shard, named 'home'. To
+shard an existing installation, list the home database first so it keeps
+its registrations and ids, then move states off it.
+
+A state is routed by its state code: the first two letters, which also
+start every reg_no, so a reg_no finds its shard without a query. A new
+state code goes to the shard holding the fewest states. Each shard numbers
+its registrations from its own block of ID_BLOCK ids, so a registration_id
+is unique across shards and names the shard that issued it.
+
+Admin listings and dashboards send the same query to every shard in
+parallel and merge the results. Capacity grows by adding a shard to
+RTO_SHARDS and moving states onto it:
+
+    python rto_shards.py --init          # create the schema on every shard
+    python rto_shards.py --list          # states and registrations per shard
+    python rto_shards.py --move MH west  # move a state code to another shard
+
+A move makes the state read-only, copies its rows in batches, checks that
+nothing changed on the source meanwhile, repoints the directory and only
+then deletes the source rows. Moved registrations keep their reg_no but get
+new registration_ids from the target's block.
+
+vehicles' UNIQUE engine_no and chassis_no only hold within one shard, so
+submissions first claim the pair in the home database's vehicle_identity
+table (create_sharded_registration); a number in use on any shard is a
+DuplicateVehicle.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Dict, List, Tuple, Any, Callable, Iterable, Sequence
+
+import pymysql
+
+from rto_core import DB_HOST, DB_NAME, DB_PORT, DuplicateVehicle, WorkflowError, connect, create_registration
+from rto_rows import Columns, fetch_records, record_type
+from rto_status import normalize_reg_no
+
+HOME_SHARD = 'home'
+ID_BLOCK = 100_000_000  # registration_ids per shard; a signed INT leaves room for 21 shards
+DIRECTORY_TTL = 10      # seconds a process trusts its copy of the directory
+SCATTER_THREADS = 16
+MOVE_BATCH = 500
+CLAIM_GRACE = 24 * 3600  # seconds before a claim with no vehicle on any shard may be taken over
+MIRROR_TTL = 3600        # seconds a process trusts a user it mirrored to still be on the shard
+# User columns the shards' foreign keys and joins need; password hashes stay home
+MIRROR_COLUMNS = ('user_id', 'username', 'full_name', 'role', 'email', 'phone')
+NO_PASSWORD = '*'        # shard copies get a hash no password matches
+
+# Per-registration tables copied and deleted along with a state
+CHILD_TABLES = {
+    'registration_status_history': 'history_id',
+    'payments': 'payment_id',
+    'registration_documents': 'document_id',
+    'notification_outbox': 'outbox_id',
+}
+
+
+def parse_shards(spec: str) -> Dict[str, Tuple[str, int, str]]:
+    """RTO_SHARDS value as {name: (host, port, database)}, in the order listed"""
+    shards = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, target = entry.partition('=')
+        if not name.strip() or not target.strip():
+            raise ValueError(f"Shard entries look like name=database, got {entry!r}")
+        host, port = DB_HOST, DB_PORT
+        if '/' in target:
+            address, target = target.split('/', 1)
+            host, _, port_text = address.partition(':')
+            port = int(port_text or DB_PORT)
+        shards[name.strip()] = (host, port, target.strip())
+    return shards or {HOME_SHARD: (DB_HOST, DB_PORT, DB_NAME)}
+
+SHARDS = parse_shards(os.environ.get("RTO_SHARDS", ""))
+
+def is_home(shard: str) -> bool:
+    """Whether the shard is the home database itself"""
+    return SHARDS[shard] == (DB_HOST, DB_PORT, DB_NAME)
+
+def connect_shard(shard: str, cursorclass=pymysql.cursors.DictCursor):
+    """Open a new connection to one shard"""
+    host, port, database = SHARDS[shard]
+    return connect(database, cursorclass, host=host, port=port)
+
+@contextmanager
+def open_shard(shard: str):
+    """Short-lived shard connection, for tools and background jobs"""
+    conn = connect_shard(shard)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def state_code(state: str) -> str:
+    """Routing key of a state, the same code submit_registration puts in its reg_nos"""
+    return state[:2].upper()
+
+# --- Directory ---
+def ensure_directory(conn):
+    """Create the directory tables in the home database and register the configured shards"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS shards (
+                name VARCHAR(32) PRIMARY KEY,
+                id_base INT NOT NULL UNIQUE,
+                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS vehicle_identity (
+                identity_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                engine_no VARCHAR(50) NOT NULL UNIQUE,
+                chassis_no VARCHAR(50) NOT NULL UNIQUE,
+                owner_id INT,
+                idempotency_key VARCHAR(64),
+                claimed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS shard_directory (
+                state_code CHAR(2) PRIMARY KEY,
+                shard VARCHAR(32) NOT NULL,
+                read_only BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            )
+        """)
+        # Serialized so two replicas starting together don't race for the same block
+        cursor.execute("SELECT GET_LOCK('rto_shards', 30)")
+        try:
+            for name in SHARDS:
+                # Blocks are handed out in order and never reused
+                cursor.execute("""
+                    INSERT IGNORE INTO shards (name, id_base)
+                    SELECT %s, COALESCE(MAX(id_base) + %s, 0) FROM shards
+                """, (name, ID_BLOCK))
+            conn.commit()
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('rto_shards')")
+    finally:
+        cursor.close()
+
+def ensure_shards(conn, *ensure_functions: Callable):
+    """Set up every shard and claim the states whose registrations it already holds.
+
+    ensure_functions(shard_conn) create the shard schema; the home database
+    is left to the caller, which sets it up anyway.
+    """
+    ensure_directory(conn)
+    bases = _read_directory(conn)[1]
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM vehicle_identity LIMIT 1")
+        seed_identities = cursor.fetchone() is None
+    finally:
+        cursor.close()
+    for shard in SHARDS:
+        shard_conn = conn if is_home(shard) else connect_shard(shard)
+        try:
+            if shard_conn is not conn:
+                for ensure in ensure_functions:
+                    ensure(shard_conn)
+                _scrub_mirrored_passwords(shard_conn)
+            _start_id_block(shard_conn, shard, bases[shard])
+            _claim_existing_states(conn, shard_conn, shard)
+            if seed_identities:
+                _claim_existing_vehicles(conn, shard_conn)
+        finally:
+            if shard_conn is not conn:
+                shard_conn.close()
+    _reset_directory()
+
+def _start_id_block(conn, shard: str, base: int):
+    """Move a shard's registration_id counter into its block"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COALESCE(MAX(registration_id), 0) AS last_id FROM registrations")
+        last_id = cursor.fetchone()['last_id']
+        if last_id >= base + ID_BLOCK:
+            raise ValueError(f"Shard {shard} has used up its registration_id block")
+        if last_id < base:
+            cursor.execute(f"ALTER TABLE registrations AUTO_INCREMENT = {int(base) + 1}")
+    finally:
+        cursor.close()
+
+def _claim_existing_states(home, shard_conn, shard: str):
+    """Map the state codes a shard has issued reg_nos for to that shard"""
+    cursor = shard_conn.cursor()
+    try:
+        cursor.execute("SELECT DISTINCT state_code FROM registration_series")
+        codes = [row['state_code'] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+    if not codes:
+        return
+    cursor = home.cursor()
+    try:
+        cursor.executemany("INSERT IGNORE INTO shard_directory (state_code, shard) VALUES (%s, %s)",
+                           [(code, shard) for code in codes])
+        home.commit()
+    finally:
+        cursor.close()
+
+def _scrub_mirrored_passwords(shard_conn):
+    """Drop password hashes that earlier versions copied to a shard along with its users"""
+    cursor = shard_conn.cursor()
+    try:
+        cursor.execute("UPDATE users SET password_hash = %s WHERE password_hash <> %s",
+                       (NO_PASSWORD, NO_PASSWORD))
+        shard_conn.commit()
+    finally:
+        cursor.close()
+
+def _claim_existing_vehicles(home, shard_conn):
+    """Record a shard's engine and chassis numbers in vehicle_identity.
+
+    Pairs already used on another shard are skipped; those duplicates
+    predate the global check and have to be resolved by hand.
+    """
+    last_id = 0
+    src = shard_conn.cursor(pymysql.cursors.DictCursor)
+    dst = home.cursor()
+    try:
+        while True:
+            src.execute("""
+                SELECT vehicle_id, engine_no, chassis_no FROM vehicles
+                WHERE vehicle_id > %s ORDER BY vehicle_id LIMIT %s
+            """, (last_id, MOVE_BATCH))
+            rows = src.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1]['vehicle_id']
+            dst.executemany("INSERT IGNORE INTO vehicle_identity (engine_no, chassis_no) VALUES (%s, %s)",
+                            [(row['engine_no'], row['chassis_no']) for row in rows])
+            home.commit()
+    finally:
+        src.close()
+        dst.close()
+
+def _read_directory(conn) -> Tuple[Dict[str, Tuple[str, bool]], Dict[str, int]]:
+    """({state_code: (shard, read_only)}, {shard: id_base}) as stored in the home database"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT state_code, shard, read_only FROM shard_directory")
+        states = {row['state_code']: (row['shard'], bool(row['read_only'])) for row in cursor.fetchall()}
+        cursor.execute("SELECT name, id_base FROM shards")
+        bases = {row['name']: row['id_base'] for row in cursor.fetchall()}
+        return states, bases
+    finally:
+        cursor.close()
+
+# Process-wide copy of the directory: (states, id bases, monotonic load time)
+_directory: Tuple[Dict[str, Tuple[str, bool]], Dict[str, int], float] = ({}, {}, float('-inf'))
+_directory_lock = threading.Lock()
+
+def _reset_directory():
+    global _directory
+    _directory = ({}, {}, float('-inf'))
+
+def _current_directory(force: bool = False) -> Tuple[Dict[str, Tuple[str, bool]], Dict[str, int]]:
+    """The directory, reloaded on its own connection every DIRECTORY_TTL seconds"""
+    global _directory
+    states, bases, loaded_at = _directory
+    if not force and time.monotonic() - loaded_at < DIRECTORY_TTL:
+        return states, bases
+    with _directory_lock:
+        states, bases, loaded_at = _directory
+        if force or time.monotonic() - loaded_at >= DIRECTORY_TTL:
+            # A connection of its own, so the read never sees a caller's old snapshot
+            conn = connect()
+            try:
+                states, bases = _read_directory(conn)
+            finally:
+                conn.close()
+            _directory = (states, bases, time.monotonic())
+    return states, bases
+
+def _assign_state(code: str) -> str:
+    """Place a state code nobody has used yet on the shard with the fewest states"""
+    states, _ = _current_directory(force=True)
+    if code not in states:
+        load = Counter(shard for shard, _ in states.values())
+        shard = min(SHARDS, key=lambda name: load[name])
+        conn = connect()
+        try:
+            cursor = conn.cursor()
+            try:
+                # Another process may win the race; whichever row lands is the answer
+                cursor.execute("INSERT IGNORE INTO shard_directory (state_code, shard) VALUES (%s, %s)",
+                               (code, shard))
+                conn.commit()
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+        states, _ = _current_directory(force=True)
+    return states[code][0]
+
+def _route(code: str, write: bool) -> Optional[str]:
+    entry = _current_directory()[0].get(code)
+    if entry is None:
+        return None
+    shard, read_only = entry
+    if write and read_only:
+        raise WorkflowError("Registrations of this state are being moved, please try again in a few minutes.")
+    return shard
+
+# --- Routing ---
+def shard_for_state(state: str, write: bool = False) -> str:
+    """Shard holding a state's registrations; write=True refuses states that are being moved"""
+    code = state_code(state)
+    return _route(code, write) or _assign_state(code)
+
+def shard_for_reg_no(reg_no: str, write: bool = False) -> Optional[str]:
+    """Shard a reg_no was issued by, or None for a state code no shard has"""
+    return _route(state_code(normalize_reg_no(reg_no)), write)
+
+def shard_for_registration(registration_id: int) -> Optional[str]:
+    """Shard whose id block contains registration_id"""
+    for shard, base in _current_directory()[1].items():
+        if base < registration_id <= base + ID_BLOCK and shard in SHARDS:
+            return shard
+    return None
+
+_mirrored: Dict[Tuple[str, int], float] = {}  # (shard, user_id) -> when this process mirrored it
+_mirrored_lock = threading.Lock()
+
+def mirror_users(home_conn, shard: str, shard_conn, user_ids: Iterable[Optional[int]]):
+    """Copy the MIRROR_COLUMNS of user rows from the home database to a shard.
+
+    A process copies each user to each shard once per MIRROR_TTL, so most
+    submissions and status changes cost no extra round trip.
+    """
+    if is_home(shard):
+        return
+    now = time.monotonic()
+    with _mirrored_lock:
+        ids = sorted({user_id for user_id in user_ids if user_id is not None
+                      and now - _mirrored.get((shard, user_id), float('-inf')) >= MIRROR_TTL})
+    if not ids:
+        return
+    cursor = home_conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        cursor.execute(f"SELECT {', '.join(MIRROR_COLUMNS)} FROM users "
+                       f"WHERE user_id IN ({', '.join(['%s'] * len(ids))})", ids)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if rows:
+        cursor = shard_conn.cursor()
+        try:
+            # user_id is updated too: it replaces the default admin the shard seeded for itself
+            cursor.executemany(f"""
+                INSERT INTO users ({', '.join(MIRROR_COLUMNS)}, password_hash)
+                VALUES ({', '.join(['%s'] * len(MIRROR_COLUMNS))}, %s)
+                ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in MIRROR_COLUMNS)},
+                    password_hash = VALUES(password_hash)
+            """, [[row[c] for c in MIRROR_COLUMNS] + [NO_PASSWORD] for row in rows])
+            shard_conn.commit()
+        finally:
+            cursor.close()
+    with _mirrored_lock:
+        for user_id in ids:
+            _mirrored[shard, user_id] = now
+
+# --- Vehicle Identity ---
+def _has_vehicle(conn, engine_no: str, chassis_no: str) -> bool:
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1 FROM vehicles WHERE engine_no = %s OR chassis_no = %s LIMIT 1",
+                       (engine_no, chassis_no))
+        return cursor.fetchone() is not None
+    finally:
+        cursor.close()
+
+def claim_vehicle(home_conn, engine_no: str, chassis_no: str, owner_id: int,
+                  idempotency_key: Optional[str] = None):
+    """Reserve an engine and chassis number for a submission across every shard.
+
+    A retry of the same submission (same owner and idempotency key) finds
+    its own claim and goes ahead. A claim older than CLAIM_GRACE with no
+    vehicle behind it on any shard, left by a submission that never reached
+    its shard, is taken over. Anything else raises DuplicateVehicle.
+    """
+    cursor = home_conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        for _ in range(2):
+            try:
+                cursor.execute("""
+                    INSERT INTO vehicle_identity (engine_no, chassis_no, owner_id, idempotency_key)
+                    VALUES (%s, %s, %s, %s)
+                """, (engine_no, chassis_no, owner_id, idempotency_key))
+                home_conn.commit()
+                return
+            except pymysql.IntegrityError:
+                home_conn.rollback()
+            cursor.execute("""
+                SELECT identity_id, engine_no = %s AND chassis_no = %s AND owner_id <=> %s
+                           AND idempotency_key IS NOT NULL AND idempotency_key = %s AS own,
+                       claimed_at < NOW() - INTERVAL %s SECOND AS stale
+                FROM vehicle_identity
+                WHERE engine_no = %s OR chassis_no = %s
+            """, (engine_no, chassis_no, owner_id, idempotency_key, CLAIM_GRACE, engine_no, chassis_no))
+            claims = cursor.fetchall()
+            if len(claims) == 1 and claims[0]['own']:
+                return
+            if not claims or not all(claim['stale'] for claim in claims) \
+                    or any(scatter(lambda conn: _has_vehicle(conn, engine_no, chassis_no)).values()):
+                break
+            cursor.execute(f"DELETE FROM vehicle_identity WHERE identity_id IN ({', '.join(['%s'] * len(claims))})",
+                           [claim['identity_id'] for claim in claims])
+            home_conn.commit()
+    finally:
+        cursor.close()
+    raise DuplicateVehicle("Engine or Chassis number already exists!")
+
+def release_vehicle(home_conn, engine_no: str, chassis_no: str, owner_id: int,
+                    idempotency_key: Optional[str] = None):
+    """Drop a submission's claim after the shard refused the submission"""
+    cursor = home_conn.cursor()
+    try:
+        cursor.execute("""
+            DELETE FROM vehicle_identity
+            WHERE engine_no = %s AND chassis_no = %s AND owner_id <=> %s AND idempotency_key <=> %s
+        """, (engine_no, chassis_no, owner_id, idempotency_key))
+        home_conn.commit()
+    finally:
+        cursor.close()
+
+def create_sharded_registration(home_conn, shard_conn, vehicle_data: dict, owner_id: int,
+                                idempotency_key: Optional[str] = None) -> str:
+    """create_registration on the state's shard, with the vehicle claimed in the home database first.
+
+    The claim stays if the shard could not be reached, so a retry or spool
+    replay with the same idempotency key can use it.
+    """
+    claim = (vehicle_data['engine_no'], vehicle_data['chassis_no'], owner_id, idempotency_key)
+    claim_vehicle(home_conn, *claim)
+    try:
+        return create_registration(shard_conn, vehicle_data, owner_id, idempotency_key)
+    except WorkflowError:
+        release_vehicle(home_conn, *claim)
+        raise
+
+# --- Scatter-Gather ---
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def scatter(fn: Callable, shards: Optional[Sequence[str]] = None,
+            open_conn: Callable = open_shard, pass_shard: bool = False) -> Dict[str, Any]:
+    """fn(conn) on every shard in parallel, as {shard: result} in shard order.
+
+    open_conn(shard) is a context manager yielding the connection to use;
+    pass_shard=True calls fn(conn, shard) instead. If any shard fails, the
+    first error is raised after all have finished.
+    """
+    global _executor
+    shards = list(shards or SHARDS)
+
+    def run(shard):
+        with open_conn(shard) as conn:
+            return fn(conn, shard) if pass_shard else fn(conn)
+
+    if len(shards) == 1:
+        return {shards[0]: run(shards[0])}
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SCATTER_THREADS, thread_name_prefix='scatter')
+    futures = {shard: _executor.submit(run, shard) for shard in shards}
+    errors = [future.exception() for future in futures.values()]
+    for error in errors:
+        if error is not None:
+            raise error
+    return {shard: future.result() for shard, future in futures.items()}
+
+def merge_sorted(parts: Iterable[List], key: Callable, reverse: bool = False,
+                 limit: Optional[int] = None) -> List:
+    """Merge per-shard lists that are each already sorted by key"""
+    merged = heapq.merge(*parts, key=key, reverse=reverse)
+    return list(itertools.islice(merged, limit)) if limit else list(merged)
+
+def merge_counts(parts: Iterable[List[Dict]], keys: Sequence[str], count: str = 'count') -> List[Dict]:
+    """Per-shard GROUP BY rows with the same keys summed into one row, ordered by the keys"""
+    totals: Dict[tuple, Dict] = {}
+    for rows in parts:
+        for row in rows:
+            group = tuple(row[key] for key in keys)
+            if group in totals:
+                totals[group][count] += row[count]
+            else:
+                totals[group] = dict(row)
+    return [totals[group] for group in sorted(totals, key=lambda g: [(v is None, v) for v in g])]
+
+def merge_columns(parts: List[Columns], order_by: Optional[str] = None, reverse: bool = False,
+                  limit: Optional[int] = None) -> Columns:
+    """Per-shard Columns combined into one: merged by order_by (each part sorted by it)
+    or, without order_by, one shard after the other"""
+    names = next((part.names for part in parts if part.names), [])
+    if order_by is None or not names:
+        rows = [row for part in parts for row in part.rows()][:limit]
+    else:
+        index = names.index(order_by)
+        rows = merge_sorted([list(part.rows()) for part in parts if len(part)],
+                            key=lambda row: row[index], reverse=reverse, limit=limit)
+    return Columns(names, [list(column) for column in zip(*rows)] if rows else [[] for _ in names])
+
+def gather_records(query: str, params: Sequence = (), key: Optional[Callable] = None,
+                   reverse: bool = False, limit: Optional[int] = None,
+                   open_conn: Callable = open_shard) -> List[tuple]:
+    """A listing query run on every shard, as records with an extra 'shard' field.
+
+    Each shard's rows must already be ordered by key; they are merged
+    by it and cut to limit.
+    """
+    parts = []
+    for shard, records in scatter(lambda conn: fetch_records(conn, query, params),
+                                  open_conn=open_conn).items():
+        if records:
+            make = record_type(records[0]._fields + ('shard',))._make
+            parts.append([make((*record, shard)) for record in records])
+    if key is None:
+        return [record for part in parts for record in part][:limit]
+    return merge_sorted(parts, key, reverse, limit)
+
+# --- Rebalancing ---
+def _state_filter(code: str) -> str:
+    """reg_no prefix pattern of a state code; served by the unique reg_no index"""
+    return code.replace('%', '').replace('_', '') + '%'
+
+def _fingerprint(conn, code: str) -> Tuple[int, int]:
+    """Row count and checksum of a state's registrations, to notice changes during a move"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT COUNT(*) AS row_count,
+                   COALESCE(SUM(CRC32(CONCAT_WS('|', reg_no, status, status_updated_at, remarks))), 0)
+                       AS checksum
+            FROM registrations WHERE reg_no LIKE %s
+        """, (_state_filter(code),))
+        row = cursor.fetchone()
+        return int(row['row_count']), int(row['checksum'])
+    finally:
+        cursor.close()
+
+def _select_in(cursor, table: str, column: str, values: List) -> List[Dict]:
+    if not values:
+        return []
+    cursor.execute(f"SELECT * FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(values))})", values)
+    return cursor.fetchall()
+
+def _insert_rows(cursor, table: str, rows: List[Dict], skip: Optional[str] = None,
+                 ignore: bool = False):
+    """Insert dict rows into table, leaving out the skip column (its own id)"""
+    if not rows:
+        return
+    columns = [column for column in rows[0] if column != skip]
+    cursor.executemany(f"""
+        INSERT {'IGNORE ' if ignore else ''}INTO {table} ({', '.join(columns)})
+        VALUES ({', '.join(['%s'] * len(columns))})
+    """, [[row[column] for column in columns] for row in rows])
+
+def _copy_batch(source, target, target_shard: str, registrations: List[Dict]):
+    """Copy a batch of registrations and everything hanging off them to the target"""
+    src = source.cursor()
+    dst = target.cursor()
+    try:
+        old_ids = [row['registration_id'] for row in registrations]
+        user_ids = {row['owner_id'] for row in registrations} | {row['status_updated_by'] for row in registrations}
+        mirror_users(source, target_shard, target, user_ids)
+
+        vehicles = _select_in(src, 'vehicles', 'vehicle_id', [row['vehicle_id'] for row in registrations])
+        _insert_rows(dst, 'vehicles', vehicles, 'vehicle_id')
+        engine_ids = {row['engine_no']: row['vehicle_id'] for row in _select_in(
+            dst, 'vehicles', 'engine_no', [vehicle['engine_no'] for vehicle in vehicles])}
+        new_vehicle = {vehicle['vehicle_id']: engine_ids[vehicle['engine_no']] for vehicle in vehicles}
+
+        _insert_rows(dst, 'registrations',
+                     [dict(row, vehicle_id=new_vehicle.get(row['vehicle_id'])) for row in registrations],
+                     'registration_id')
+        new_id = {}
+        reg_nos = {row['reg_no']: row['registration_id'] for row in registrations}
+        for row in _select_in(dst, 'registrations', 'reg_no', list(reg_nos)):
+            new_id[reg_nos[row['reg_no']]] = row['registration_id']
+
+        # The insert trigger logged a fresh 'pending' entry; the copied history replaces it
+        placeholders = ', '.join(['%s'] * len(new_id))
+        dst.execute(f"DELETE FROM registration_status_history WHERE registration_id IN ({placeholders})",
+                    list(new_id.values()))
+        for table, id_column in CHILD_TABLES.items():
+            rows = _select_in(src, table, 'registration_id', old_ids)
+            if table == 'registration_documents':
+                blobs = sorted({row['sha256'] for row in rows})
+                _insert_rows(dst, 'document_blobs', _select_in(src, 'document_blobs', 'sha256', blobs),
+                             ignore=True)
+            _insert_rows(dst, table, [dict(row, registration_id=new_id[row['registration_id']])
+                                      for row in rows], id_column)
+        target.commit()
+    except Exception:
+        target.rollback()
+        raise
+    finally:
+        src.close()
+        dst.close()
+
+def _copy_state(source, target, target_shard: str, code: str) -> int:
+    """Copy a state's registrations in batches; returns how many were copied"""
+    copied = 0
+    after_id = 0
+    cursor = source.cursor()
+    try:
+        while True:
+            cursor.execute("""
+                SELECT * FROM registrations
+                WHERE reg_no LIKE %s AND registration_id > %s
+                ORDER BY registration_id
+                LIMIT %s
+            """, (_state_filter(code), after_id, MOVE_BATCH))
+            batch = cursor.fetchall()
+            if not batch:
+                break
+            _copy_batch(source, target, target_shard, batch)
+            copied += len(batch)
+            after_id = batch[-1]['registration_id']
+
+        # Counters and idempotency keys follow the state, so numbering and replays carry on
+        cursor.execute("SELECT * FROM registration_series WHERE state_code = %s", (code,))
+        series = cursor.fetchall()
+        cursor.execute("SELECT * FROM submission_keys WHERE reg_no LIKE %s", (_state_filter(code),))
+        keys = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    cursor = target.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO registration_series (state_code, series_year, last_number)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE last_number = GREATEST(last_number, VALUES(last_number))
+        """, [(row['state_code'], row['series_year'], row['last_number']) for row in series])
+        _insert_rows(cursor, 'submission_keys', keys, ignore=True)
+        target.commit()
+    finally:
+        cursor.close()
+    return copied
+
+def delete_state(conn, code: str) -> int:
+    """Delete a state's registrations and their dependent rows from one shard"""
+    deleted = 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            cursor.execute("""
+                SELECT registration_id, vehicle_id FROM registrations
+                WHERE reg_no LIKE %s ORDER BY registration_id LIMIT %s
+            """, (_state_filter(code), MOVE_BATCH))
+            batch = cursor.fetchall()
+            if not batch:
+                break
+            ids = [row['registration_id'] for row in batch]
+            placeholders = ', '.join(['%s'] * len(ids))
+            for table in CHILD_TABLES:
+                cursor.execute(f"DELETE FROM {table} WHERE registration_id IN ({placeholders})", ids)
+            cursor.execute(f"DELETE FROM registrations WHERE registration_id IN ({placeholders})", ids)
+            vehicle_ids = [row['vehicle_id'] for row in batch if row['vehicle_id'] is not None]
+            if vehicle_ids:
+                cursor.execute(f"DELETE FROM vehicles WHERE vehicle_id IN ({', '.join(['%s'] * len(vehicle_ids))})",
+                               vehicle_ids)
+            conn.commit()
+            deleted += len(batch)
+
+        cursor.execute("DELETE FROM registration_series WHERE state_code = %s", (code,))
+        cursor.execute("DELETE FROM submission_keys WHERE reg_no LIKE %s", (_state_filter(code),))
+        # Sketches can't subtract samples; the shard that now has the history rebuilds them
+        cursor.execute("DELETE FROM sla_sketches WHERE UPPER(LEFT(state, 2)) = %s", (code,))
+        conn.commit()
+        return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _set_directory(conn, code: str, **changes):
+    cursor = conn.cursor()
+    try:
+        assignments = ', '.join(f"{column} = %s" for column in changes)
+        cursor.execute(f"UPDATE shard_directory SET {assignments} WHERE state_code = %s",
+                       [*changes.values(), code])
+        conn.commit()
+    finally:
+        cursor.close()
+
+def move_state(code: str, target: str, settle: float = DIRECTORY_TTL + 1) -> int:
+    """Move a state code to another shard; returns the number of registrations moved.
+
+    settle is how long every process needs to notice a directory change.
+    """
+    code = code.upper()
+    if target not in SHARDS:
+        raise ValueError(f"Unknown shard: {target}")
+    home = connect()
+    try:
+        ensure_directory(home)
+        states, _ = _read_directory(home)
+        if code not in states:
+            raise ValueError(f"No shard holds state code {code}")
+        source = states[code][0]
+        if source == target:
+            return 0
+        if SHARDS.get(source) == SHARDS[target]:
+            raise ValueError(f"Shards {source} and {target} are the same database")
+
+        _set_directory(home, code, read_only=True)
+        repointed = False
+        try:
+            time.sleep(settle)  # writers still holding the old directory finish first
+            with open_shard(source) as src, open_shard(target) as dst:
+                delete_state(dst, code)  # leftovers of an interrupted earlier move
+                before = _fingerprint(src, code)
+                moved = _copy_state(src, dst, target, code)
+                if _fingerprint(src, code) != before or _fingerprint(dst, code) != before:
+                    delete_state(dst, code)
+                    raise RuntimeError(f"{code} changed on {source} during the copy; nothing was moved")
+            _set_directory(home, code, shard=target, read_only=False)
+            repointed = True
+        finally:
+            if not repointed:
+                _set_directory(home, code, read_only=False)
+    finally:
+        home.close()
+
+    time.sleep(settle)  # readers routed by the old directory are done with the source
+    with open_shard(source) as src:
+        delete_state(src, code)
+    return moved
+
+def shard_summary() -> List[Dict]:
+    """Configured shards with their id block, state codes and registration count"""
+    home = connect()
+    try:
+        states, bases = _read_directory(home)
+    finally:
+        home.close()
+    counts = scatter(lambda conn: _count_registrations(conn))
+    return [{'shard': shard, 'database': '{}:{}/{}'.format(*SHARDS[shard]), 'id_base': bases.get(shard),
+             'states': sorted(code + ('*' if read_only else '') for code, (name, read_only) in states.items()
+                              if name == shard),
+             'registrations': counts[shard]}
+            for shard in SHARDS]
+
+def _count_registrations(conn) -> int:
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) AS total FROM registrations")
+        return cursor.fetchone()['total']
+    finally:
+        cursor.close()
+
+if __name__ == "__main__":
+    from rto_core import ensure_schema
+    from rto_cube import ensure_cube_schema
+    from rto_sla import ensure_sla_schema
+    from rto_documents import ensure_documents_schema
+
+    parser = argparse.ArgumentParser(description="Manage state shards")
+    parser.add_argument('--init', action='store_true', help="create the schema on every shard")
+    parser.add_argument('--list', action='store_true', help="show states and registrations per shard")
+    parser.add_argument('--move', nargs=2, metavar=('STATE_CODE', 'SHARD'),
+                        help="move a state code to another shard")
+    args = parser.parse_args()
+
+    if args.init:
+        conn = connect()
+        schema = (ensure_schema, ensure_cube_schema, ensure_sla_schema, ensure_documents_schema)
+        for ensure in schema:
+            ensure(conn)
+        ensure_shards(conn, *schema)
+        conn.close()
+        print(f"{len(SHARDS)} shards ready")
+    if args.move:
+        code, target = args.move
+        print(f"Moved {move_state(code, target)} registrations of {code.upper()} to {target}")
+    if args.list:
+        for entry in shard_summary():
+            print(f"{entry['shard']:<12} {entry['database']:<40} ids from {entry['id_base']}: "
+                  f"{entry['registrations']} registrations, states {' '.join(entry['states']) or '-'}")
@@ -0,0 +1,444 @@
+"""Processing-time SLA metrics built from the registration status history.
+
+Every status change is recorded in registration_status_history by triggers
+on registrations. refresh_sla_sketches() folds new history rows into
+mergeable quantile sketches, one per (status, state, district, month), so
+p50/p90/p99 turnaround for any slice is a merge of a few small sketches
+rather than a sort over every duration.
+
+The refresh runs as a background worker over every shard; the Analytics
+page only reads the sketches. --check compares the sketch with
+numpy.quantile on generated turnaround times, whole and merged from parts,
+and each shard's sketch sample counts with its folded history rows.
+
+    python rto_sla.py --watch --interval 60
+    python rto_sla.py --check
+"""
+import argparse
+import json
+import math
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Optional, Dict, List, Tuple
+
+from rto_core import ensure_object, lock_registrations
+
+OUTCOME_STATUSES = ('verified', 'approved', 'rejected')
+REFRESH_BATCH_SIZE = 5000
+LATE_COMMIT_GRACE = 3600  # seconds a history id below folded ones may still turn up (a slow transaction)
+
+HISTORY_TRIGGERS = {
+    'registrations_history_insert': ('TRIGGER', 'v1', """
+        CREATE TRIGGER registrations_history_insert AFTER INSERT ON registrations
+        FOR EACH ROW
+        INSERT INTO registration_status_history (registration_id, from_status, to_status,
+            changed_by, state, district, duration_seconds)
+        VALUES (NEW.registration_id, NULL, NEW.status, NEW.owner_id,
+            NEW.state, NEW.district, 0)
+    """),
+    'registrations_history_update': ('TRIGGER', 'v1', """
+        CREATE TRIGGER registrations_history_update AFTER UPDATE ON registrations
+        FOR EACH ROW
+        BEGIN
+            IF NOT (OLD.status <=> NEW.status) THEN
+                INSERT INTO registration_status_history (registration_id, from_status, to_status,
+                    changed_by, state, district, duration_seconds)
+                VALUES (NEW.registration_id, OLD.status, NEW.status, NEW.status_updated_by,
+                    NEW.state, NEW.district,
+                    GREATEST(TIMESTAMPDIFF(SECOND,
+                        COALESCE(NEW.created_at, NEW.application_date), NOW()), 0));
+            END IF;
+        END
+    """),
+}
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with bounded relative error (DDSketch-style).
+
+    Values fall into logarithmic buckets, so any quantile is returned within
+    relative_accuracy of the true value and two sketches merge by adding
+    their bucket counts.
+    """
+
+    __slots__ = ('relative_accuracy', 'gamma', '_log_gamma', 'zero_count', 'buckets', 'count')
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.zero_count = 0
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+
+    def add(self, value: float, count: int = 1):
+        if value <= 0:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+
+    def merge(self, other: 'QuantileSketch'):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_json(self) -> str:
+        return json.dumps({'a': self.relative_accuracy, 'z': self.zero_count, 'b': self.buckets},
+                          separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data: str) -> 'QuantileSketch':
+        raw = json.loads(data)
+        sketch = cls(raw['a'])
+        sketch.zero_count = raw['z']
+        sketch.buckets = {int(index): count for index, count in raw['b'].items()}
+        sketch.count = sketch.zero_count + sum(sketch.buckets.values())
+        return sketch
+
+# --- Schema ---
+def ensure_sla_schema(conn):
+    """Create the history and sketch tables plus the history triggers"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS registration_status_history (
+                history_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                registration_id INT NOT NULL,
+                from_status VARCHAR(10),
+                to_status VARCHAR(10) NOT NULL,
+                changed_by INT,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                state VARCHAR(50) NOT NULL,
+                district VARCHAR(50) NOT NULL,
+                duration_seconds INT NOT NULL,
+                INDEX idx_history_registration (registration_id, changed_at)
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sla_sketches (
+                to_status VARCHAR(10) NOT NULL,
+                state VARCHAR(50) NOT NULL,
+                district VARCHAR(50) NOT NULL,
+                period_month DATE NOT NULL,
+                sample_count INT NOT NULL,
+                sketch TEXT NOT NULL,
+                PRIMARY KEY (to_status, period_month, state, district)
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sla_refresh_state (
+                id TINYINT PRIMARY KEY,
+                last_history_id BIGINT NOT NULL
+            )
+        """)
+        cursor.execute("INSERT IGNORE INTO sla_refresh_state (id, last_history_id) VALUES (1, 0)")
+
+        # History ids above last_history_id that are already in the sketches
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sla_folded_history (
+                history_id BIGINT PRIMARY KEY,
+                folded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_folded_at (folded_at)
+            )
+        """)
+
+        cursor.execute("SELECT 1 FROM registration_status_history LIMIT 1")
+        new_history = not cursor.fetchone()
+
+        for name, (kind, version, ddl) in HISTORY_TRIGGERS.items():
+            ensure_object(cursor, kind, name, version, ddl)
+        conn.commit()
+
+        # Seed history once from the statuses registrations already have. The
+        # triggers exist by now, so registrations written since have history
+        # of their own, and the lock holds off the ones still being written.
+        if new_history:
+            lock_registrations(cursor)
+            cursor.execute("""
+                INSERT INTO registration_status_history (registration_id, from_status, to_status,
+                    changed_by, changed_at, state, district, duration_seconds)
+                SELECT registration_id, IF(status = 'pending', NULL, 'pending'), status,
+                       status_updated_by, COALESCE(status_updated_at, created_at), state, district,
+                       IF(status = 'pending' OR status_updated_at IS NULL, 0,
+                          GREATEST(TIMESTAMPDIFF(SECOND, COALESCE(created_at, application_date),
+                                                 status_updated_at), 0))
+                FROM registrations r
+                WHERE NOT EXISTS (SELECT 1 FROM registration_status_history h
+                                  WHERE h.registration_id = r.registration_id)
+            """)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+# --- Incremental Refresh ---
+def refresh_sla_sketches(conn, batch_size: int = REFRESH_BATCH_SIZE) -> int:
+    """Fold history rows not yet in the sketches into them; returns the status changes folded.
+
+    Auto-increment ids are handed out before their transactions commit, so
+    a slow transaction can commit an id below ones already folded. Every
+    row above last_history_id is therefore looked at until it is folded,
+    and sla_folded_history remembers which ones were. last_history_id only
+    moves past ids folded LATE_COMMIT_GRACE seconds ago.
+    """
+    consumed = 0
+    cursor = conn.cursor()
+    try:
+        while True:
+            # Locking the watermark row serialises concurrent refreshes
+            cursor.execute("SELECT last_history_id FROM sla_refresh_state WHERE id = 1 FOR UPDATE")
+            watermark = cursor.fetchone()['last_history_id']
+
+            cursor.execute("""
+                SELECT h.history_id, h.to_status, h.state, h.district, h.changed_at, h.duration_seconds
+                FROM registration_status_history h
+                LEFT JOIN sla_folded_history f ON f.history_id = h.history_id
+                WHERE h.history_id > %s AND f.history_id IS NULL
+                ORDER BY h.history_id
+                LIMIT %s
+            """, (watermark, batch_size))
+            rows = cursor.fetchall()
+
+            fresh: Dict[Tuple, QuantileSketch] = defaultdict(QuantileSketch)
+            outcomes = [row for row in rows if row['to_status'] in OUTCOME_STATUSES]
+            for row in outcomes:
+                month = row['changed_at'].date().replace(day=1)
+                fresh[(row['to_status'], row['state'], row['district'], month)].add(row['duration_seconds'])
+            if fresh:
+                _merge_into_table(cursor, fresh)
+            if rows:
+                cursor.executemany("INSERT INTO sla_folded_history (history_id) VALUES (%s)",
+                                   [(row['history_id'],) for row in rows])
+                consumed += len(outcomes)
+            if len(rows) < batch_size:
+                _advance_watermark(cursor, watermark)
+                conn.commit()
+                return consumed
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _advance_watermark(cursor, watermark: int):
+    """Move last_history_id past ids folded long enough ago that no lower id can still commit"""
+    cursor.execute("""
+        SELECT MAX(history_id) AS history_id FROM sla_folded_history
+        WHERE folded_at < NOW() - INTERVAL %s SECOND
+    """, (LATE_COMMIT_GRACE,))
+    settled = cursor.fetchone()['history_id']
+    if settled is None or settled <= watermark:
+        return
+    cursor.execute("UPDATE sla_refresh_state SET last_history_id = %s WHERE id = 1", (settled,))
+    cursor.execute("DELETE FROM sla_folded_history WHERE history_id <= %s", (settled,))
+
+def _merge_into_table(cursor, fresh: Dict[Tuple, QuantileSketch]):
+    """Merge new sketches with the stored ones for the same keys and upsert them"""
+    keys = list(fresh)
+    placeholders = ', '.join(['(%s, %s, %s, %s)'] * len(keys))
+    cursor.execute(f"""
+        SELECT to_status, state, district, period_month, sketch
+        FROM sla_sketches
+        WHERE (to_status, state, district, period_month) IN ({placeholders})
+        FOR UPDATE
+    """, [value for key in keys for value in key])
+    for row in cursor.fetchall():
+        key = (row['to_status'], row['state'], row['district'], row['period_month'])
+        fresh[key].merge(QuantileSketch.from_json(row['sketch']))
+
+    cursor.executemany("""
+        INSERT INTO sla_sketches (to_status, state, district, period_month, sample_count, sketch)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE sample_count = VALUES(sample_count), sketch = VALUES(sketch)
+    """, [(*key, sketch.count, sketch.to_json()) for key, sketch in fresh.items()])
+
+# --- Queries ---
+def load_sketches(conn, date_from: date, date_to: date,
+                  states: Optional[List[str]] = None,
+                  districts: Optional[List[str]] = None) -> List[Dict]:
+    """One database's sketch rows for the months overlapping [date_from, date_to]"""
+    query = """
+        SELECT to_status, state, district, period_month, sketch
+        FROM sla_sketches
+        WHERE period_month BETWEEN %s AND %s
+    """
+    params = [date_from.replace(day=1), date_to]
+    for column, values in (('state', states), ('district', districts)):
+        if values:
+            query += f" AND {column} IN ({', '.join(['%s'] * len(values))})"
+            params.extend(values)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def sla_percentiles(conn, date_from: date, date_to: date,
+                    states: Optional[List[str]] = None,
+                    districts: Optional[List[str]] = None,
+                    group_by: Optional[str] = None,
+                    quantiles: Tuple[float, ...] = (0.5, 0.9, 0.99)) -> List[Dict]:
+    """Turnaround percentiles in days per outcome status, optionally per state, district or month.
+
+    Months overlapping [date_from, date_to] are counted whole. conn may also
+    be a list of shard connections, whose sketches are merged.
+    """
+    return merge_percentiles([load_sketches(shard_conn, date_from, date_to, states, districts)
+                              for shard_conn in (conn if isinstance(conn, list) else [conn])],
+                             group_by, quantiles)
+
+def merge_percentiles(parts: List[List[Dict]], group_by: Optional[str] = None,
+                      quantiles: Tuple[float, ...] = (0.5, 0.9, 0.99)) -> List[Dict]:
+    """sla_percentiles from the load_sketches rows of one or more shards"""
+    if group_by not in (None, 'state', 'district', 'period_month'):
+        raise ValueError(f"Unknown grouping: {group_by}")
+
+    merged: Dict[Tuple, QuantileSketch] = {}
+    for row in (row for rows in parts for row in rows):
+        key = (row['to_status'], row[group_by] if group_by else None)
+        sketch = QuantileSketch.from_json(row['sketch'])
+        if key in merged:
+            merged[key].merge(sketch)
+        else:
+            merged[key] = sketch
+
+    results = []
+    for (status, group), sketch in sorted(merged.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+        result = {'status': status, 'samples': sketch.count}
+        if group_by:
+            result[group_by] = group
+        for q in quantiles:
+            value = sketch.quantile(q)
+            result[f"p{round(q * 100)}"] = None if value is None else value / 86400
+        results.append(result)
+    return results
+
+# --- Checks ---
+def check_sketch(samples: int = 20000, parts: int = 8, relative_accuracy: float = 0.01,
+                 seed: int = 7) -> List[str]:
+    """Compare sketch quantiles with numpy.quantile; returns the failures, empty when all pass.
+
+    Each distribution is checked whole and as a merge of parts sketches,
+    which must hold exactly the same buckets as the whole.
+    """
+    import numpy as np  # only the check needs NumPy
+
+    rng = np.random.default_rng(seed)
+    distributions = {
+        'lognormal': rng.lognormal(mean=12, sigma=1.2, size=samples),
+        'exponential': rng.exponential(scale=3 * 86400, size=samples),
+        'with zeros': np.where(rng.random(samples) < 0.2, 0, rng.uniform(60, 90 * 86400, samples)).round(),
+    }
+    failures = []
+    for name, values in distributions.items():
+        whole = QuantileSketch(relative_accuracy)
+        for value in values:
+            whole.add(float(value))
+        merged = QuantileSketch(relative_accuracy)
+        for chunk in np.array_split(values, parts):
+            part = QuantileSketch(relative_accuracy)
+            for value in chunk:
+                part.add(float(value))
+            merged.merge(QuantileSketch.from_json(part.to_json()))
+        if (merged.count, merged.zero_count, merged.buckets) != (whole.count, whole.zero_count, whole.buckets):
+            failures.append(f"{name}: merged sketch differs from the whole")
+        for q in (0.01, 0.25, 0.5, 0.9, 0.99, 0.999):
+            # The sketch answers with the value at rank floor(q * (n - 1)), numpy's 'lower' method
+            expected = float(np.quantile(values, q, method='lower'))
+            for label, sketch in (('whole', whole), ('merged', merged)):
+                got = sketch.quantile(q)
+                if abs(got - expected) > relative_accuracy * expected:
+                    failures.append(f"{name} {label} p{q * 100:g}: {got:.1f}, numpy {expected:.1f}")
+    return failures
+
+def check_counts(conn) -> List[str]:
+    """Compare the sketches' sample counts with the history rows folded into them; returns the gaps"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT to_status, SUM(sample_count) AS samples FROM sla_sketches GROUP BY to_status")
+        sketched = {row['to_status']: int(row['samples']) for row in cursor.fetchall()}
+        cursor.execute(f"""
+            SELECT h.to_status, COUNT(*) AS history_rows,
+                   SUM(h.history_id > s.last_history_id AND f.history_id IS NULL) AS unfolded
+            FROM registration_status_history h
+            JOIN sla_refresh_state s ON s.id = 1
+            LEFT JOIN sla_folded_history f ON f.history_id = h.history_id
+            WHERE h.to_status IN ({', '.join(['%s'] * len(OUTCOME_STATUSES))})
+            GROUP BY h.to_status
+        """, OUTCOME_STATUSES)
+        history = {row['to_status']: (int(row['history_rows']), int(row['unfolded'])) for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+    gaps = []
+    for status in OUTCOME_STATUSES:
+        rows, unfolded = history.get(status, (0, 0))
+        samples = sketched.get(status, 0)
+        if samples != rows - unfolded:
+            gaps.append(f"{status}: sketches hold {samples} samples, history has {rows - unfolded} folded rows "
+                        f"({rows - unfolded - samples:+d}; {unfolded} more not folded yet)")
+    return gaps
+
+# --- Command-Line Interface ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the SLA sketches current on every shard")
+    parser.add_argument('--watch', action='store_true', help="keep folding new status history in")
+    parser.add_argument('--interval', type=int, default=60, help="seconds between refreshes with --watch")
+    parser.add_argument('--check', action='store_true',
+                        help="compare the sketch with numpy.quantile and its counts with the history, then exit")
+    args = parser.parse_args()
+
+    from rto_shards import SHARDS, open_shard
+
+    if args.check:
+        problems = check_sketch()
+        for shard in SHARDS:
+            try:
+                with open_shard(shard) as db:
+                    problems += [f"{shard}: {gap}" for gap in check_counts(db)]
+            except Exception as e:
+                problems.append(f"{shard}: counts not checked: {e}")
+        for problem in problems:
+            print(problem)
+        print("SLA check failed" if problems else "Sketch quantiles and counts check out")
+        raise SystemExit(1 if problems else 0)
+
+    while True:
+        for shard in SHARDS:
+            try:
+                with open_shard(shard) as db:
+                    consumed = refresh_sla_sketches(db)
+            except Exception as e:
+                print(f"{shard}: refresh failed: {e}")
+                continue
+            if consumed:
+                print(f"{shard}: {consumed} status changes folded into the sketches")
+        if not args.watch:
+            break
+        time.sleep(args.interval)
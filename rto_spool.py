@@ -0,0 +1,368 @@
+"""Local spool for submissions and status changes made while MySQL is down.
+
+When the database cannot be reached, the app writes validated submissions
+and admin status changes to a SQLite file (WAL mode, synchronous=FULL) on
+the replica and hands back a provisional reference. A background thread
+replays the spool in order as soon as the database answers again:
+
+    submission     create_sharded_registration() with the original
+                   idempotency key, so an attempt that did commit before the
+                   outage is not registered twice, then its documents are
+                   attached
+    status change  update_registration_status() as the admin who made it
+    documents      attach_documents() for a registration that was saved
+                   but whose documents could not be linked at the time
+
+Every batch uses one connection per shard and mirrors all of its users in
+one statement. A submission whose engine or chassis number was registered
+in the meantime, on any shard, is marked 'conflict', and so is a status change whose
+registration has moved on. Both stay visible to their owner. Any other
+error is retried up to MAX_ATTEMPTS times and then marked 'failed'.
+
+    python rto_spool.py --status
+    python rto_spool.py --replay          # drain now instead of waiting for the app
+    python rto_spool.py --list conflict
+    python rto_spool.py --retry-failed
+
+Processes on one host can share RTO_SPOOL_PATH; claims keep them from
+replaying the same entry twice.
+"""
+import argparse
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, List, Callable, Tuple
+
+import pymysql
+
+from rto_admission import Overloaded
+from rto_catalog import canonicalize
+from rto_fees import with_fee
+from rto_core import (
+    DuplicateVehicle, WorkflowError, connect, update_registration_status
+)
+from rto_documents import DocumentError, attach_documents
+from rto_shards import (
+    connect_shard, create_sharded_registration, mirror_users, shard_for_reg_no, shard_for_state, state_code
+)
+
+SPOOL_PATH = os.environ.get(
+    "RTO_SPOOL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rto_spool.db')
+)
+REPLAY_BATCH = 200
+REPLAY_INTERVAL = 5.0  # seconds between replay attempts while the spool is not empty
+CLAIM_TIMEOUT = 300    # a claim older than this belongs to a process that died mid-replay
+MAX_ATTEMPTS = 20
+# Errors that mean "the database is not there", as opposed to a rejected operation
+UNAVAILABLE = (pymysql.OperationalError, pymysql.InterfaceError, Overloaded)
+STATES = ('queued', 'claimed', 'applied', 'conflict', 'failed')
+
+
+class Spool:
+    """Operations accepted while the database was unreachable, oldest first"""
+
+    def __init__(self, path: str = SPOOL_PATH):
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")  # an accepted submission must survive a crash
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS spooled_operations (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ref TEXT NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    actor_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_state ON spooled_operations (state, seq)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_actor ON spooled_operations (actor_id, seq)")
+
+    def _add(self, kind: str, actor_id: int, payload: Dict) -> str:
+        ref = f"TMP-{secrets.token_hex(4).upper()}"
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO spooled_operations (ref, kind, actor_id, payload, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (ref, kind, actor_id, json.dumps(payload), now, now))
+        return ref
+
+    def add_submission(self, vehicle_data: Dict, owner_id: int, idempotency_key: str,
+                       documents: Dict[str, Tuple[Dict, str]]) -> str:
+        """Spool a validated submission; returns its provisional reference"""
+        return self._add('submission', owner_id, {'vehicle_data': vehicle_data,
+                                                  'idempotency_key': idempotency_key,
+                                                  'documents': documents})
+
+    def add_status_change(self, registration_id: int, reg_no: str, status: str,
+                          actor_id: int, remarks: Optional[str] = None) -> str:
+        """Spool a status change made by actor_id; returns its reference"""
+        return self._add('status', actor_id, {'registration_id': registration_id, 'reg_no': reg_no,
+                                              'status': status, 'remarks': remarks})
+
+    def add_documents(self, reg_no: str, owner_id: int, documents: Dict[str, Tuple[Dict, str]]) -> str:
+        """Spool the document links of a saved registration; returns the entry's reference"""
+        return self._add('documents', owner_id, {'reg_no': reg_no, 'documents': documents})
+
+    def claim(self, limit: int = REPLAY_BATCH) -> List[Dict]:
+        """Take the oldest queued entries for replay, in order"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("""
+                    UPDATE spooled_operations SET state = 'queued', updated_at = ?
+                    WHERE state = 'claimed' AND updated_at < ?
+                """, (now, now - CLAIM_TIMEOUT))
+                rows = self._conn.execute("""
+                    SELECT seq, ref, kind, actor_id, payload, attempts FROM spooled_operations
+                    WHERE state = 'queued' ORDER BY seq LIMIT ?
+                """, (limit,)).fetchall()
+                self._conn.executemany(
+                    "UPDATE spooled_operations SET state = 'claimed', updated_at = ? WHERE seq = ?",
+                    [(now, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [{'seq': seq, 'ref': ref, 'kind': kind, 'actor_id': actor_id,
+                 'payload': json.loads(payload), 'attempts': attempts}
+                for seq, ref, kind, actor_id, payload, attempts in rows]
+
+    def finish(self, outcomes: List[Tuple[int, str, Optional[str], Optional[str], int]]):
+        """Record (seq, state, result, error, attempts) for a replayed batch in one transaction"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("""
+                    UPDATE spooled_operations
+                    SET state = ?, result = ?, error = ?, attempts = ?, updated_at = ?
+                    WHERE seq = ?
+                """, [(state, result, error, attempts, now, seq)
+                      for seq, state, result, error, attempts in outcomes])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def entries(self, state: Optional[str] = None, actor_id: Optional[int] = None,
+                limit: int = 50) -> List[Dict]:
+        """Most recent entries, optionally of one state and/or one actor"""
+        conditions, params = [], []
+        if state:
+            conditions.append("state = ?")
+            params.append(state)
+        if actor_id is not None:
+            conditions.append("actor_id = ?")
+            params.append(actor_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT ref, kind, actor_id, payload, state, attempts, result, error, created_at
+                FROM spooled_operations {where} ORDER BY seq DESC LIMIT ?
+            """, params + [limit]).fetchall()
+        return [{'ref': ref, 'kind': kind, 'actor_id': actor_id, 'payload': json.loads(payload),
+                 'state': state, 'attempts': attempts, 'result': result, 'error': error,
+                 'created_at': created_at}
+                for ref, kind, actor_id, payload, state, attempts, result, error, created_at in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """Entries per state"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM spooled_operations GROUP BY state"
+            ).fetchall()
+        return dict(rows)
+
+    def backlog(self) -> int:
+        """Entries not yet replayed"""
+        counts = self.counts()
+        return counts.get('queued', 0) + counts.get('claimed', 0)
+
+    def retry_failed(self) -> int:
+        """Queue failed entries again with a fresh set of attempts"""
+        with self._lock:
+            cursor = self._conn.execute("""
+                UPDATE spooled_operations SET state = 'queued', attempts = 0, updated_at = ?
+                WHERE state = 'failed'
+            """, (time.time(),))
+        return cursor.rowcount
+
+# --- Replay ---
+def _route(entry: Dict) -> Tuple[str, str]:
+    """(shard, state code) an entry has to be applied on"""
+    payload = entry['payload']
+    if entry['kind'] == 'submission':
+        state = payload['vehicle_data']['state']
+        return shard_for_state(state, write=True), state_code(state)
+    return shard_for_reg_no(payload['reg_no'], write=True), payload['reg_no'][:2].upper()
+
+def _apply(home, db, entry: Dict) -> Tuple[str, Optional[str], Optional[str]]:
+    """(state, result, error) of applying one entry on its shard connection"""
+    payload = entry['payload']
+    if entry['kind'] == 'submission':
+        # The catalog and fee schedule may have loaded or changed since the form was filled in
+        vehicle_data = with_fee(home, canonicalize(home, payload['vehicle_data']))
+        reg_no = create_sharded_registration(home, db, vehicle_data, entry['actor_id'],
+                                             payload['idempotency_key'])
+        documents = {doc_type: tuple(document) for doc_type, document in payload['documents'].items()}
+        attach_documents(db, reg_no, documents, entry['actor_id'])
+        return 'applied', reg_no, None
+    if entry['kind'] == 'documents':
+        documents = {doc_type: tuple(document) for doc_type, document in payload['documents'].items()}
+        attach_documents(db, payload['reg_no'], documents, entry['actor_id'])
+        return 'applied', payload['reg_no'], None
+    if update_registration_status(db, payload['registration_id'], payload['status'],
+                                  entry['actor_id'], payload['remarks']):
+        return 'applied', payload['reg_no'], None
+    return 'conflict', None, f"{payload['reg_no']} was already moved on; it could not be marked {payload['status']}"
+
+def replay(spool: Spool, batch_size: int = REPLAY_BATCH) -> List[Dict]:
+    """Apply one batch of spooled operations in order; returns the entries that reached a final state.
+
+    Stops at the first sign that the database is still unreachable and puts
+    the rest of the batch back in the queue. Entries of a state that is
+    read-only for a shard move wait, and so does everything after them in
+    that state, so each state's operations keep their order.
+    """
+    entries = spool.claim(batch_size)
+    if not entries:
+        return []
+    outcomes: Dict[int, Tuple] = {}
+    finished = []
+    home = None
+    shard_conns: Dict[str, object] = {}
+    held_states = set()
+    try:
+        home = connect()
+        routes = {}
+        for entry in entries:
+            try:
+                routes[entry['seq']] = _route(entry)
+            except WorkflowError:
+                routes[entry['seq']] = None  # read-only while its state moves shards
+
+        # One connection and one user mirror per shard for the whole batch
+        for shard in {route[0] for route in routes.values() if route}:
+            shard_conns[shard] = connect_shard(shard)
+            mirror_users(home, shard, shard_conns[shard],
+                         [entry['actor_id'] for entry in entries
+                          if routes[entry['seq']] and routes[entry['seq']][0] == shard])
+
+        for entry in entries:
+            route = routes[entry['seq']]
+            if route is None or route[1] in held_states:
+                if route:
+                    held_states.add(route[1])
+                continue
+            attempts = entry['attempts'] + 1
+            try:
+                state, result, error = _apply(home, shard_conns[route[0]], entry)
+            except DuplicateVehicle as e:
+                state, result, error = 'conflict', None, str(e)
+            except UNAVAILABLE:
+                raise
+            except Exception as e:
+                # Anything else counts as an attempt, so a bad entry ends up 'failed'
+                # instead of being claimed first forever and blocking the spool
+                shard_conns[route[0]].rollback()
+                state = 'failed' if attempts >= MAX_ATTEMPTS else 'queued'
+                result = None
+                error = str(e) if isinstance(e, (WorkflowError, DocumentError, pymysql.MySQLError)) \
+                    else f"{type(e).__name__}: {e}"
+                if state == 'queued':
+                    held_states.add(route[1])
+            outcomes[entry['seq']] = (entry['seq'], state, result, error, attempts)
+            if state != 'queued':
+                finished.append(dict(entry, state=state, result=result, error=error))
+    except UNAVAILABLE as e:
+        print(f"[spool] database unavailable, replay paused: {e}")
+    finally:
+        for db in [home] + list(shard_conns.values()):
+            if db is not None:
+                try:
+                    db.close()
+                except pymysql.MySQLError:
+                    pass
+        # Whatever was not reached goes back to the queue untouched
+        spool.finish(list(outcomes.values()) + [
+            (entry['seq'], 'queued', None, None, entry['attempts'])
+            for entry in entries if entry['seq'] not in outcomes
+        ])
+    return finished
+
+class Replayer:
+    """Background thread that drains the spool whenever the database answers"""
+
+    def __init__(self, spool: Spool, interval: float = REPLAY_INTERVAL,
+                 on_finished: Optional[Callable[[List[Dict]], None]] = None):
+        self.spool = spool
+        self.interval = interval
+        self.on_finished = on_finished  # called with the entries each batch settled
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="spool-replay", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            finished = []
+            try:
+                if self.spool.backlog():
+                    finished = replay(self.spool)
+                    if finished and self.on_finished:
+                        self.on_finished(finished)
+            except Exception as e:  # keep the thread alive; the entries stay queued
+                print(f"[spool] replay failed: {type(e).__name__}: {e}")
+            if not finished:
+                self._stop.wait(self.interval)
+
+# --- Command-Line Interface ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and replay the local submission spool")
+    parser.add_argument("--status", action="store_true", help="Entries per state")
+    parser.add_argument("--replay", action="store_true", help="Replay everything queued now")
+    parser.add_argument("--list", choices=STATES, metavar="STATE", help="Show the latest entries in a state")
+    parser.add_argument("--retry-failed", action="store_true", help="Queue failed entries again")
+    parser.add_argument("--path", default=SPOOL_PATH)
+    args = parser.parse_args()
+
+    spool = Spool(args.path)
+    if args.retry_failed:
+        print(f"Queued {spool.retry_failed()} failed entries again")
+    if args.replay:
+        total = 0
+        while True:
+            finished = replay(spool)
+            total += len(finished)
+            if not finished:
+                break
+        print(f"Settled {total} entries, {spool.backlog()} still queued")
+    if args.list:
+        for entry in spool.entries(args.list):
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['created_at']))
+            print(f"{entry['ref']}  {created}  {entry['kind']:<10} actor={entry['actor_id']} "
+                  f"result={entry['result'] or '-'}  {entry['error'] or ''}")
+    if args.status or not (args.replay or args.list or args.retry_failed):
+        for state, count in sorted(spool.counts().items()):
+            print(f"{state:<8} {count}")
@@ -0,0 +1,98 @@
+"""Public, unauthenticated registration status lookup.
+
+A lookup needs the reg_no plus the last characters of the chassis number.
+Results come from a unique-index point query behind the shared TTL cache.
+Unknown reg_nos are cached too, for a shorter time, and callers are
+throttled with a shared per-minute counter, so the lookup path never
+touches the admin-facing queries.
+
+Guessing the chassis suffix is also limited per reg_no: after
+FAILED_LOOKUPS_PER_HOUR wrong answers the reg_no cannot be looked up until
+the hour is over, whichever clients the guesses came from. Behind reverse
+proxies, set RTO_TRUSTED_PROXIES to their number so clients are told apart
+by the address the outermost proxy saw, not by a header they can forge.
+"""
+import hmac
+import os
+import time
+from typing import Optional, Dict
+
+from rto_cache import RateLimiter, get_cache
+
+CHASSIS_SUFFIX_LENGTH = 4
+POSITIVE_TTL = 15      # seconds a found registration is served from cache
+NEGATIVE_TTL = 30      # seconds an unknown reg_no is remembered as missing
+RATE_LIMIT_PER_MINUTE = 20
+FAILED_LOOKUPS_PER_HOUR = 10  # wrong chassis suffixes per reg_no before it is locked for the hour
+TRUSTED_PROXIES = int(os.environ.get("RTO_TRUSTED_PROXIES", "0"))  # proxy hops in front of the app/API
+
+rate_limiter = RateLimiter(get_cache(), 'status', RATE_LIMIT_PER_MINUTE)
+
+
+class LookupThrottled(Exception):
+    """Raised when a client exceeds the lookup rate limit"""
+
+
+def normalize_reg_no(reg_no: str) -> str:
+    return ''.join(reg_no.split()).upper()
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str] = None) -> Optional[str]:
+    """Caller address for rate limiting.
+
+    Without trusted proxies this is the peer address; X-Forwarded-For is
+    ignored since anyone can send it. With TRUSTED_PROXIES = n, it is the
+    address the outermost of the n proxies appended, the n-th from the right.
+    """
+    if TRUSTED_PROXIES and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if hops:
+            return hops[-min(TRUSTED_PROXIES, len(hops))]
+    return peer
+
+def _failures_key(reg_no: str) -> str:
+    return f"status:failures:{reg_no}:{int(time.time() // 3600)}"
+
+def _fetch(conn, reg_no: str) -> Optional[Dict]:
+    """Point query on the unique reg_no index"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT r.reg_no, r.status, r.application_date, r.registration_date,
+                   r.state, r.district, r.remarks, v.chassis_no
+            FROM registrations r
+            JOIN vehicles v ON r.vehicle_id = v.vehicle_id
+            WHERE r.reg_no = %s
+        """, (reg_no,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+def lookup_status(conn, reg_no: str, chassis_suffix: str, client: str) -> Optional[Dict]:
+    """Public status of a registration, or None if the reg_no/chassis pair does not match"""
+    if not rate_limiter.allow(client):
+        raise LookupThrottled("Too many lookups, please try again in a minute.")
+
+    reg_no = normalize_reg_no(reg_no)
+    chassis_suffix = chassis_suffix.strip().upper()
+    if not reg_no or len(chassis_suffix) < CHASSIS_SUFFIX_LENGTH:
+        return None
+
+    cache = get_cache()
+    if cache.incr(_failures_key(reg_no), 0, 3600) >= FAILED_LOOKUPS_PER_HOUR:
+        raise LookupThrottled("Too many failed attempts for this registration number, please try again later.")
+
+    cached = cache.get(f"status:{reg_no}")
+    if cached is None:
+        # Cached as a 1-tuple so a known-missing reg_no is distinguishable from a miss
+        cached = (_fetch(conn, reg_no),)
+        cache.set(f"status:{reg_no}", cached, POSITIVE_TTL if cached[0] else NEGATIVE_TTL)
+    record = cached[0]
+    expected = record['chassis_no'].upper()[-CHASSIS_SUFFIX_LENGTH:] if record else ''
+    if record is None or not hmac.compare_digest(expected, chassis_suffix[-CHASSIS_SUFFIX_LENGTH:]):
+        cache.incr(_failures_key(reg_no), 1, 3600)
+        return None
+    return {key: value for key, value in record.items() if key != 'chassis_no'}
+
+def invalidate_status(reg_no: str):
+    """Drop a cached lookup after the registration changes"""
+    get_cache().invalidate(f"status:{normalize_reg_no(reg_no)}")